@@ -3,6 +3,9 @@
 
 import keyboard
 from pylkmotor import LKMotor
+from pylkmotor.LKMotor import MotorGroup
+from procedures import motor_startup_sequence, shutdown_sequence, zero_position_sequence
+from sequence import Sequence, Step
 import time
 import math
 from collections import deque
@@ -218,30 +221,23 @@ def main():
     print("Start Motor Initialization")
     motor_Front = LKMotor(bus_interface="socketcan", bus_channel="can0", motor_id=1)
     motor_Rear = LKMotor(bus_interface="socketcan", bus_channel="can0", motor_id=2)
-    motor_Front.motor_shutdown()
-    motor_Rear.motor_shutdown()
-    motor_Front.motor_run()
-    motor_Rear.motor_run()
-    motor_status(motor_Front)
-    motor_status(motor_Rear)
-    print("Finished Motor Initialization")
-    time.sleep(1)
-
-    # Set the current position to 0
-    print("Set the current position to 0")
-    motor_Front.set_position_to_angle(0)
-    time.sleep(2)
-    motor_Rear.set_position_to_angle(0)
-    time.sleep(2)
-    print("set_position_to_angle 0 Finished")
-
-    print("Start Multi Turn Position Control")
-    motor_Front.multi_turn_position_control(angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(90))
-    time.sleep(2)
-    motor_Rear.multi_turn_position_control(angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(90))
-    time.sleep(2)
-    print("multi_turn_position_control Finished")
-
+    motors = MotorGroup([motor_Front, motor_Rear])
+
+    def stop_and_shut_down():
+        motors.motor_stop()
+        motors.motor_shutdown()
+
+    startup = Sequence(
+        motor_startup_sequence(motor_Front, motor_Rear, telemetry_hz=None).stages
+        + [Step("Motor status", lambda: (motor_status(motor_Front), motor_status(motor_Rear)))]
+        + zero_position_sequence(motor_Front, motor_Rear, max_speed=90, gear_ratio=gearBox_Ratio).stages,
+        # The combined sequence replaces the on_failure of zero_position_sequence
+        on_failure=stop_and_shut_down,
+    )
+    if not startup.run(unattended=True):
+        motor_Front.close()
+        motor_Rear.close()
+        return
     print("Finished Position Initialization")
 
     print("------------ Start Keyboard Control ------------")
@@ -256,36 +252,11 @@ def main():
     keyboard.wait('esc')
     print("Exiting...")
 
-    print("------------ Return to Middle Position ------------")
-    # Stop the motor
-    motor_Front.motor_stop()
-    motor_Rear.motor_stop()
-    print("Motor Stopped")
-    time.sleep(0.5)
+    print("------------ Return to Middle Position and Shutdown ------------")
+    shutdown_sequence(motor_Front, motor_Rear, max_speed=90, timeout=10, gear_ratio=gearBox_Ratio).run(unattended=True)
 
-    motor_Front.single_turn_position_control(spin_direction=0, angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(90))
-    motor_Rear.single_turn_position_control(spin_direction=0, angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(90))
-    
-    time_cycle_out = 0
-    while motor_Front.read_motor_status_2()[2] > 0.01 or motor_Rear.read_motor_status_2()[2] > 0.01:
-        print(f"Speed Front: {motor_Front.read_motor_status_2()[2]} deg/s")
-        print(f"Speed Rear: {motor_Rear.read_motor_status_2()[2]} deg/s")
-        time.sleep(0.1)
-        time_cycle_out += 1
-        print(f"Time cycle out: {time_cycle_out}")
-        if time_cycle_out == 100:
-            print("Wait Motor Stop Time Out!")
-            break
-
-    print("------------ Motor and CAN Shutdown ------------")
-    motor_Front.motor_stop()
-    motor_Rear.motor_stop()
-
-    motor_Front.motor_shutdown()
-    motor_Rear.motor_shutdown()
-
-    motor_Front.bus.shutdown()
-    motor_Rear.bus.shutdown()
+    motor_Front.close()
+    motor_Rear.close()
 
     print("------------ Thank you and Goodbye! ------------")
 
@@ -1,25 +1,574 @@
+import asyncio
 import can
+import contextlib
+import functools
+import itertools
+import json
+import os
+import queue
+import struct
+import threading
 import time
+from collections import deque, namedtuple
 from typing import Optional
 
+# Frame layouts of the LK CAN protocol: 8 data bytes, little-endian, DATA[0]
+# is the command byte. Command frames are packed into a reusable buffer and
+# replies are unpacked straight from `can.Message.data`.
+_NO_DATA = struct.Struct("<B7x")
+_RAW_DATA = struct.Struct("<B7s")
+_COMMAND_LAYOUTS = {
+    0x8C: struct.Struct("<BB6x"),  # control byte
+    0xA0: struct.Struct("<B3xh2x"),  # power control
+    0xA1: struct.Struct("<B3xh2x"),  # iq control
+    0xA2: struct.Struct("<Bxhi"),  # iq control, speed control
+    0xA3: struct.Struct("<B3xi"),  # angle control
+    0xA4: struct.Struct("<BxHi"),  # max speed, angle control
+    0xA5: struct.Struct("<BB2xI"),  # spin direction, angle control
+    0xA6: struct.Struct("<BBHI"),  # spin direction, max speed, angle control
+    0xA7: struct.Struct("<B3xi"),  # angle increment
+    0xA8: struct.Struct("<BxHi"),  # max speed, angle increment
+    0x95: struct.Struct("<B3xi"),  # multi-turn angle
+    0xC0: struct.Struct("<BB6x"),  # control parameter ID
+    0xC1: struct.Struct("<BB6s"),  # control parameter ID, parameter bytes
+}
+_STATUS_1_REPLY = struct.Struct("<xbhhBB")  # temperature, voltage, current, motor state, error state
+_STATUS_2_REPLY = struct.Struct("<xbhhH")  # temperature, iq, speed, encoder
+_STATUS_3_REPLY = struct.Struct("<xbhhh")  # temperature, phase A, B, C current
+_ENCODER_REPLY = struct.Struct("<2xHHH")  # encoder, encoder raw, encoder offset
+_ENCODER_OFFSET_REPLY = struct.Struct("<6xH")
+_BRAKE_REPLY = struct.Struct("<xB")
+_SINGLE_TURN_ANGLE_REPLY = struct.Struct("<4xI")
+# The multi-turn angle is an int56 in DATA[1:8]; an int64 over the whole
+# frame shifted right by the command byte gives it with the sign intact.
+_MULTI_TURN_ANGLE_REPLY = struct.Struct("<q")
+_MULTI_MOTOR_TORQUE = struct.Struct("<4h")
+_CONTROL_PARAM_REPLY = struct.Struct("<xB6s")  # control parameter ID, parameter bytes
+
+
+class CanBusManager:
+    """Shared CAN bus with a single receive thread
+
+    One manager is kept per (interface, channel). It owns the only
+    `can.interface.Bus` on that channel and one reader thread, which routes
+    every incoming frame by arbitration ID into a per-ID queue. Motors on the
+    same channel share the manager, so N motors cost one socket and one reader.
+
+    With kernel filters on (the default), the bus only delivers the
+    arbitration IDs that were asked for with `get_queue`. On SocketCAN the
+    filters run in the kernel (or in the CAN controller), so other traffic on
+    the bus never wakes up the Python reader. Turn them off to sniff the bus.
+
+    The reader counts every frame, the frames for IDs nobody has asked for
+    (unclaimed, e.g. other devices on the bus) and the frames dropped because
+    their queue was full.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, bus_interface, bus_channel, queue_size=64, kernel_filters=True, **kwargs):
+        """Open the bus and start the receive thread
+
+        Use `CanBusManager.acquire` instead of calling this directly, so that
+        motors on the same channel share one manager.
+
+        Args:
+            bus_interface (str or type): CAN bus interface, e.g. "socketcan",
+                "kvaser", "serial", or a `can.BusABC` subclass
+            bus_channel (str): CAN bus channel
+            queue_size (int, optional): Frames kept per arbitration ID. Defaults to 64.
+            kernel_filters (bool, optional): Only receive the arbitration IDs
+                asked for with `get_queue`. Defaults to True.
+            **kwargs: Additional arguments, e.g. baudrate, bitrate, etc.
+        """
+
+        self.bus_interface = bus_interface
+        self.bus_channel = bus_channel
+        if isinstance(bus_interface, str):
+            self.bus = can.interface.Bus(
+                interface=bus_interface, channel=bus_channel, **kwargs
+            )
+        else:
+            # A bus class python-can does not know, e.g. ReplayBus
+            self.bus = bus_interface(channel=bus_channel, **kwargs)
+
+        self._queue_size = queue_size
+        self._queues = {}
+        self._queues_lock = threading.Lock()
+        self._claimed_ids = set()
+        self.kernel_filters = kernel_filters
+        self._apply_filters()
+        self.frames_received = 0
+        self.frames_unclaimed = {}
+        self.frames_dropped = {}
+        self._ref_count = 0
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._receive_loop, name=f"can-rx-{bus_channel}", daemon=True
+        )
+        self._thread.start()
+
+    @classmethod
+    def acquire(cls, bus_interface, bus_channel, **kwargs):
+        """Get the shared manager for a channel, opening it if needed
+
+        Args:
+            bus_interface (str or type): CAN bus interface, or a `can.BusABC` subclass
+            bus_channel (str): CAN bus channel
+            **kwargs: Additional arguments, only used when the bus is opened
+
+        Returns:
+            CanBusManager: Shared manager for the channel
+        """
+
+        key = (bus_interface, bus_channel)
+        with cls._instances_lock:
+            manager = cls._instances.get(key)
+            if manager is None:
+                manager = cls(bus_interface, bus_channel, **kwargs)
+                cls._instances[key] = manager
+            manager._ref_count += 1
+        return manager
+
+    def release(self):
+        """Drop one reference, and shut down the bus after the last one"""
+
+        key = (self.bus_interface, self.bus_channel)
+        with CanBusManager._instances_lock:
+            self._ref_count -= 1
+            if self._ref_count > 0:
+                return
+            if CanBusManager._instances.get(key) is self:
+                del CanBusManager._instances[key]
+        self.shutdown()
+
+    def get_queue(self, arbitration_id):
+        """Get the receive queue for an arbitration ID
+
+        Frames that arrive before anyone asks for their queue are kept too,
+        so no reply is thrown away.
+
+        Args:
+            arbitration_id (int): Arbitration ID of the frames
+
+        Returns:
+            queue.Queue: Queue of `can.Message`
+        """
+
+        with self._queues_lock:
+            if arbitration_id not in self._claimed_ids:
+                self._claimed_ids.add(arbitration_id)
+                self._apply_filters()
+        return self._queue_for(arbitration_id)
+
+    def set_kernel_filters(self, enabled):
+        """Turn the receive filters on, or off to see every frame on the bus
+
+        Args:
+            enabled (bool): Only receive the arbitration IDs asked for with `get_queue`
+        """
+
+        with self._queues_lock:
+            self.kernel_filters = enabled
+            self._apply_filters()
+
+    def _apply_filters(self):
+        """Install a filter for every claimed arbitration ID on the bus"""
+
+        if not self.kernel_filters:
+            self.bus.set_filters(None)
+            return
+        # An exact match on each 11-bit ID. An empty list would turn filtering
+        # off, so with no ID claimed yet use a filter no LK motor frame matches.
+        self.bus.set_filters(
+            [
+                {"can_id": arbitration_id, "can_mask": 0x7FF, "extended": False}
+                for arbitration_id in sorted(self._claimed_ids)
+            ]
+            or [{"can_id": 0, "can_mask": 0x7FF, "extended": True}]
+        )
+
+    def _queue_for(self, arbitration_id):
+        """Get or create the receive queue for an arbitration ID"""
+
+        with self._queues_lock:
+            frame_queue = self._queues.get(arbitration_id)
+            if frame_queue is None:
+                frame_queue = queue.Queue(maxsize=self._queue_size)
+                self._queues[arbitration_id] = frame_queue
+        return frame_queue
+
+    def send(self, message):
+        """Send a frame on the shared bus
+
+        Args:
+            message (can.Message): Frame to be sent
+        """
+
+        self.bus.send(message)
+
+    def _receive_loop(self):
+        """Read every frame on the channel and route it by arbitration ID"""
+
+        while self._running:
+            try:
+                message = self.bus.recv(0.1)
+            except (can.CanError, OSError, ValueError):
+                if not self._running:
+                    break
+                time.sleep(0.1)
+                continue
+            if message is None:
+                continue
+            arbitration_id = message.arbitration_id
+            self.frames_received += 1
+            if arbitration_id not in self._claimed_ids:
+                self.frames_unclaimed[arbitration_id] = self.frames_unclaimed.get(arbitration_id, 0) + 1
+            frame_queue = self._queue_for(arbitration_id)
+            while True:
+                try:
+                    frame_queue.put_nowait(message)
+                    break
+                except queue.Full:
+                    # Nobody is reading this ID, keep only the newest frames
+                    self.frames_dropped[arbitration_id] = self.frames_dropped.get(arbitration_id, 0) + 1
+                    try:
+                        frame_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def shutdown(self):
+        """Stop the receive thread and shut down the bus"""
+
+        self._running = False
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self.bus.shutdown()
+
+
+class CommandStats:
+    """Counters and round-trip time histograms per command byte
+
+    Every `LKMotor` keeps one in `motor.stats`. For each command byte it counts:
+    - sent: command frames sent
+    - replies: matching replies received, with their round-trip time
+    - timeouts: replies that did not arrive in time
+    - retries: commands sent again after a failed attempt
+    - failures: commands that gave up after all retries
+    - stale: replies skipped because they answered an earlier command
+    """
+
+    # Upper edges of the round-trip time histogram in seconds, the last bucket is open
+    RTT_BUCKETS = (0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1)
+    COUNTERS = ("sent", "replies", "timeouts", "retries", "failures", "stale")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all counters and histograms"""
+
+        with self._lock:
+            self._commands = {}
+
+    def _entry(self, command_byte):
+        entry = self._commands.get(command_byte)
+        if entry is None:
+            entry = dict.fromkeys(self.COUNTERS, 0)
+            entry["rtt_histogram"] = [0] * (len(self.RTT_BUCKETS) + 1)
+            entry["rtt_sum"] = 0.0
+            entry["rtt_max"] = 0.0
+            self._commands[command_byte] = entry
+        return entry
+
+    def count(self, command_byte, counter):
+        """Add one to a counter of a command byte
+
+        Args:
+            command_byte (uint8_t): Command byte
+            counter (str): One of `COUNTERS`
+        """
+
+        with self._lock:
+            self._entry(command_byte)[counter] += 1
+
+    def record_reply(self, command_byte, rtt):
+        """Count a reply and add its round-trip time in seconds to the histogram"""
+
+        with self._lock:
+            entry = self._entry(command_byte)
+            entry["replies"] += 1
+            entry["rtt_sum"] += rtt
+            entry["rtt_max"] = max(entry["rtt_max"], rtt)
+            histogram = entry["rtt_histogram"]
+            for index, edge in enumerate(self.RTT_BUCKETS):
+                if rtt <= edge:
+                    histogram[index] += 1
+                    return
+            histogram[-1] += 1
+
+    def snapshot(self):
+        """Get a copy of the counters
+
+        Returns:
+            dict: Per command byte, the counters, "rtt_histogram" (counts per
+                bucket of `RTT_BUCKETS`, plus one open bucket), "rtt_sum" and
+                "rtt_max" in seconds
+        """
+
+        with self._lock:
+            return {
+                command_byte: dict(entry, rtt_histogram=list(entry["rtt_histogram"]))
+                for command_byte, entry in sorted(self._commands.items())
+            }
+
+
+class RttEstimator:
+    """Adaptive reply timeout from the measured round-trip time
+
+    The same estimator as TCP's retransmission timer (RFC 6298): a smoothed
+    RTT (SRTT) and its mean deviation (RTTVAR) give the timeout
+    SRTT + 4 * RTTVAR, clamped to [floor, ceiling]. Each timeout doubles the
+    current timeout until the next measured reply. Until the first reply the
+    timeout is the ceiling.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, floor=0.02, ceiling=0.1):
+        """Initialize the estimator
+
+        Args:
+            floor (float, optional): Shortest timeout in seconds. Defaults to 0.02.
+            ceiling (float, optional): Longest timeout in seconds. Defaults to 0.1.
+        """
+
+        self.floor = floor
+        self.ceiling = ceiling
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = ceiling
+
+    def _clamp(self, value):
+        return min(self.ceiling, max(self.floor, value))
+
+    def update(self, rtt):
+        """Add a measured round-trip time in seconds"""
+
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.timeout = self._clamp(self.srtt + self.K * self.rttvar)
+
+    def backoff(self):
+        """Double the timeout after a reply did not arrive in time"""
+
+        self.timeout = self._clamp(self.timeout * 2)
+
+
+def _locked(method):
+    """Run an LKMotor command as one transaction under the motor's lock
+
+    A motor answers one command at a time, so the send and the matching
+    receive must not interleave with another thread's command to the same
+    motor.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+# Torque current per iq LSB (iq and phase currents), by motor series
+IQ_AMPS_MF = 33 / 4096
+IQ_AMPS_MG = 66 / 4096
+
+
+class MotorState:
+    """Immutable snapshot of a motor's state, in physical units
+
+    Fields:
+    - motor_id
+    - time: `time.monotonic()` when the newest reply was received
+    - rx_time: receive timestamp of the newest reply frame (`can.Message.timestamp`)
+    - temperature (°C), voltage (V), current (A): status 1
+    - motor_state, error_state: status 1 flags
+    - torque_current (A): iq from status 2 or a control reply
+    - speed (degree/s at the output shaft)
+    - angle (degree at the output shaft): the multi-turn angle
+    - encoder: raw encoder value
+    - phase_current_a, phase_current_b, phase_current_c (A): status 3
+
+    Fields are read by name, there is no positional access. A snapshot
+    taken from a `MotorStatePool` is only valid until the pool reuses it.
+    """
+
+    __slots__ = (
+        "motor_id",
+        "time",
+        "rx_time",
+        "temperature",
+        "voltage",
+        "current",
+        "motor_state",
+        "error_state",
+        "torque_current",
+        "speed",
+        "angle",
+        "encoder",
+        "phase_current_a",
+        "phase_current_b",
+        "phase_current_c",
+    )
+
+    def __init__(self, *values):
+        _fill_motor_state(self, values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"MotorState is immutable, cannot set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"MotorState is immutable, cannot delete {name}")
+
+    def as_dict(self):
+        """The fields as a dict"""
+
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "MotorState(" + ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__) + ")"
+
+
+# The slot descriptors set the fields without going through __setattr__
+_MOTOR_STATE_SETTERS = tuple(getattr(MotorState, name).__set__ for name in MotorState.__slots__)
+
+
+def _fill_motor_state(state, values):
+    if len(values) != len(_MOTOR_STATE_SETTERS):
+        raise TypeError(f"MotorState takes {len(_MOTOR_STATE_SETTERS)} values, got {len(values)}")
+    for setter, value in zip(_MOTOR_STATE_SETTERS, values):
+        setter(state, value)
+    return state
+
+
+# How a state field is read: its command byte, the LKMotor and MotorGroup
+# methods that read it, and the LKMotor method that parses its reply
+_StateReader = namedtuple("_StateReader", ("command_byte", "motor_method", "group_method", "parser"))
+
+# Field name of `LKMotor.read_state`, `MotorGroup.wait_until` and `TelemetryPoller` -> its reader
+_STATE_READERS = {
+    "status_1": _StateReader(0x9A, "read_motor_status_1", "read_status_1", "_parse_response_1"),
+    "status_2": _StateReader(0x9C, "read_motor_status_2", "read_status_2", "_parse_response_2"),
+    "status_3": _StateReader(0x9D, "read_motor_status_3", "read_status_3", "_parse_response_3"),
+    "multi_turn_angle": _StateReader(0x92, "read_multi_turn_angle", "read_multi_turn_angle", "_parse_multi_turn_angle"),
+}
+
+
+class MotorStatePool:
+    """Preallocated `MotorState` snapshots for high-rate loops
+
+    Snapshots are handed out round-robin, so taking one allocates nothing.
+    A snapshot stays valid until `size` more have been taken from the pool;
+    keep the pool larger than the number of snapshots held at once.
+
+    Example:
+        pool = MotorStatePool(size=8)
+        while running:
+            state = motor.read_state(pool=pool)
+            if state.speed > 90:
+                ...
+    """
+
+    def __init__(self, size=64):
+        """Allocate the snapshots
+
+        Args:
+            size (int, optional): Number of snapshots. Defaults to 64.
+        """
+
+        self._states = [MotorState.__new__(MotorState) for _ in range(size)]
+        # next() of a cycle runs in C under the GIL, so threads may share the pool
+        self._cycle = itertools.cycle(self._states)
+
+    def take(self, values):
+        """Fill the next snapshot with `values`, in `MotorState.__slots__` order"""
+
+        return _fill_motor_state(next(self._cycle), values)
+
 
 class LKMotor:
-    def __init__(self, bus_interface, bus_channel, motor_id, **kwargs):
+    def __init__(
+        self,
+        bus_interface,
+        bus_channel,
+        motor_id,
+        timeout_floor=0.02,
+        timeout_ceiling=0.1,
+        kernel_filters=True,
+        gear_ratio=1,
+        amps_per_iq=IQ_AMPS_MG,
+        **kwargs,
+    ):
         """Initialize the motor
 
+        Motors on the same interface and channel share one bus and one
+        receive thread through `CanBusManager`.
+
+        The reply timeout adapts to the measured round-trip time of this
+        motor, see `RttEstimator`.
+
         Args:
-            bus_interface (str): CAN bus interface, e.g. "socketcan", "kvaser", "serial"
-            bus_interface (str): CAN bus interface, e.g. "socketcan", "kvaser", "serial"
+            bus_interface (str or type): CAN bus interface, e.g. "socketcan",
+                "kvaser", "serial", or a `can.BusABC` subclass such as `ReplayBus`
             bus_channel (str): CAN bus channel
             motor_id (int): Motor ID
-            **kwargs: Additional arguments, e.g. baudrate, bitrate, etc.
+            timeout_floor (float, optional): Shortest reply timeout in seconds,
+                above the reply latency plus the scheduling jitter of the host. Defaults to 0.02.
+            timeout_ceiling (float, optional): Longest reply timeout in seconds. Defaults to 0.1.
+            kernel_filters (bool, optional): Let the shared bus receive only
+                the reply IDs of its motors. False turns the filters off for
+                the whole channel, e.g. to sniff the bus. Defaults to True.
+            gear_ratio (float, optional): Gear ratio, for the output shaft
+                units of `state()`. Defaults to 1.
+            amps_per_iq (float, optional): Current per iq LSB, `IQ_AMPS_MG`
+                or `IQ_AMPS_MF`. Defaults to `IQ_AMPS_MG`.
             **kwargs: Additional arguments, e.g. baudrate, bitrate, etc.
         """
 
         self.motor_id = motor_id
-        self.bus = can.interface.Bus(
-            interface=bus_interface, channel=bus_channel, **kwargs
+        self.bus_channel = bus_channel
+        self.gear_ratio = gear_ratio
+        self.amps_per_iq = amps_per_iq
+        self.bus_manager = CanBusManager.acquire(
+            bus_interface, bus_channel, kernel_filters=kernel_filters, **kwargs
+        )
+        if not kernel_filters:
+            self.bus_manager.set_kernel_filters(False)
+        self.bus = self.bus_manager.bus
+        self._reply_queue = self.bus_manager.get_queue(0x140 + motor_id)
+        self._pending_command = None
+        self._sent_at = 0.0
+        self._timed_out_command = None
+        self._sample_rtt = False
+        self.reply_timestamp = None
+        self.reply_time = None
+        self.stats = CommandStats()
+        self.rtt = RttEstimator(timeout_floor, timeout_ceiling)
+        self._tx_message = can.Message(
+            arbitration_id=0x140 + motor_id, data=bytearray(8), is_extended_id=False
         )
+        self._lock = threading.RLock()
+        self.telemetry = None
 
         self.temperature = 0
         self.voltage = 0
@@ -82,13 +631,59 @@ class LKMotor:
             data (unit8_t list): Data bytes to be sent
         """
 
-        data = [command_byte] + (data if data else [0x00] * 7)
-        message = can.Message(
-            arbitration_id=0x140 + self.motor_id, data=data, is_extended_id=False
+        if data:
+            _RAW_DATA.pack_into(self._tx_message.data, 0, command_byte, bytes(data))
+        else:
+            _NO_DATA.pack_into(self._tx_message.data, 0, command_byte)
+        self._send_frame(command_byte)
+
+    def _send_packed(self, command_byte, *values, drain=True):
+        """Send a command to the motor, packed with the command's frame layout
+
+        Args:
+            command_byte (uint8_t): Command byte, a key of `_COMMAND_LAYOUTS`
+            *values: Command fields in frame order
+            drain (bool, optional): Drop the queued replies first, False
+                inside a burst of commands. Defaults to True.
+        """
+
+        _COMMAND_LAYOUTS[command_byte].pack_into(
+            self._tx_message.data, 0, command_byte, *values
         )
+        self._send_frame(command_byte, drain)
 
-        self.bus.send(message)
-        # print(f"Command sent to motor {self.motor_id} with data: {data}")
+    def _send_frame(self, command_byte, drain=True):
+        """Send the packed command frame and wait for its reply next"""
+
+        self._expect_reply(command_byte, drain)
+        self.bus_manager.send(self._tx_message)
+        # print(f"Command sent to motor {self.motor_id} with data: {self._tx_message.data}")
+
+    def _expect_reply(self, command_byte, drain=True):
+        """Make the next reply to wait for the one to this command byte
+
+        Also counts the command as sent and starts its round-trip time. A
+        command sent again after a timeout is not used for the RTT estimate,
+        since its reply may answer the earlier attempt (Karn's algorithm).
+
+        Replies still queued arrived after their command timed out. One to
+        the same command byte would pass for the reply to this command, so
+        they are dropped and counted as stale, unless `drain` is False.
+        """
+
+        if drain:
+            while True:
+                try:
+                    response = self._reply_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if response.data:
+                    self.stats.count(response.data[0], "stale")
+        self._pending_command = command_byte
+        self._sample_rtt = command_byte != self._timed_out_command
+        self._timed_out_command = None
+        self._sent_at = time.perf_counter()
+        self.stats.count(command_byte, "sent")
 
     # def _receive_response(self, timeout=0.1):
     #     """Receive a response from the motor
@@ -104,14 +699,144 @@ class LKMotor:
     #         return response.data
     #     return None
     
-    def _receive_response(self, timeout=0.1):
-        """Receive response with filtering for correct motor ID"""
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            response = self.bus.recv(0.1)  # Smaller per-call timeout
-            if response and response.arbitration_id == 0x140 + self.motor_id:
+    def _receive_response(self, timeout=None):
+        """Receive the reply to the last command from this motor's queue
+
+        Frames are routed to the queue by `CanBusManager`, so only replies
+        from this motor arrive here. Late replies to an earlier command are
+        skipped by checking the command byte, and counted as stale.
+
+        Args:
+            timeout (float, optional): Timeout in seconds. Defaults to None,
+                the adaptive timeout `self.rtt.timeout`.
+
+        Returns:
+            bytearray: Response data, or None on timeout
+        """
+
+        if timeout is None:
+            timeout = self.rtt.timeout
+        command_byte = self._pending_command
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    response = self._reply_queue.get(timeout=remaining)
+                else:
+                    # Past a group deadline a reply may already be queued
+                    response = self._reply_queue.get_nowait()
+            except queue.Empty:
+                if command_byte is not None:
+                    self.stats.count(command_byte, "timeouts")
+                    self._timed_out_command = command_byte
+                    self.rtt.backoff()
+                return None
+            if command_byte is None:
+                if response.data:
+                    return response.data
+                continue
+            if response.data and response.data[0] == command_byte:
+                rtt = time.perf_counter() - self._sent_at
+                # Receive time from the driver, on SocketCAN the kernel's
+                self.reply_timestamp = response.timestamp
+                self.reply_time = time.monotonic()
+                self.stats.record_reply(command_byte, rtt)
+                if self._sample_rtt:
+                    self.rtt.update(rtt)
                 return response.data
-        return None
+            self.stats.count(command_byte, "stale")
+
+    def state(self, pool=None):
+        """Snapshot of the last read values, without bus traffic
+
+        Args:
+            pool (MotorStatePool, optional): Take the snapshot from this pool
+                instead of allocating one
+
+        Returns:
+            MotorState: The state in physical units
+        """
+
+        gear_ratio = self.gear_ratio
+        amps_per_iq = self.amps_per_iq
+        values = (
+            self.motor_id,
+            self.reply_time,
+            self.reply_timestamp,
+            self.temperature,
+            self.voltage,
+            self.current,
+            self.motor_state,
+            self.error_state,
+            self.iq * amps_per_iq,
+            self.speed / gear_ratio,
+            self.multi_turn_angle / 100 / gear_ratio,
+            self.encoder_value,
+            self.current_A * amps_per_iq,
+            self.current_B * amps_per_iq,
+            self.current_C * amps_per_iq,
+        )
+        if pool is None:
+            return MotorState(*values)
+        return pool.take(values)
+
+    @_locked
+    def read_state(self, fields=("status_2", "multi_turn_angle"), pool=None):
+        """Read the motor and return a snapshot of its state
+
+        Args:
+            fields (tuple, optional): What to read: "status_1", "status_2",
+                "status_3" and "multi_turn_angle". Defaults to status 2 and
+                the multi-turn angle.
+            pool (MotorStatePool, optional): Take the snapshot from this pool
+
+        Returns:
+            MotorState: The state in physical units; fields that were not
+                read keep their last values
+        """
+
+        for field in fields:
+            if field not in _STATE_READERS:
+                raise ValueError(f"Unknown state field: {field}")
+            getattr(self, _STATE_READERS[field].motor_method)()
+        return self.state(pool)
+
+    def start_telemetry(self, rate_hz=20.0, history=256, fields=None, motion_window=5):
+        """Start a background telemetry poller for this motor
+
+        Args:
+            rate_hz (float, optional): Polling cycles per second. Defaults to 20.
+            history (int, optional): Samples kept per field. Defaults to 256.
+            fields (tuple, optional): Fields to poll, see `TelemetryPoller`
+            motion_window (int, optional): Samples in the speed fit. Defaults to 5.
+
+        Returns:
+            TelemetryPoller: The running poller, also kept as `self.telemetry`
+        """
+
+        self.stop_telemetry()
+        self.telemetry = TelemetryPoller(self, rate_hz, history, fields, motion_window)
+        self.telemetry.start()
+        return self.telemetry
+
+    def stop_telemetry(self):
+        """Stop the background telemetry poller, if any"""
+
+        if self.telemetry is not None:
+            self.telemetry.stop()
+            self.telemetry = None
+
+    def close(self):
+        """Release this motor's reference to the shared bus
+
+        The bus is shut down when the last motor on the channel is closed.
+        """
+
+        self.stop_telemetry()
+        if self.bus_manager is not None:
+            self.bus_manager.release()
+            self.bus_manager = None
 
     def _parse_response_1(self, response):
         """Parse the response data from the motor
@@ -142,11 +867,15 @@ class LKMotor:
         """
 
         if response:
-            self.temperature = self._byte_to_decimal([response[1]])
-            self.voltage = self._byte_to_decimal(response[2:4]) * 0.01
-            self.current = self._byte_to_decimal(response[4:6]) * 0.01
-            self.motor_state = response[6]
-            self.error_state = response[7]
+            (
+                self.temperature,
+                voltage,
+                current,
+                self.motor_state,
+                self.error_state,
+            ) = _STATUS_1_REPLY.unpack_from(response)
+            self.voltage = voltage * 0.01
+            self.current = current * 0.01
         return (
             self.temperature,
             self.voltage,
@@ -178,10 +907,12 @@ class LKMotor:
         """
 
         if response:
-            self.temperature = self._byte_to_decimal([response[1]])
-            self.iq = self._byte_to_decimal(response[2:4])
-            self.speed = self._byte_to_decimal(response[4:6])
-            self.encoder_value = self._byte_to_decimal(response[6:8])
+            (
+                self.temperature,
+                self.iq,
+                self.speed,
+                self.encoder_value,
+            ) = _STATUS_2_REPLY.unpack_from(response)
         return self.temperature, self.iq, self.speed, self.encoder_value
 
     def _parse_response_3(self, response):
@@ -199,12 +930,25 @@ class LKMotor:
             response (list): Response data from the motor
         """
         if response:
-            self.temperature = self._byte_to_decimal([response[1]])
-            self.current_A = self._byte_to_decimal(response[2:4])
-            self.current_B = self._byte_to_decimal(response[4:6])
-            self.current_C = self._byte_to_decimal(response[6:8])
+            (
+                self.temperature,
+                self.current_A,
+                self.current_B,
+                self.current_C,
+            ) = _STATUS_3_REPLY.unpack_from(response)
         return self.temperature, self.current_A, self.current_B, self.current_C
 
+    def _parse_multi_turn_angle(self, response):
+        """Parse the multi-turn angle (int64_t, 0.01 degree/LSB) from the response data
+
+        Args:
+            response (list): Response data from the motor
+        """
+
+        self.multi_turn_angle = _MULTI_TURN_ANGLE_REPLY.unpack_from(response)[0] >> 8
+        return self.multi_turn_angle
+
+    @_locked
     def read_motor_status_1(self):
         """Read the motor status 1
 
@@ -222,6 +966,7 @@ class LKMotor:
         if response:
             return self._parse_response_1(response)
 
+    @_locked
     def clear_error_flags(self):
         """Clear the error flags of the motor
 
@@ -249,15 +994,23 @@ class LKMotor:
     #     if response:
     #         return self._parse_response_2(response)
     
+    @_locked
     def read_motor_status_2(self, retries=3):
         for attempt in range(retries):
+            if attempt:
+                self.stats.count(0x9C, "retries")
             self._send_command(0x9C)
             response = self._receive_response()
             if response and any(response[1:]):  # 检查是否非全零响应
                 return self._parse_response_2(response)
-            time.sleep(0.05 * (attempt + 1))  # 指数退避
+            if response is not None:
+                # An all-zero reply: give the motor a few round trips before asking again.
+                # After a timeout the wait has already happened, retry at once.
+                time.sleep(self.rtt.timeout * (attempt + 1))  # 指数退避
+        self.stats.count(0x9C, "failures")
         return (0, 0, 0, 0)  # 返回安全值
 
+    @_locked
     def read_motor_status_3(self):
         """Read the motor status 3
 
@@ -272,6 +1025,7 @@ class LKMotor:
         if response:
             return self._parse_response_3(response)
 
+    @_locked
     def motor_shutdown(self):
         """Shutdown the motor
 
@@ -284,6 +1038,7 @@ class LKMotor:
         self._send_command(0x80)
         return self._receive_response()
 
+    @_locked
     def motor_run(self):
         """Start the motor
 
@@ -295,6 +1050,7 @@ class LKMotor:
         self._send_command(0x88)
         return self._receive_response()
 
+    @_locked
     def motor_stop(self):
         """Stop the motor
 
@@ -306,6 +1062,7 @@ class LKMotor:
         self._send_command(0x81)
         return self._receive_response()
 
+    @_locked
     def brake_control(self, control_byte):
         """Brake control command
 
@@ -315,12 +1072,12 @@ class LKMotor:
             control_byte (uint8_t): Control byte, 0x00 for brake, 0x01 for release, 0x10 for state
         """
 
-        data = self._decimal_to_byte(control_byte, 1) + [0x00] * 6
-        self._send_command(0x8C, data)
+        self._send_packed(0x8C, control_byte)
         response = self._receive_response()
         if response:
-            return self._byte_to_decimal([response[1]])
+            return _BRAKE_REPLY.unpack_from(response)[0]
 
+    @_locked
     def open_loop_control(self, power_control):
         """Open loop control command
 
@@ -331,12 +1088,12 @@ class LKMotor:
             power_control (int16_t): Power control, range from -850 to 850
         """
 
-        data = [0x00] * 3 + self._decimal_to_byte(power_control, 2) + [0x00] * 2
-        self._send_command(0xA0, data)
+        self._send_packed(0xA0, power_control)
         response = self._receive_response()
         if response:
             return self._parse_response_2(response)
 
+    @_locked
     def torque_loop_control(self, iq_control):
         """Torque loop control command
 
@@ -348,12 +1105,12 @@ class LKMotor:
             iq_control (int16_t): Torque control, range from -2048 to 2048
         """
 
-        data = [0x00] * 3 + self._decimal_to_byte(iq_control, 2) + [0x00] * 2
-        self._send_command(0xA1, data)
+        self._send_packed(0xA1, iq_control)
         response = self._receive_response()
         if response:
             return self._parse_response_2(response)
 
+    @_locked
     def speed_loop_control(self, iq_control, speed_control):
         """Speed loop control command
 
@@ -364,16 +1121,12 @@ class LKMotor:
             speed_control (int32_t): Speed control, unit: 0.01 dps/LSB
         """
 
-        data = (
-            [0x00]
-            + self._decimal_to_byte(iq_control, 2)
-            + self._decimal_to_byte(speed_control, 4)
-        )
-        self._send_command(0xA2, data)
+        self._send_packed(0xA2, iq_control, speed_control)
         response = self._receive_response()
         if response:
             return self._parse_response_2(response)
 
+    @_locked
     def multi_turn_position_control(
         self, angle_control, max_speed: Optional[int] = None
     ):
@@ -387,19 +1140,14 @@ class LKMotor:
         """
 
         if max_speed is None:
-            data = [0x00] * 3 + self._decimal_to_byte(angle_control, 4)
-            self._send_command(0xA3, data)
+            self._send_packed(0xA3, angle_control)
         else:
-            data = (
-                [0x00]
-                + self._decimal_to_byte(max_speed, 2)
-                + self._decimal_to_byte(angle_control, 4)
-            )
-            self._send_command(0xA4, data)
+            self._send_packed(0xA4, max_speed, angle_control)
         response = self._receive_response()
         if response:
             return self._parse_response_2(response)
 
+    @_locked
     def single_turn_position_control(
         self, spin_direction, angle_control, max_speed: Optional[int] = None
     ):
@@ -414,23 +1162,14 @@ class LKMotor:
         """
 
         if max_speed is None:
-            data = (
-                self._decimal_to_byte(spin_direction, 1)
-                + [0x00] * 2
-                + self._decimal_to_byte(angle_control, 4)
-            )
-            self._send_command(0xA5, data)
+            self._send_packed(0xA5, spin_direction, angle_control)
         else:
-            data = (
-                self._decimal_to_byte(spin_direction, 1)
-                + self._decimal_to_byte(max_speed, 2)
-                + self._decimal_to_byte(angle_control, 4)
-            )
-            self._send_command(0xA6, data)
+            self._send_packed(0xA6, spin_direction, max_speed, angle_control)
         response = self._receive_response()
         if response:
             return self._parse_response_2(response)
 
+    @_locked
     def incremental_position_control(
         self, angle_increment, max_speed: Optional[int] = None
     ):
@@ -444,31 +1183,34 @@ class LKMotor:
         """
 
         if max_speed is None:
-            data = [0x00] * 3 + self._decimal_to_byte(angle_increment, 4)
-            self._send_command(0xA7, data)
+            self._send_packed(0xA7, angle_increment)
         else:
-            data = (
-                [0x00]
-                + self._decimal_to_byte(max_speed, 2)
-                + self._decimal_to_byte(angle_increment, 4)
-            )
-            self._send_command(0xA8, data)
+            self._send_packed(0xA8, max_speed, angle_increment)
         response = self._receive_response()
         if response:
             return self._parse_response_2(response)
 
-    def read_control_params(self):
+    @_locked
+    def read_control_params(self, control_param_id):
         """Read control parameter command
 
         This function sends a command to the motor to read the control parameter.
 
+        Args:
+            control_param_id (uint8_t): Control parameter ID
+
         Returns:
-            list: Control parameter data
+            bytes: Parameter bytes (DATA[2:8]), or None if there was no reply
+                for this parameter
         """
 
-        self._send_command(0xC0)
-        return self._receive_response()
+        self._send_packed(0xC0, control_param_id)
+        response = self._receive_control_param(control_param_id)
+        if response:
+            return _CONTROL_PARAM_REPLY.unpack_from(response)[1]
+        return None
 
+    @_locked
     def write_control_params(self, control_param_id, param_bytes):
         """Write control parameter command
 
@@ -477,12 +1219,36 @@ class LKMotor:
         Args:
             control_param_id (uint8_t): Control parameter ID
             param_bytes (list): Parameter bytes
+
+        Returns:
+            bytearray: Response data, or None if there was no reply for this
+                parameter
         """
 
-        data = [0xC1, control_param_id] + param_bytes
-        self._send_command(0xC1, data)
-        return self._receive_response()
+        self._send_packed(0xC1, control_param_id, bytes(param_bytes))
+        return self._receive_control_param(control_param_id)
+
+    def _receive_control_param(self, control_param_id):
+        """Receive the reply to a control parameter command
+
+        Replies for another parameter ID (DATA[1]), e.g. late ones to an
+        earlier command, are skipped and counted as stale.
+
+        Args:
+            control_param_id (uint8_t): Control parameter ID of the command
 
+        Returns:
+            bytearray: Response data, or None on timeout
+        """
+
+        deadline = time.monotonic() + self.rtt.timeout
+        while True:
+            response = self._receive_response(max(deadline - time.monotonic(), 0))
+            if response is None or response[1] == control_param_id:
+                return response
+            self.stats.count(response[0], "stale")
+
+    @_locked
     def read_encoder_data(self):
         """Read encoder data command
 
@@ -497,11 +1263,14 @@ class LKMotor:
         self._send_command(0x90)
         response = self._receive_response()
         if response:
-            self.encoder_value = self._byte_to_decimal(response[2:4])
-            self.encoder_raw = self._byte_to_decimal(response[4:6])
-            self.encoder_offset = self._byte_to_decimal(response[6:8])
+            (
+                self.encoder_value,
+                self.encoder_raw,
+                self.encoder_offset,
+            ) = _ENCODER_REPLY.unpack_from(response)
         return self.encoder_value, self.encoder_raw, self.encoder_offset
 
+    @_locked
     def set_zero_position(self):
         """Set the current position as the zero position
 
@@ -515,9 +1284,10 @@ class LKMotor:
         self._send_command(0x19)
         response = self._receive_response()
         if response:
-            self.encoder_offset = self._byte_to_decimal(response[6:8])
+            self.encoder_offset = _ENCODER_OFFSET_REPLY.unpack_from(response)[0]
         return self.encoder_offset
 
+    @_locked
     def read_multi_turn_angle(self):
         """Read the multi-turn angle
 
@@ -530,14 +1300,19 @@ class LKMotor:
         self._send_command(0x92)
         response = self._receive_response()
         if response:
-            self.multi_turn_angle = self._byte_to_decimal(response[1:8])
+            self._parse_multi_turn_angle(response)
         return self.multi_turn_angle
 
-    def read_single_turn_angle(self):
+    @_locked
+    def read_single_turn_angle(self, fresh=False):
         """Read the single-turn angle
 
         This function sends a command to the motor to read the single-turn angle.
 
+        Args:
+            fresh (bool, optional): Return None instead of the last read angle
+                when the motor does not reply. Defaults to False.
+
         Returns:
             single_turn_angle (uint32_t): Single-turn angle, range from 0 to 35999
         """
@@ -545,9 +1320,12 @@ class LKMotor:
         self._send_command(0x94)
         response = self._receive_response()
         if response:
-            self.single_turn_angle = self._byte_to_decimal(response[4:8])
+            self.single_turn_angle = _SINGLE_TURN_ANGLE_REPLY.unpack_from(response)[0]
+        elif fresh:
+            return None
         return self.single_turn_angle
 
+    @_locked
     def set_position_to_angle(self, multi_turn_angle):
         """Set the current position as a multi-turn angle
 
@@ -555,11 +1333,1167 @@ class LKMotor:
             motor_angle (int): Target angle, unit: 0.01 degree/LSB
         """
 
-        data = [0x00] * 3 + self._decimal_to_byte(multi_turn_angle, 4)
-        self._send_command(0x95, data)
+        self._send_packed(0x95, multi_turn_angle)
+        if self.telemetry is not None:
+            # The angle jumps to the new origin, do not read it as speed
+            self.telemetry.motion.reset()
         return self._receive_response()
 
 
+class AsyncLKMotor:
+    """asyncio interface to an LKMotor
+
+    Every command of `LKMotor` has an awaitable version with the same name and
+    arguments. Each call runs the blocking command in an executor thread, so
+    commands to different motors overlap on the bus:
+
+        await asyncio.gather(
+            front.speed_loop_control(iq_control, speed_control),
+            rear.speed_loop_control(iq_control, -speed_control),
+        )
+
+    costs one round trip instead of two. Calls to the same motor are
+    serialized, since a motor answers one command at a time.
+    """
+
+    def __init__(self, bus_interface, bus_channel, motor_id, executor=None, **kwargs):
+        """Initialize the motor
+
+        Args:
+            bus_interface (str): CAN bus interface, e.g. "socketcan", "kvaser", "serial"
+            bus_channel (str): CAN bus channel
+            motor_id (int): Motor ID
+            executor (concurrent.futures.Executor, optional): Executor for the
+                blocking commands. Defaults to the event loop's default executor.
+            **kwargs: Additional arguments, e.g. baudrate, bitrate, etc.
+        """
+
+        self.motor = LKMotor(bus_interface, bus_channel, motor_id, **kwargs)
+        self.motor_id = motor_id
+        self._executor = executor
+        self._lock = None
+
+    @classmethod
+    def from_motor(cls, motor, executor=None):
+        """Wrap an existing LKMotor
+
+        Args:
+            motor (LKMotor): Motor to be wrapped
+            executor (concurrent.futures.Executor, optional): Executor for the blocking commands
+
+        Returns:
+            AsyncLKMotor: Async interface to the motor
+        """
+
+        self = cls.__new__(cls)
+        self.motor = motor
+        self.motor_id = motor.motor_id
+        self._executor = executor
+        self._lock = None
+        return self
+
+    async def _call(self, name, *args, **kwargs):
+        """Run a blocking LKMotor command in the executor"""
+
+        # Created lazily so that the lock belongs to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        command = functools.partial(getattr(self.motor, name), *args, **kwargs)
+        async with self._lock:
+            return await loop.run_in_executor(self._executor, command)
+
+    def close(self):
+        """Release the motor's reference to the shared bus"""
+
+        self.motor.close()
+
+
+def _async_command(name):
+    """Build the awaitable version of an LKMotor command"""
+
+    method = getattr(LKMotor, name)
+
+    @functools.wraps(method)
+    async def command(self, *args, **kwargs):
+        return await self._call(name, *args, **kwargs)
+
+    return command
+
+
+for _name in (
+    "read_motor_status_1",
+    "clear_error_flags",
+    "read_motor_status_2",
+    "read_motor_status_3",
+    "motor_shutdown",
+    "motor_run",
+    "motor_stop",
+    "brake_control",
+    "open_loop_control",
+    "torque_loop_control",
+    "speed_loop_control",
+    "multi_turn_position_control",
+    "single_turn_position_control",
+    "incremental_position_control",
+    "read_control_params",
+    "write_control_params",
+    "read_encoder_data",
+    "set_zero_position",
+    "read_multi_turn_angle",
+    "read_single_turn_angle",
+    "set_position_to_angle",
+):
+    setattr(AsyncLKMotor, _name, _async_command(_name))
+del _name
+
+
+class MotorGroup:
+    """Pipelined commands to several LKMotors
+
+    Each group command writes the request frames for every motor
+    back-to-back, then collects the replies in whatever order they arrive.
+    Replies are routed per motor by `CanBusManager`, so a group command
+    finishes in about one round trip no matter how many motors are in the
+    group.
+
+    Results are returned as a list in the order of `motors`. A motor that
+    does not reply before the timeout gets None.
+    """
+
+    def __init__(self, motors):
+        """Initialize the group
+
+        Args:
+            motors (list): LKMotor instances, e.g. [motor_Front, motor_Rear]
+        """
+
+        self.motors = list(motors)
+
+    def __len__(self):
+        return len(self.motors)
+
+    def __iter__(self):
+        return iter(self.motors)
+
+    def _per_motor(self, values, name):
+        """Expand a scalar into one value per motor"""
+
+        if isinstance(values, (list, tuple)):
+            if len(values) != len(self.motors):
+                raise ValueError(
+                    f"{name} has {len(values)} values for {len(self.motors)} motors"
+                )
+            return list(values)
+        return [values] * len(self.motors)
+
+    def _lock_all(self):
+        """Hold the lock of every motor in the group, in a fixed order"""
+
+        stack = contextlib.ExitStack()
+        for motor in sorted(self.motors, key=id):
+            stack.enter_context(motor._lock)
+        return stack
+
+    def _reply_timeout(self):
+        """Adaptive timeout for a whole group: the longest motor timeout"""
+
+        return max(motor.rtt.timeout for motor in self.motors)
+
+    def _transaction(self, command_byte, values_list=None, parse=None, timeout=None):
+        """Send one command to every motor, then collect every reply
+
+        Args:
+            command_byte (uint8_t): Command byte
+            values_list (list, optional): Command fields per motor, None for no data
+            parse (str, optional): Name of the LKMotor parser for the reply
+            timeout (float, optional): Timeout for the whole group in seconds.
+                Defaults to None, the longest adaptive timeout of the motors.
+
+        Returns:
+            list: Parsed reply (or raw reply data if parse is None) per motor
+        """
+
+        with self._lock_all():
+            if values_list is None:
+                for motor in self.motors:
+                    motor._send_command(command_byte)
+            else:
+                for motor, values in zip(self.motors, values_list):
+                    motor._send_packed(command_byte, *values)
+
+            deadline = time.monotonic() + (timeout or self._reply_timeout())
+            results = []
+            for motor in self.motors:
+                response = motor._receive_response(max(deadline - time.monotonic(), 0))
+                if response is None:
+                    results.append(None)
+                elif parse is None:
+                    results.append(response)
+                else:
+                    results.append(getattr(motor, parse)(response))
+        return results
+
+    def read_status_1(self):
+        """Read the motor status 1 of every motor
+
+        Returns:
+            list: (temperature, voltage, current, motor_state, error_state) per motor
+        """
+
+        return self._transaction(0x9A, parse="_parse_response_1")
+
+    def read_status_2(self):
+        """Read the motor status 2 of every motor
+
+        Returns:
+            list: (temperature, iq, speed, encoder_value) per motor
+        """
+
+        return self._transaction(0x9C, parse="_parse_response_2")
+
+    def read_status_3(self):
+        """Read the motor status 3 of every motor
+
+        Returns:
+            list: (temperature, current_A, current_B, current_C) per motor
+        """
+
+        return self._transaction(0x9D, parse="_parse_response_3")
+
+    def read_multi_turn_angle(self):
+        """Read the multi-turn angle of every motor
+
+        Returns:
+            list: Multi-turn angle per motor, unit: 0.01 degree/LSB
+        """
+
+        results = self._transaction(0x92)
+        angles = []
+        for motor, response in zip(self.motors, results):
+            if response is None:
+                angles.append(None)
+                continue
+            angles.append(motor._parse_multi_turn_angle(response))
+        return angles
+
+    def read_states(self, pool=None):
+        """Read the status 2 of every motor in one pipelined exchange
+
+        Args:
+            pool (MotorStatePool, optional): Take the snapshots from this pool
+
+        Returns:
+            list: `MotorState` per motor; a motor without a reply keeps its last values
+        """
+
+        self.read_status_2()
+        return [motor.state(pool) for motor in self.motors]
+
+    def wait_until(self, predicate, timeout=5.0, poll_hz=20.0, field="status_2", cancel=None):
+        """Wait until a condition on the motors holds
+
+        The condition is checked at most `poll_hz` times per second, on values
+        read after the wait started. Motors with a running telemetry poller
+        for `field` are checked from the poller without touching the bus; the
+        others are read with one pipelined group read per check.
+
+        Args:
+            predicate (callable): Called with a list of `field` values, one per
+                motor, and returns True when the condition holds
+            timeout (float, optional): Timeout in seconds. Defaults to 5.
+            poll_hz (float, optional): Maximum checks per second. Defaults to 20.
+            field (str, optional): Telemetry field passed to the predicate, see
+                `TelemetryPoller`, or "state" for a `MotorState` per motor
+                after reading status 2. Defaults to "status_2".
+            cancel (threading.Event, optional): Stop waiting when it is set
+
+        Returns:
+            bool: True if the condition holds, False on timeout or cancel
+        """
+
+        as_state = field == "state"
+        if as_state:
+            field = "status_2"
+        reader = _STATE_READERS[field].group_method
+        streamed = [
+            motor.telemetry is not None and field in motor.telemetry.fields
+            for motor in self.motors
+        ]
+        polled = MotorGroup(
+            [motor for motor, is_streamed in zip(self.motors, streamed) if not is_streamed]
+        )
+        period = 1.0 / poll_hz
+        deadline = time.monotonic() + timeout
+
+        while cancel is None or not cancel.is_set():
+            check_time = time.monotonic()
+            polled_values = iter(getattr(polled, reader)() if len(polled) else ())
+            values = []
+            for motor, is_streamed in zip(self.motors, streamed):
+                if not is_streamed:
+                    values.append(next(polled_values))
+                    continue
+                sample = motor.telemetry.wait_for_sample(
+                    field, check_time, max(deadline - time.monotonic(), 0)
+                )
+                values.append(None if sample is None else sample[1])
+            if None not in values:
+                if as_state:
+                    values = [motor.state() for motor in self.motors]
+                if predicate(values):
+                    return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            delay = min(max(check_time + period - time.monotonic(), 0), remaining)
+            if cancel is None:
+                time.sleep(delay)
+            else:
+                cancel.wait(delay)
+        return False
+
+    def wait_until_stopped(self, timeout=5.0, speed_threshold=0, poll_hz=20.0, cancel=None):
+        """Wait until every motor has stopped
+
+        Args:
+            timeout (float, optional): Timeout in seconds. Defaults to 5.
+            speed_threshold (float, optional): Largest absolute speed counted
+                as stopped, in degree/s at the output shaft (`MotorState.speed`).
+                Defaults to 0.
+            poll_hz (float, optional): Maximum checks per second. Defaults to 20.
+            cancel (threading.Event, optional): Stop waiting when it is set
+
+        Returns:
+            bool: True if every motor stopped, False on timeout or cancel
+        """
+
+        return self.wait_until(
+            lambda states: all(abs(state.speed) <= speed_threshold for state in states),
+            timeout,
+            poll_hz,
+            field="state",
+            cancel=cancel,
+        )
+
+    def motor_run(self):
+        """Start every motor"""
+
+        return self._transaction(0x88)
+
+    def motor_stop(self):
+        """Stop every motor"""
+
+        return self._transaction(0x81)
+
+    def motor_shutdown(self):
+        """Shutdown every motor"""
+
+        return self._transaction(0x80)
+
+    def brake_control(self, control_byte):
+        """Brake control command for every motor
+
+        Args:
+            control_byte (uint8_t or list): Control byte, 0x00 for brake, 0x01 for release, 0x10 for state
+        """
+
+        values_list = [(control,) for control in self._per_motor(control_byte, "control_byte")]
+        results = self._transaction(0x8C, values_list)
+        return [
+            None if response is None else _BRAKE_REPLY.unpack_from(response)[0]
+            for response in results
+        ]
+
+    def torque_loop_control(self, iq_control):
+        """Torque loop control command for every motor
+
+        Args:
+            iq_control (int16_t or list): Torque control per motor, range from -2048 to 2048
+
+        Returns:
+            list: (temperature, iq, speed, encoder_value) per motor
+        """
+
+        values_list = [(iq,) for iq in self._per_motor(iq_control, "iq_control")]
+        return self._transaction(0xA1, values_list, "_parse_response_2")
+
+    def broadcast_torque_control(self, iq_control, fallback=True, timeout=None):
+        """Multi-motor torque loop control command
+
+        One frame with identifier 0x280 sets the iq of motor IDs 1 to 4, and
+        every motor replies on its own identifier like the torque loop control
+        command (0xA1). This needs the motors to be set to Broadcast Mode in
+        the LK Motor Tool, and only works at 500 kbps or 1 Mbps.
+        Motor IDs 1 to 4 that are not in the group get iq 0.
+
+        Args:
+            iq_control (int16_t or list): Torque control per motor, range from -2048 to 2048
+            fallback (bool, optional): Send the single-motor torque command to
+                motors that did not reply to the broadcast. Defaults to True.
+            timeout (float, optional): Timeout for the whole group in seconds.
+                Defaults to None, the longest adaptive timeout of the motors.
+
+        Returns:
+            list: (temperature, iq, speed, encoder_value) per motor
+        """
+
+        managers = {motor.bus_manager for motor in self.motors}
+        if len(managers) != 1:
+            raise ValueError("Broadcast torque control needs all motors on one bus")
+        slots = [0] * 4
+        for motor, iq in zip(self.motors, self._per_motor(iq_control, "iq_control")):
+            if not 1 <= motor.motor_id <= 4:
+                raise ValueError(
+                    f"Broadcast torque control only supports motor ID 1~4, got {motor.motor_id}"
+                )
+            slots[motor.motor_id - 1] = iq
+
+        data = _MULTI_MOTOR_TORQUE.pack(*slots)
+        with self._lock_all():
+            for motor in self.motors:
+                motor._expect_reply(0xA1)
+            managers.pop().send(
+                can.Message(arbitration_id=0x280, data=data, is_extended_id=False)
+            )
+
+            deadline = time.monotonic() + (timeout or self._reply_timeout())
+            results = []
+            for motor in self.motors:
+                response = motor._receive_response(max(deadline - time.monotonic(), 0))
+                results.append(None if response is None else motor._parse_response_2(response))
+
+        if fallback:
+            for index, motor in enumerate(self.motors):
+                if results[index] is None:
+                    results[index] = motor.torque_loop_control(slots[motor.motor_id - 1])
+        return results
+
+    def speed_loop_control(self, iq_control, speed_control):
+        """Speed loop control command for every motor
+
+        Args:
+            iq_control (int16_t or list): Torque control per motor, range from -2048 to 2048
+            speed_control (int32_t or list): Speed control per motor, unit: 0.01 dps/LSB
+
+        Returns:
+            list: (temperature, iq, speed, encoder_value) per motor
+        """
+
+        values_list = list(
+            zip(
+                self._per_motor(iq_control, "iq_control"),
+                self._per_motor(speed_control, "speed_control"),
+            )
+        )
+        return self._transaction(0xA2, values_list, "_parse_response_2")
+
+    def multi_turn_position_control(self, angle_control, max_speed: Optional[int] = None):
+        """Multi-turn position control command for every motor
+
+        Args:
+            angle_control (int32_t or list): Angle control per motor, unit: 0.01 degree/LSB
+            max_speed (uint16_t or list, optional): Maximum speed per motor, unit: 1 dps/LSB
+
+        Returns:
+            list: (temperature, iq, speed, encoder_value) per motor
+        """
+
+        return self._position_control(0xA3, 0xA4, angle_control, max_speed)
+
+    def incremental_position_control(self, angle_increment, max_speed: Optional[int] = None):
+        """Incremental position control command for every motor
+
+        Args:
+            angle_increment (int32_t or list): Angle increment per motor, unit: 0.01 degree/LSB
+            max_speed (uint16_t or list, optional): Maximum speed per motor, unit: 1 dps/LSB
+
+        Returns:
+            list: (temperature, iq, speed, encoder_value) per motor
+        """
+
+        return self._position_control(0xA7, 0xA8, angle_increment, max_speed)
+
+    def _position_control(self, command_byte, speed_command_byte, angles, max_speed):
+        """Shared body of the multi-turn and incremental position commands"""
+
+        angles = self._per_motor(angles, "angle")
+        if max_speed is None:
+            values_list = [(angle,) for angle in angles]
+            return self._transaction(command_byte, values_list, "_parse_response_2")
+        values_list = list(zip(self._per_motor(max_speed, "max_speed"), angles))
+        return self._transaction(speed_command_byte, values_list, "_parse_response_2")
+
+    def set_position_to_angle(self, multi_turn_angle):
+        """Set the current position of every motor as a multi-turn angle
+
+        Args:
+            multi_turn_angle (int32_t or list): Angle per motor, unit: 0.01 degree/LSB
+        """
+
+        values_list = [
+            (angle,) for angle in self._per_motor(multi_turn_angle, "multi_turn_angle")
+        ]
+        results = self._transaction(0x95, values_list)
+        for motor in self.motors:
+            if motor.telemetry is not None:
+                # The angle jumps to the new origin, do not read it as speed
+                motor.telemetry.motion.reset()
+        return results
+
+
+# One telemetry reading: `time` is the `time.monotonic()` time it was stored,
+# `rx_time` the receive timestamp of the reply frame (`can.Message.timestamp`,
+# taken by the kernel on SocketCAN), which does not include the scheduling
+# delay of the Python threads.
+TelemetrySample = namedtuple("TelemetrySample", ("time", "value", "rx_time"))
+
+
+class MotionEstimator:
+    """Speed and angle of a motor from timestamped angle samples
+
+    The speed is the least-squares slope of the last `window` angles over
+    their receive timestamps, so it needs no extra round trips and is not
+    disturbed by when the Python thread happened to run.
+
+    Angles come from the multi-turn angle, or from the single-turn encoder
+    value. Encoder deltas are unwrapped with the speed reported in the same
+    reply, so more than half a turn between samples is still counted right.
+    All angles and speeds are on the motor side of the gearbox.
+    """
+
+    def __init__(self, window=5, encoder_resolution=65536):
+        """Initialize the estimator
+
+        Args:
+            window (int, optional): Samples in the speed fit. Defaults to 5.
+            encoder_resolution (int, optional): Encoder counts per turn,
+                16384, 32768 or 65536. Defaults to 65536.
+        """
+
+        self.encoder_resolution = encoder_resolution
+        self._samples = deque(maxlen=window)  # (receive time, angle in degree)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forget every sample, e.g. after the angle origin was changed"""
+
+        with self._lock:
+            self._samples.clear()
+
+    def add_angle(self, rx_time, multi_turn_angle):
+        """Add a multi-turn angle sample
+
+        Args:
+            rx_time (float): Receive timestamp of the reply
+            multi_turn_angle (int): Multi-turn angle, unit: 0.01 degree/LSB
+        """
+
+        with self._lock:
+            self._samples.append((rx_time, multi_turn_angle * 0.01))
+
+    def add_encoder(self, rx_time, encoder_value, speed=None):
+        """Add a single-turn encoder sample
+
+        Args:
+            rx_time (float): Receive timestamp of the reply
+            encoder_value (uint16_t): Encoder value
+            speed (int, optional): Speed from the same reply, unit: dps. Used
+                to count the whole turns since the last sample.
+        """
+
+        angle = encoder_value * 360.0 / self.encoder_resolution
+        with self._lock:
+            if self._samples:
+                last_time, last_angle = self._samples[-1]
+                delta = (angle - last_angle) % 360.0
+                if delta >= 180.0:
+                    delta -= 360.0
+                if speed is not None:
+                    expected = speed * (rx_time - last_time)
+                    delta += 360.0 * round((expected - delta) / 360.0)
+                angle = last_angle + delta
+            self._samples.append((rx_time, angle))
+
+    @property
+    def speed(self):
+        """Estimated speed in dps, None with fewer than two samples"""
+
+        with self._lock:
+            samples = list(self._samples)
+        if len(samples) < 2:
+            return None
+        start_time = samples[0][0]
+        times = [rx_time - start_time for rx_time, _ in samples]
+        angles = [angle for _, angle in samples]
+        mean_time = sum(times) / len(times)
+        mean_angle = sum(angles) / len(angles)
+        variance = sum((t - mean_time) ** 2 for t in times)
+        if variance == 0:
+            return None
+        return sum((t - mean_time) * (a - mean_angle) for t, a in zip(times, angles)) / variance
+
+    @property
+    def angle(self):
+        """Latest angle in degrees, None before the first sample"""
+
+        with self._lock:
+            return self._samples[-1][1] if self._samples else None
+
+    def angle_at(self, rx_time):
+        """Angle in degrees at a receive time, extrapolated with the speed
+
+        Args:
+            rx_time (float): Time on the clock of the receive timestamps
+
+        Returns:
+            float: Angle, or None before the first sample
+        """
+
+        with self._lock:
+            if not self._samples:
+                return None
+            last_time, last_angle = self._samples[-1]
+        speed = self.speed
+        if speed is None:
+            return last_angle
+        return last_angle + speed * (rx_time - last_time)
+
+    def phase_difference(self, other, gear_ratio=36):
+        """Angle difference to another motor at the output shaft
+
+        Both angles are taken at the same instant, the later of the two
+        latest receive times, so the two motors need not be sampled together.
+
+        Args:
+            other (MotionEstimator): Estimator of the other motor
+            gear_ratio (int, optional): Gear ratio. Defaults to 36.
+
+        Returns:
+            float: self minus other in degrees, or None before the first samples
+        """
+
+        with self._lock:
+            own_time = self._samples[-1][0] if self._samples else None
+        with other._lock:
+            other_time = other._samples[-1][0] if other._samples else None
+        if own_time is None or other_time is None:
+            return None
+        at = max(own_time, other_time)
+        return (self.angle_at(at) - other.angle_at(at)) / gear_ratio
+
+
+class TelemetryPoller:
+    """Background telemetry reader for one LKMotor
+
+    A thread reads status 1, 2, 3 and the multi-turn angle at a fixed rate
+    and keeps the results in ring buffers of `TelemetrySample`, with the
+    `time.monotonic()` time and the receive timestamp of the reply.
+    Callers read the latest value and its age without touching the bus, and
+    the bus load from telemetry is capped at `rate_hz` cycles per second.
+
+    `motion` estimates speed and angle from the receive timestamps, fed by
+    the multi-turn angle if it is polled, else by the status 2 encoder value.
+
+    Fields and their values:
+    - "status_1": (temperature, voltage, current, motor_state, error_state)
+    - "status_2": (temperature, iq, speed, encoder_value)
+    - "status_3": (temperature, current_A, current_B, current_C)
+    - "multi_turn_angle": Multi-turn angle, unit: 0.01 degree/LSB
+    """
+
+    FIELDS = tuple(_STATE_READERS)
+
+    def __init__(self, motor, rate_hz=20.0, history=256, fields=None, motion_window=5):
+        """Initialize the poller
+
+        Args:
+            motor (LKMotor): Motor to be polled
+            rate_hz (float, optional): Polling cycles per second. Defaults to 20.
+            history (int, optional): Samples kept per field. Defaults to 256.
+            fields (tuple, optional): Fields to poll. Defaults to all of `FIELDS`.
+            motion_window (int, optional): Samples in the speed fit of `motion`. Defaults to 5.
+        """
+
+        self.motor = motor
+        self.rate_hz = rate_hz
+        self.fields = tuple(fields) if fields else self.FIELDS
+        for field in self.fields:
+            if field not in self.FIELDS:
+                raise ValueError(f"Unknown telemetry field: {field}")
+        self._samples = {field: deque(maxlen=history) for field in self.fields}
+        self.motion = MotionEstimator(window=motion_window)
+        if "multi_turn_angle" in self.fields:
+            self._motion_field = "multi_turn_angle"
+        elif "status_2" in self.fields:
+            self._motion_field = "status_2"
+        else:
+            self._motion_field = None
+        self._samples_lock = threading.Lock()
+        self._new_sample = threading.Condition(self._samples_lock)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Start the polling thread"""
+
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._poll_loop,
+            name=f"lkmotor-telemetry-{self.motor.motor_id}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the polling thread"""
+
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
+
+    def _read(self, field):
+        """Read one field from the motor
+
+        Returns:
+            tuple: (value, receive timestamp), or (None, None) on timeout
+        """
+
+        motor = self.motor
+        reader = _STATE_READERS[field]
+        with motor._lock:
+            motor._send_command(reader.command_byte)
+            response = motor._receive_response()
+            if response is None:
+                return None, None
+            return getattr(motor, reader.parser)(response), motor.reply_timestamp
+
+    def _poll_loop(self):
+        """Poll every field once per period, on an absolute schedule"""
+
+        period = 1.0 / self.rate_hz
+        next_time = time.monotonic()
+        while self._running:
+            for field in self.fields:
+                value, rx_time = self._read(field)
+                if value is None:
+                    continue
+                if field == self._motion_field:
+                    if field == "multi_turn_angle":
+                        self.motion.add_angle(rx_time, value)
+                    else:
+                        _, _, speed, encoder_value = value
+                        self.motion.add_encoder(rx_time, encoder_value, speed)
+                with self._new_sample:
+                    self._samples[field].append(TelemetrySample(time.monotonic(), value, rx_time))
+                    self._new_sample.notify_all()
+            next_time += period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind, restart the schedule instead of bursting
+                next_time = time.monotonic()
+
+    def latest(self, field):
+        """Get the latest sample of a field
+
+        Args:
+            field (str): Field name, one of `FIELDS`
+
+        Returns:
+            tuple: (value, age in seconds), or (None, None) if nothing was read yet
+        """
+
+        with self._samples_lock:
+            samples = self._samples[field]
+            if not samples:
+                return None, None
+            timestamp, value, _ = samples[-1]
+        return value, time.monotonic() - timestamp
+
+    def wait_for_sample(self, field, after, timeout):
+        """Wait for a sample of a field taken after a given time
+
+        Args:
+            field (str): Field name, one of `FIELDS`
+            after (float): `time.monotonic()` time the sample must be newer than
+            timeout (float): Timeout in seconds
+
+        Returns:
+            TelemetrySample: (time, value, rx_time), or None on timeout
+        """
+
+        deadline = time.monotonic() + timeout
+        with self._new_sample:
+            while True:
+                samples = self._samples[field]
+                if samples and samples[-1][0] > after:
+                    return samples[-1]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    return None
+                self._new_sample.wait(remaining)
+
+    def history(self, field):
+        """Get every buffered sample of a field
+
+        Args:
+            field (str): Field name, one of `FIELDS`
+
+        Returns:
+            list: `TelemetrySample` (time, value, rx_time), oldest first
+        """
+
+        with self._samples_lock:
+            return list(self._samples[field])
+
+
+def format_prometheus(motors):
+    """Format the command and bus counters of motors as Prometheus text
+
+    Args:
+        motors (iterable): `LKMotor` objects, e.g. a `MotorGroup`
+
+    Returns:
+        str: Metrics in the Prometheus text exposition format
+    """
+
+    counters = {
+        "sent": "Command frames sent",
+        "replies": "Matching replies received",
+        "timeouts": "Replies that did not arrive in time",
+        "retries": "Commands sent again after a failed attempt",
+        "failures": "Commands that gave up after all retries",
+        "stale": "Replies skipped because they answered an earlier command",
+    }
+    motors = list(motors)
+    snapshots = [(motor, motor.stats.snapshot()) for motor in motors]
+
+    def labels(motor, command_byte):
+        return f'channel="{motor.bus_channel}",motor="{motor.motor_id}",command="0x{command_byte:02X}"'
+
+    lines = []
+    for counter, description in counters.items():
+        name = f"lkmotor_command_{counter}_total"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} counter")
+        for motor, snapshot in snapshots:
+            for command_byte, entry in snapshot.items():
+                lines.append(f"{name}{{{labels(motor, command_byte)}}} {entry[counter]}")
+
+    name = "lkmotor_command_rtt_seconds"
+    lines.append(f"# HELP {name} Command round-trip time")
+    lines.append(f"# TYPE {name} histogram")
+    for motor, snapshot in snapshots:
+        for command_byte, entry in snapshot.items():
+            command_labels = labels(motor, command_byte)
+            cumulative = 0
+            for edge, count in zip(CommandStats.RTT_BUCKETS, entry["rtt_histogram"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{command_labels},le="{edge}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{command_labels},le="+Inf"}} {entry["replies"]}')
+            lines.append(f"{name}_sum{{{command_labels}}} {entry['rtt_sum']}")
+            lines.append(f"{name}_count{{{command_labels}}} {entry['replies']}")
+
+    for name, attribute, description in (
+        ("lkmotor_srtt_seconds", "srtt", "Smoothed command round-trip time"),
+        ("lkmotor_reply_timeout_seconds", "timeout", "Current adaptive reply timeout"),
+    ):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for motor in motors:
+            value = getattr(motor.rtt, attribute)
+            if value is not None:
+                lines.append(f'{name}{{channel="{motor.bus_channel}",motor="{motor.motor_id}"}} {value}')
+
+    managers = []
+    for motor in motors:
+        if motor.bus_manager is not None and motor.bus_manager not in managers:
+            managers.append(motor.bus_manager)
+    lines.append("# HELP lkmotor_can_frames_received_total Frames read from the bus")
+    lines.append("# TYPE lkmotor_can_frames_received_total counter")
+    for manager in managers:
+        lines.append(f'lkmotor_can_frames_received_total{{channel="{manager.bus_channel}"}} {manager.frames_received}')
+    for name, attribute, description in (
+        ("lkmotor_can_frames_unclaimed_total", "frames_unclaimed", "Frames for IDs no motor reads"),
+        ("lkmotor_can_frames_dropped_total", "frames_dropped", "Frames dropped because their queue was full"),
+    ):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} counter")
+        for manager in managers:
+            for arbitration_id, count in sorted(getattr(manager, attribute).items()):
+                lines.append(f'{name}{{channel="{manager.bus_channel}",arbitration_id="0x{arbitration_id:03X}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusExporter:
+    """Write the motor counters to a Prometheus text file periodically
+
+    The file is replaced atomically, so it can be read at any time, e.g. by
+    the node_exporter textfile collector.
+
+    Example:
+        exporter = PrometheusExporter([motor_Front, motor_Rear], "/var/lib/node_exporter/lkmotor.prom")
+        exporter.start()
+        ...
+        exporter.stop()
+    """
+
+    def __init__(self, motors, path, interval=10.0):
+        """Initialize the exporter
+
+        Args:
+            motors (iterable): `LKMotor` objects, e.g. a `MotorGroup`
+            path (str): Output file path
+            interval (float, optional): Seconds between writes. Defaults to 10.
+        """
+
+        self.motors = list(motors)
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self):
+        """Write the file now"""
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(format_prometheus(self.motors))
+        os.replace(temp_path, self.path)
+
+    def start(self):
+        """Start writing in a background thread"""
+
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._export_loop, name="lkmotor-metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, after one last write"""
+
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _export_loop(self):
+        while True:
+            stopping = self._stop.wait(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Writing metrics to {self.path} failed: {e}")
+            except Exception as e:
+                # Keep exporting, a bad round must not end the thread
+                print(f"Formatting metrics for {self.path} failed: {e!r}")
+            if stopping:
+                return
+
+
+# Control parameters read with 0xC0 and written with 0xC1: name -> (parameter
+# ID, layout of the 6 parameter bytes DATA[2:8]). PID gains are Kp, Ki, Kd.
+CONTROL_PARAMS = {
+    "angle_pid": (0x0A, struct.Struct("<HHH")),
+    "speed_pid": (0x0B, struct.Struct("<HHH")),
+    "iq_pid": (0x0C, struct.Struct("<HHH")),
+    "max_torque": (0x1E, struct.Struct("<2xh2x")),
+    "max_speed": (0x20, struct.Struct("<2xi")),
+    "max_angle": (0x22, struct.Struct("<2xi")),
+    "current_ramp": (0x24, struct.Struct("<2xi")),
+    "speed_ramp": (0x26, struct.Struct("<2xi")),
+}
+
+
+class ControlParamStore:
+    """Cached control parameters of one motor, written only where they differ
+
+    `load()` reads every parameter in one pipelined burst: all 0xC0 requests
+    are sent before the first reply is awaited, and the replies are matched
+    by parameter ID. `apply(profile)` then writes only the parameters whose
+    value differs from the cache, so re-applying a tuning profile costs no
+    frames when nothing changed. `version` counts the changes of the cache.
+
+    A snapshot of the cache can be saved to a JSON file, keyed by motor ID, so
+    several motors share one file and a restart can skip the read burst.
+
+    Example:
+        store = ControlParamStore(motor_Front)
+        store.load()
+        print(store.values["speed_pid"])
+        written = store.apply({"speed_pid": (100, 50, 0), "max_speed": 32400})
+        store.save("control-params.json")
+    """
+
+    def __init__(self, motor, names=None):
+        """Initialize the store, nothing is read yet
+
+        Args:
+            motor (LKMotor): The motor
+            names (iterable, optional): Parameters of `CONTROL_PARAMS` to
+                cache. Defaults to None, all of them.
+        """
+
+        self.motor = motor
+        self.names = list(CONTROL_PARAMS if names is None else names)
+        self.values = {}
+        self.version = 0
+        self.loaded_at = None
+
+    def _decode(self, name, param_bytes):
+        value = CONTROL_PARAMS[name][1].unpack(param_bytes)
+        return value[0] if len(value) == 1 else value
+
+    def _encode(self, name, value):
+        layout = CONTROL_PARAMS[name][1]
+        return layout.pack(*value) if isinstance(value, (list, tuple)) else layout.pack(value)
+
+    def _update(self, name, value):
+        if self.values.get(name) != value:
+            self.values[name] = value
+            self.version += 1
+
+    def load(self, force=False):
+        """Read the parameters that are not cached yet, in one burst
+
+        Args:
+            force (bool, optional): Read every parameter again. Defaults to False.
+
+        Returns:
+            list: Names of the parameters without a reply
+        """
+
+        names = [name for name in self.names if force or name not in self.values]
+        if not names:
+            return []
+        motor = self.motor
+        by_id = {CONTROL_PARAMS[name][0]: name for name in names}
+        with motor._lock:
+            for index, param_id in enumerate(by_id):
+                # The replies of the burst are queued together
+                motor._send_packed(0xC0, param_id, drain=index == 0)
+            deadline = time.monotonic() + motor.rtt.timeout * len(by_id)
+            missing = set(by_id)
+            while missing:
+                response = motor._receive_response(max(deadline - time.monotonic(), 0))
+                if response is None:
+                    break
+                param_id, param_bytes = _CONTROL_PARAM_REPLY.unpack_from(response)
+                if param_id in missing:
+                    missing.discard(param_id)
+                    self._update(by_id[param_id], self._decode(by_id[param_id], param_bytes))
+        self.loaded_at = time.time()
+        return [by_id[param_id] for param_id in missing]
+
+    def diff(self, profile):
+        """Parameters of a profile that differ from the cache
+
+        Args:
+            profile (dict): Parameter name to value, a tuple for the PID gains
+
+        Returns:
+            dict: The differing part of the profile
+        """
+
+        unknown = set(profile) - set(CONTROL_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown control parameters: {sorted(unknown)}")
+        self.load()
+        return {
+            name: value
+            for name, value in profile.items()
+            if self.values.get(name) != (tuple(value) if isinstance(value, list) else value)
+        }
+
+    def apply(self, profile):
+        """Write the parameters of a profile that differ from the cache
+
+        Args:
+            profile (dict): Parameter name to value, a tuple for the PID gains
+
+        Returns:
+            list: Names of the written parameters
+        """
+
+        written = []
+        for name, value in self.diff(profile).items():
+            param_id = CONTROL_PARAMS[name][0]
+            response = self.motor.write_control_params(param_id, self._encode(name, value))
+            if response is None:
+                raise TimeoutError(f"Motor {self.motor.motor_id} did not confirm writing {name}")
+            param_id, param_bytes = _CONTROL_PARAM_REPLY.unpack_from(response)
+            self._update(name, self._decode(name, param_bytes))
+            written.append(name)
+        return written
+
+    def snapshot(self):
+        """The cache as a JSON-compatible dict"""
+
+        return {
+            "motor_id": self.motor.motor_id,
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "params": {
+                name: list(value) if isinstance(value, tuple) else value
+                for name, value in self.values.items()
+            },
+        }
+
+    def save(self, path):
+        """Store the snapshot in a JSON file, under this motor's ID
+
+        Snapshots of other motors in the file are kept.
+
+        Args:
+            path (str): File path
+        """
+
+        try:
+            with open(path) as f:
+                snapshots = json.load(f)
+        except FileNotFoundError:
+            snapshots = {}
+        snapshots[str(self.motor.motor_id)] = self.snapshot()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(snapshots, f, indent=2)
+        os.replace(temp_path, path)
+
+    def restore(self, path):
+        """Fill the cache from the snapshot of this motor in a JSON file
+
+        The snapshot is trusted without reading the motor; use
+        `load(force=True)` if the parameters may have changed since.
+
+        Args:
+            path (str): File path
+
+        Returns:
+            bool: True if the file has a snapshot of this motor
+        """
+
+        try:
+            with open(path) as f:
+                snapshot = json.load(f).get(str(self.motor.motor_id))
+        except FileNotFoundError:
+            return False
+        if snapshot is None:
+            return False
+        for name, value in snapshot["params"].items():
+            if name in CONTROL_PARAMS:
+                self._update(name, tuple(value) if isinstance(value, list) else value)
+        self.loaded_at = snapshot["loaded_at"]
+        return True
+
+
 if __name__ == "__main__":
     motor = LKMotor(bus_interface="socketcan", bus_channel="can0", motor_id=1)
 
@@ -0,0 +1,118 @@
+# Throughput of a MotorArray as motors are spread over more CAN channels.
+# By default every channel is a python-can virtual bus with simulated motors
+# whose wire runs at 1 Mbit/s, so a channel saturates like a real one:
+#   python3 Control_python-can/channel-scaling-benchmark.py --channels 1 2 4 --output scaling.json
+# Against real (or vcan) channels can0, can1, ... with the motors answering:
+#   python3 Control_python-can/channel-scaling-benchmark.py --interface socketcan --channels 1 2
+# Each channel count runs once with one I/O thread per channel and once with
+# all channels served by the calling thread, to show what the workers add.
+
+import argparse
+import json
+import platform
+import time
+from lk_simulator import LKMotorSimulator
+from motor_array import MotorArray
+
+
+def bench_array(motors, duration):
+    """Status reads per second and exchange times of one MotorArray"""
+
+    exchange_times = []
+    replies = 0
+    end = time.perf_counter() + duration
+    start = time.perf_counter()
+    while time.perf_counter() < end:
+        exchange_start = time.perf_counter()
+        replies += int(motors.read_status_2().sum())
+        exchange_times.append(time.perf_counter() - exchange_start)
+    elapsed = time.perf_counter() - start
+    exchange_times.sort()
+    return {
+        "exchanges": len(exchange_times),
+        "commands_per_sec": len(exchange_times) * len(motors) / elapsed,
+        "replies_per_sec": replies / elapsed,
+        "exchange_p50_us": exchange_times[len(exchange_times) // 2] * 1e6,
+        "exchange_p99_us": exchange_times[min(len(exchange_times) - 1, int(len(exchange_times) * 0.99))] * 1e6,
+    }
+
+
+def channel_names(args, count):
+    if args.interface == "virtual":
+        return [f"lk-scaling-{index}" for index in range(count)]
+    return [f"{args.channel_prefix}{index}" for index in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MotorArray throughput against the number of CAN channels")
+    parser.add_argument("--interface", default="virtual", help="'virtual' starts simulated motors on every channel")
+    parser.add_argument("--channel-prefix", default="can", help="channels are <prefix>0, <prefix>1, ...")
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 2, 4], help="channel counts to run")
+    parser.add_argument("--motor-ids", type=int, nargs="+", default=[1, 2, 3, 4], help="motor IDs on every channel")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per run")
+    parser.add_argument("--sim-bitrate", type=int, default=1000000, help="wire bit rate of the simulated channels")
+    parser.add_argument("--sim-latency", type=float, default=0.0002, help="reply latency of the simulated motors")
+    parser.add_argument("--output", help="write the JSON report to this file, '-' for stdout")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "interface": args.interface,
+            "simulated": args.interface == "virtual",
+            "sim_bitrate": args.sim_bitrate if args.interface == "virtual" else None,
+            "motor_ids": args.motor_ids,
+        },
+        "runs": [],
+    }
+    for count in args.channels:
+        channels = channel_names(args, count)
+        simulators = []
+        if args.interface == "virtual":
+            simulators = [
+                LKMotorSimulator(
+                    bus_channel=channel,
+                    motor_ids=args.motor_ids,
+                    latency=args.sim_latency,
+                    bitrate=args.sim_bitrate,
+                ).start()
+                for channel in channels
+            ]
+        try:
+            for workers in (False, True):
+                motors = MotorArray(
+                    [(channel, motor_id) for channel in channels for motor_id in args.motor_ids],
+                    bus_interface=args.interface,
+                    workers=workers,
+                )
+                try:
+                    result = bench_array(motors, args.duration)
+                finally:
+                    motors.close()
+                result.update({"channels": count, "motors": count * len(args.motor_ids), "workers": workers})
+                report["runs"].append(result)
+        finally:
+            for simulator in simulators:
+                simulator.stop()
+
+    if args.output == "-":
+        print(json.dumps(report, indent=2))
+        return
+    baseline = {run["workers"]: run["replies_per_sec"] for run in report["runs"] if run["channels"] == args.channels[0]}
+    print("channels motors workers  replies/s  scaling  exchange p50 (us)  p99 (us)")
+    for run in report["runs"]:
+        scaling = run["replies_per_sec"] / baseline[run["workers"]] if baseline[run["workers"]] else 0
+        print(
+            f"{run['channels']:>8} {run['motors']:>6} {'yes' if run['workers'] else 'no':>7} "
+            f"{run['replies_per_sec']:>10.0f} {scaling:>7.2f}x {run['exchange_p50_us']:>18.0f} {run['exchange_p99_us']:>9.0f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Microbenchmark of the LKMotor frame codec, no CAN hardware needed.
+# Compares the list-based helpers (_decimal_to_byte / _byte_to_decimal) with
+# the precompiled struct layouts used by LKMotor.
+#   python3 Control_python-can/codec-benchmark.py
+
+import can
+import timeit
+from pylkmotor.LKMotor import LKMotor, _COMMAND_LAYOUTS, _STATUS_2_REPLY
+
+iq_control = -180
+speed_control = 36 * 100 * 90
+reply = bytearray([0xA2, 0x1E, 0x34, 0xFF, 0x10, 0x27, 0x00, 0x20])
+number = 200000
+
+# Parsing only touches attributes, so a motor without a bus is enough here
+motor = LKMotor.__new__(LKMotor)
+motor.motor_id = 1
+tx_message = can.Message(arbitration_id=0x141, data=bytearray(8), is_extended_id=False)
+speed_layout = _COMMAND_LAYOUTS[0xA2]
+
+
+def encode_helpers():
+    data = [0xA2] + (
+        [0x00]
+        + motor._decimal_to_byte(iq_control, 2)
+        + motor._decimal_to_byte(speed_control, 4)
+    )
+    return can.Message(arbitration_id=0x141, data=data, is_extended_id=False)
+
+
+def encode_struct():
+    speed_layout.pack_into(tx_message.data, 0, 0xA2, iq_control, speed_control)
+    return tx_message
+
+
+def decode_helpers():
+    temperature = motor._byte_to_decimal([reply[1]])
+    iq = motor._byte_to_decimal(reply[2:4])
+    speed = motor._byte_to_decimal(reply[4:6])
+    encoder_value = motor._byte_to_decimal(reply[6:8])
+    return temperature, iq, speed, encoder_value
+
+
+def decode_struct():
+    return _STATUS_2_REPLY.unpack_from(reply)
+
+
+def bench(function):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    assert bytes(encode_helpers().data) == bytes(encode_struct().data)
+    assert decode_helpers() == decode_struct()
+
+    print("------------ Codec Benchmark (ns per frame) ------------")
+    for name, old, new in (
+        ("encode 0xA2", encode_helpers, encode_struct),
+        ("decode 0x9C", decode_helpers, decode_struct),
+    ):
+        old_ns = bench(old)
+        new_ns = bench(new)
+        print(f"{name}: helpers {old_ns:.0f} ns, struct {new_ns:.0f} ns, speedup {old_ns / new_ns:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+
+
+class CommandQueue:
+    """Coalescing queue of motor intents, drained by one worker thread
+
+    Input callbacks (e.g. keyboard hooks) put intents and return at once, so
+    input latency does not depend on how long a motor operation takes. The
+    worker runs one intent at a time, in order.
+
+    - Intents with the same key are merged: a new one replaces the pending
+      one, e.g. repeated speed changes become one command with the latest
+      target speed.
+    - A preempting intent cancels the running intent and drops the pending
+      ones, e.g. a stop request during a long phase move.
+
+    Each intent is called as action(cancelled), where `cancelled` is a
+    `threading.Event` that is set when the intent should give up. Long waits
+    inside an intent should wait on it, e.g.
+    `motors.wait_until_stopped(timeout=5, cancel=cancelled)`.
+    """
+
+    def __init__(self, name="motor-worker"):
+        """Start the worker thread
+
+        Args:
+            name (str, optional): Worker thread name. Defaults to "motor-worker".
+        """
+
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._cancelled = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._work, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, action, key=None, preempt=False):
+        """Queue an intent
+
+        Args:
+            action (callable): Called as action(cancelled) on the worker thread
+            key (hashable, optional): Merge key. A pending intent with the same
+                key is replaced and keeps its place in the queue. Defaults to
+                None, which never merges.
+            preempt (bool, optional): Cancel the running intent and drop the
+                pending ones. Defaults to False.
+        """
+
+        with self._condition:
+            if not self._running:
+                return
+            if preempt:
+                self._pending.clear()
+                self._cancelled.set()
+            if key is None:
+                key = object()
+            self._pending[key] = action
+            self._condition.notify()
+
+    def cancel(self):
+        """Cancel the running intent and drop the pending ones"""
+
+        with self._condition:
+            self._pending.clear()
+            self._cancelled.set()
+
+    def close(self, cancel=True):
+        """Stop the worker thread
+
+        Args:
+            cancel (bool, optional): Cancel the running intent and drop the
+                pending ones, instead of finishing them. Defaults to True.
+        """
+
+        with self._condition:
+            self._running = False
+            if cancel:
+                self._pending.clear()
+                self._cancelled.set()
+            self._condition.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _work(self):
+        """Run the queued intents one at a time"""
+
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                _, action = self._pending.popitem(last=False)
+                self._cancelled.clear()
+            try:
+                action(self._cancelled)
+            except Exception as e:
+                print(f"Motor command failed: {e}")
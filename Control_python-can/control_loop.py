@@ -0,0 +1,235 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ControlLoop:
+    """Fixed-rate control loop on its own thread
+
+    The step function is called once per period. Each cycle sleeps until an
+    absolute deadline on the monotonic clock, so the timing does not drift.
+    When a step overruns one or more deadlines the missed cycles are counted
+    and skipped, and the loop keeps its original phase.
+
+    The loop keeps:
+    - a histogram of the period jitter (actual minus nominal start-to-start time)
+    - the number of deadline misses
+    - the time spent in the step function and in bus I/O
+
+    Example:
+        def step(loop):
+            with loop.bus_io():
+                motors.speed_loop_control(iq_control, [speed, -speed])
+
+        loop = ControlLoop(step, rate_hz=500)
+        loop.start()
+        ...
+        loop.stop()
+        print(loop.format_stats())
+    """
+
+    # Upper edges of the jitter histogram bins in microseconds, the last bin is open
+    JITTER_BINS_US = (10, 50, 100, 250, 500, 1000, 2000, 5000)
+
+    def __init__(self, step, rate_hz, spin_margin=0.0, name="control-loop"):
+        """Initialize the loop
+
+        Args:
+            step (callable): Called as step(loop) once per period
+            rate_hz (float): Loop rate, e.g. 200 to 1000 Hz
+            spin_margin (float, optional): Time in seconds before each deadline
+                spent busy-waiting instead of sleeping. It trades CPU for
+                lower jitter. Defaults to 0.
+            name (str, optional): Thread name. Defaults to "control-loop".
+        """
+
+        self.step = step
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.spin_margin = spin_margin
+        self.name = name
+
+        self.cycle = 0
+        self.tick_time = None
+        self.error = None
+        self._running = False
+        self._thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Clear the timing statistics"""
+
+        self.jitter_histogram = [0] * (len(self.JITTER_BINS_US) + 1)
+        self.max_jitter = 0.0
+        self.deadline_misses = 0
+        self.skipped_cycles = 0
+        self.step_time = 0.0
+        self.max_step_time = 0.0
+        self.bus_io_time = 0.0
+        self.stats_cycles = 0
+
+    @contextmanager
+    def bus_io(self):
+        """Count the time spent in the block as bus I/O
+
+        Use it around motor commands inside the step function.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.bus_io_time += time.perf_counter() - start
+
+    def start(self):
+        """Start the loop thread"""
+
+        if self._running:
+            return
+        self._running = True
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the loop thread and wait for the current step to finish"""
+
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def run_for(self, duration):
+        """Start the loop, let it run for a fixed time, then stop it
+
+        Args:
+            duration (float): Run time in seconds
+        """
+
+        self.start()
+        time.sleep(duration)
+        self.stop()
+
+    def _record_jitter(self, jitter):
+        """Add one period jitter sample, in seconds, to the histogram"""
+
+        jitter_us = abs(jitter) * 1e6
+        self.max_jitter = max(self.max_jitter, abs(jitter))
+        for index, edge in enumerate(self.JITTER_BINS_US):
+            if jitter_us < edge:
+                self.jitter_histogram[index] += 1
+                return
+        self.jitter_histogram[-1] += 1
+
+    def _run(self):
+        """Call the step function on an absolute schedule"""
+
+        period = self.period
+        next_deadline = time.monotonic()
+        last_start = None
+        while self._running:
+            delay = next_deadline - time.monotonic()
+            if delay > self.spin_margin:
+                time.sleep(delay - self.spin_margin)
+            while time.monotonic() < next_deadline:
+                pass
+
+            start = time.monotonic()
+            if last_start is not None:
+                self._record_jitter(start - last_start - period)
+            last_start = start
+            self.tick_time = next_deadline
+
+            try:
+                self.step(self)
+            except Exception as e:
+                self.error = e
+                self._running = False
+                print(f"Control loop stopped by error: {e}")
+                break
+
+            end = time.monotonic()
+            step_time = end - start
+            self.step_time += step_time
+            self.max_step_time = max(self.max_step_time, step_time)
+            self.cycle += 1
+            self.stats_cycles += 1
+
+            next_deadline += period
+            if end > next_deadline:
+                self.deadline_misses += 1
+                missed = int((end - next_deadline) / period) + 1
+                self.skipped_cycles += missed
+                next_deadline += missed * period
+                # The next start is late on purpose, do not count it as jitter
+                last_start = None
+
+    def stats(self):
+        """Get the timing statistics
+
+        Returns:
+            dict: Cycles, deadline misses, skipped cycles, mean and max step
+                time, mean bus I/O time per cycle, max jitter (all times in
+                seconds) and the jitter histogram keyed by bin label
+        """
+
+        cycles = max(self.stats_cycles, 1)
+        labels = [f"<{edge}us" for edge in self.JITTER_BINS_US]
+        labels.append(f">={self.JITTER_BINS_US[-1]}us")
+        return {
+            "rate_hz": self.rate_hz,
+            "cycles": self.stats_cycles,
+            "deadline_misses": self.deadline_misses,
+            "skipped_cycles": self.skipped_cycles,
+            "mean_step_time": self.step_time / cycles,
+            "max_step_time": self.max_step_time,
+            "mean_bus_io_time": self.bus_io_time / cycles,
+            "max_jitter": self.max_jitter,
+            "jitter_histogram": dict(zip(labels, self.jitter_histogram)),
+        }
+
+    def format_stats(self):
+        """Format the timing statistics for printing"""
+
+        stats = self.stats()
+        lines = [
+            f"Rate: {stats['rate_hz']} Hz, cycles: {stats['cycles']}",
+            f"Deadline misses: {stats['deadline_misses']} (skipped cycles: {stats['skipped_cycles']})",
+            f"Step time: mean {stats['mean_step_time'] * 1e6:.0f} us, max {stats['max_step_time'] * 1e6:.0f} us",
+            f"Bus I/O time: mean {stats['mean_bus_io_time'] * 1e6:.0f} us per cycle",
+            f"Max jitter: {stats['max_jitter'] * 1e6:.0f} us",
+            "Jitter histogram:",
+        ]
+        for label, count in stats["jitter_histogram"].items():
+            lines.append(f"  {label:>9}: {count}")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Drive both motors with a status read per cycle and report the timing:
+    #   python3 Control_python-can/control_loop.py --rate 500 --seconds 5
+    import argparse
+    from pylkmotor import LKMotor
+    from pylkmotor.LKMotor import MotorGroup
+
+    parser = argparse.ArgumentParser(description="Measure the control loop timing")
+    parser.add_argument("--interface", default="socketcan")
+    parser.add_argument("--channel", default="can0")
+    parser.add_argument("--motor-ids", type=int, nargs="+", default=[2, 1])
+    parser.add_argument("--rate", type=float, default=500)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    motors = MotorGroup(
+        [LKMotor(bus_interface=args.interface, bus_channel=args.channel, motor_id=motor_id) for motor_id in args.motor_ids]
+    )
+
+    def read_status(loop):
+        with loop.bus_io():
+            motors.read_status_2()
+
+    control_loop = ControlLoop(read_status, rate_hz=args.rate)
+    control_loop.run_for(args.seconds)
+    print(control_loop.format_stats())
+    for motor in motors:
+        motor.close()
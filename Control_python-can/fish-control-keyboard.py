@@ -3,9 +3,15 @@
 
 import keyboard
 from pylkmotor import LKMotor
+from pylkmotor.LKMotor import MotorGroup
+from command_queue import CommandQueue
+from phase_control import PhaseController
+from homing import TailHoming
+from procedures import motor_startup_sequence, shutdown_sequence
+from sequence import Sequence, Step
+import argparse
 import time
 import math
-from collections import deque
 
 global target_Speed, speed_Max, speed_Min, total_Phase_Diff, current_Phase_Diff, phase_Diff_increment, init_Torque, rotate_Torque, gearBox_Ratio
 target_Speed = 0 # in degree/s
@@ -17,7 +23,6 @@ phase_Diff_increment = 5 # in degree.
 init_Torque = 60
 rotate_Torque = 180
 gearBox_Ratio = 36
-speed_samples = deque(maxlen=5)  # Adjust the maxlen for the desired window size
 
 def end_degree_to_0_01_dps_LSB(angle):
     # Convert angle to 0.01 dps LSB
@@ -34,8 +39,65 @@ def end_degree_to_1_dps_LSB(angle):
 
     return int(angle * gearBox_Ratio)
 
-def create_key_press_callback(motor_Front, motor_Rear):
-    """Factory function to create callback with motor references"""
+def create_key_press_callback(motor_Front, motor_Rear, commands, phase_controller):
+    """Factory function to create callback with motor references
+
+    The callback only updates the targets and queues the motor work on
+    `commands`, so key presses never wait for the motors. Speed and phase
+    changes go to `phase_controller`, which keeps both motors in the speed
+    loop, so the tail keeps swimming while the phase difference changes.
+    """
+    motors = MotorGroup([motor_Front, motor_Rear])
+
+    def wait_motors_stopped(cancelled, timeout=5):
+        # Returns False if the wait was cancelled by a newer command
+        if motors.wait_until_stopped(timeout=timeout, cancel=cancelled):
+            return True
+        if cancelled.is_set():
+            print("Wait Motor Stop Cancelled!")
+            return False
+        print("Wait Motor Stop Time Out!")
+        return True
+
+    def apply_target_speed(cancelled):
+        phase_controller.set_speed(target_Speed)
+        print(f"Target speed applied: {target_Speed} deg/s")
+
+    def apply_phase_diff(cancelled):
+        phase_controller.set_phase(current_Phase_Diff)
+        if phase_controller.wait_settled(timeout=2, cancel=cancelled):
+            print(f"Phase Diff reached: {current_Phase_Diff} deg")
+        elif not cancelled.is_set():
+            print(f"Phase Diff not reached: {phase_controller.phase} deg")
+
+    def stop_and_reset_phase_diff(cancelled):
+        global current_Phase_Diff
+        current_Phase_Diff = 0
+        phase_controller.set_speed(0)
+        phase_controller.set_phase(0)
+        phase_controller.wait_settled(timeout=2, cancel=cancelled)
+        phase_controller.stop()
+        motors.motor_stop()
+        wait_motors_stopped(cancelled)
+        phase_controller.start()
+
+    def redo_initialization(cancelled):
+        global current_Phase_Diff
+        print("Start Fish Tail Position Initialization")
+        phase_controller.stop()
+        phase_controller.set_speed(0)
+        homing = TailHoming(
+            motor_Front, motor_Rear, iq_control=[init_Torque, -init_Torque], max_speed=90, total_phase_diff=total_Phase_Diff
+        )
+        if not homing.run(cancel=cancelled):
+            # The zero is unknown, keep the phase controller off until the next 'r'
+            print("Position Initialization not finished, press 'r' to retry")
+            return
+        current_Phase_Diff = 0
+        phase_controller.set_phase(0)
+        phase_controller.start()
+        print("Finished Position Initialization")
+
     def on_key_press(event):
         global target_Speed, speed_Max, speed_Min, total_Phase_Diff, current_Phase_Diff, phase_Diff_increment, init_Torque, rotate_Torque, gearBox_Ratio
         """
@@ -49,147 +111,44 @@ def create_key_press_callback(motor_Front, motor_Rear):
             else:
                 target_Speed = speed_Max
             print(f"Target speed set to: {target_Speed} deg/s")
-            motor_Front.speed_loop_control(iq_control=rotate_Torque, speed_control=end_degree_to_0_01_dps_LSB(target_Speed))
-            motor_Rear.speed_loop_control(iq_control=rotate_Torque, speed_control=-end_degree_to_0_01_dps_LSB(target_Speed))
+            # Repeated presses are merged into one command with the latest target
+            commands.put(apply_target_speed, key="speed")
 
-        elif event.name == 'x':  # Check if the pressed key is 'a'
+        elif event.name == 'x':  # Check if the pressed key is 'x'
             print("Decrease speed")
             if target_Speed - 10 > speed_Min:
                 target_Speed -= 10
             else:
                 target_Speed = speed_Min
-            motor_Front.speed_loop_control(iq_control=rotate_Torque, speed_control=end_degree_to_0_01_dps_LSB(target_Speed))
-            motor_Rear.speed_loop_control(iq_control=rotate_Torque, speed_control=-end_degree_to_0_01_dps_LSB(target_Speed))
             print(f"Target speed set to: {target_Speed} deg/s")
+            commands.put(apply_target_speed, key="speed")
 
         elif event.name == 'a':  # Check if the pressed key is 'a'
             print("Increase Phase Diff")
-            motor_Front.motor_stop()
-            motor_Rear.motor_stop()
-            time.sleep(0.5)
-            motor_Front.brake_control(0) # brake
-            if abs(current_Phase_Diff + phase_Diff_increment) < total_Phase_Diff/2:
-                current_Phase_Diff += phase_Diff_increment
-            else:
-                current_Phase_Diff = total_Phase_Diff/2
+            current_Phase_Diff = min(current_Phase_Diff + phase_Diff_increment, total_Phase_Diff/2)
             print(f"Phase Diff set to: {current_Phase_Diff} deg")
-            motor_Rear.incremental_position_control(angle_increment=end_degree_to_0_01_dps_LSB(phase_Diff_increment), max_speed=end_degree_to_1_dps_LSB(20))
-            time_cycle_out = 0
-            while motor_Front.read_motor_status_2()[2] > 0.01 or motor_Rear.read_motor_status_2()[2] > 0.01:
-                print(f"Speed Front: {motor_Front.read_motor_status_2()[2]} deg/s")
-                print(f"Speed Rear: {motor_Rear.read_motor_status_2()[2]} deg/s")
-                time.sleep(0.1)
-                time_cycle_out += 1
-                print(f"Time cycle out: {time_cycle_out}")
-                if time_cycle_out == 50:
-                    print("Wait Motor Stop Time Out!")
-                    break
-            motor_Front.brake_control(1) # release brake
-            motor_Front.speed_loop_control(iq_control=rotate_Torque, speed_control=end_degree_to_0_01_dps_LSB(target_Speed))
-            motor_Rear.speed_loop_control(iq_control=rotate_Torque, speed_control=-end_degree_to_0_01_dps_LSB(target_Speed))
-
-        elif event.name == 'd':  # Check if the pressed key is 'a'
+            # Repeated presses are merged into one command with the latest target
+            commands.put(apply_phase_diff, key="phase")
+
+        elif event.name == 'd':  # Check if the pressed key is 'd'
             print("Decrease Phase Diff")
-            motor_Front.motor_stop()
-            motor_Rear.motor_stop()
-            time.sleep(0.5)
-            motor_Front.brake_control(0)
-            if abs(current_Phase_Diff + phase_Diff_increment) < total_Phase_Diff/2:
-                current_Phase_Diff -= phase_Diff_increment
-            else:
-                current_Phase_Diff = -total_Phase_Diff/2
+            current_Phase_Diff = max(current_Phase_Diff - phase_Diff_increment, -total_Phase_Diff/2)
             print(f"Phase Diff set to: {current_Phase_Diff} deg")
-            motor_Rear.incremental_position_control(angle_increment=end_degree_to_0_01_dps_LSB(-phase_Diff_increment), max_speed=end_degree_to_1_dps_LSB(20))
-            time_cycle_out = 0
-            while motor_Front.read_motor_status_2()[2] > 0.01 or motor_Rear.read_motor_status_2()[2] > 0.01:
-                print(f"Speed Front: {motor_Front.read_motor_status_2()[2]} deg/s")
-                print(f"Speed Rear: {motor_Rear.read_motor_status_2()[2]} deg/s")
-                time_cycle_out += 1
-                print(f"Time cycle out: {time_cycle_out}")
-                if time_cycle_out == 50:
-                    print("Wait Motor Stop Time Out!")
-                    break
-            motor_Front.brake_control(1)
-            motor_Front.speed_loop_control(iq_control=rotate_Torque, speed_control=end_degree_to_0_01_dps_LSB(target_Speed))
-            motor_Rear.speed_loop_control(iq_control=rotate_Torque, speed_control=-end_degree_to_0_01_dps_LSB(target_Speed))
-
-        elif event.name == 's':  # Check if the pressed key is 'a'
+            commands.put(apply_phase_diff, key="phase")
+
+        elif event.name == 's':  # Check if the pressed key is 's'
             print("Phase Diff set to 0")
-            motor_Front.motor_stop()
-            motor_Rear.motor_stop()
-            time.sleep(0.5)
-            motor_Front.brake_control(0)
-            motor_Rear.incremental_position_control(angle_increment=end_degree_to_0_01_dps_LSB(current_Phase_Diff), max_speed=end_degree_to_1_dps_LSB(90))
-            time_cycle_out = 0
-            while motor_Front.read_motor_status_2()[2] > 0.01 or motor_Rear.read_motor_status_2()[2] > 0.01:
-                print(f"Speed Front: {motor_Front.read_motor_status_2()[2]} deg/s")
-                print(f"Speed Rear: {motor_Rear.read_motor_status_2()[2]} deg/s")
-                time.sleep(0.1)
-                time_cycle_out += 1
-                print(f"Time cycle out: {time_cycle_out}")
-                if time_cycle_out == 50:
-                    print("Wait Motor Stop Time Out!")
-                    break
             current_Phase_Diff = 0
-            motor_Front.brake_control(1)
-            motor_Front.speed_loop_control(iq_control=rotate_Torque, speed_control=end_degree_to_0_01_dps_LSB(target_Speed))
-            motor_Rear.speed_loop_control(iq_control=rotate_Torque, speed_control=-end_degree_to_0_01_dps_LSB(target_Speed))
+            commands.put(apply_phase_diff, key="phase")
 
-        elif event.name == 'z':  # Check if the pressed key is 'a'
+        elif event.name == 'z':  # Check if the pressed key is 'z'
             print("Phase Diff set to 0 and stop motors")
-            motor_Front.motor_stop()
-            motor_Rear.motor_stop()
-            time.sleep(0.5)
-            motor_Front.brake_control(0)
-            motor_Rear.incremental_position_control(angle_increment=end_degree_to_0_01_dps_LSB(current_Phase_Diff), max_speed=end_degree_to_1_dps_LSB(90))
-            time_cycle_out = 0
-            while motor_Front.read_motor_status_2()[2] > 0.01 or motor_Rear.read_motor_status_2()[2] > 0.01:
-                print(f"Speed Front: {motor_Front.read_motor_status_2()[2]} deg/s")
-                print(f"Speed Rear: {motor_Rear.read_motor_status_2()[2]} deg/s")
-                time.sleep(0.1)
-                time_cycle_out += 1
-                print(f"Time cycle out: {time_cycle_out}")
-                if time_cycle_out == 50:
-                    print("Wait Motor Stop Time Out!")
-                    break
-            current_Phase_Diff = 0
-            motor_Front.brake_control(1)
-            motor_Front.motor_stop()
-            motor_Rear.motor_stop()
+            # Cancel a running phase move and drop the queued commands
+            commands.put(stop_and_reset_phase_diff, preempt=True)
 
-        elif event.name == 'r':  # Check if the pressed key is 'a'
+        elif event.name == 'r':  # Check if the pressed key is 'r'
             print("Redo Initialization")
-            print("Start Fish Tail Position Initialization")
-            motor_Front.torque_loop_control(iq_control=init_Torque)
-            motor_Rear.torque_loop_control(iq_control=-init_Torque)
-
-            # Wait for the motor to got stuck and stop
-            print("Wait for the motor to got stuck and stop")
-            time_cycle_out = 0
-            while motor_get_speed(motor_Front) > 0.01 or motor_get_speed(motor_Rear) > 0.01 or time_cycle_out < 30:
-                time.sleep(0.1)
-
-            # Stop the motor
-            motor_Front.motor_stop()
-            motor_Rear.motor_stop()
-            print("Motor Stopped")
-            time.sleep(0.5)
-
-            # Set the current position to 0
-            motor_Front.set_position_to_angle(0)
-            motor_Rear.set_position_to_angle(0)
-            time.sleep(0.5)
-
-            motor_Front.multi_turn_position_control(angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(90))
-            motor_Rear.multi_turn_position_control(angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(90))
-            time.sleep(0.5)
-
-            motor_Rear.multi_turn_position_control(angle_control=end_degree_to_0_01_dps_LSB(total_Phase_Diff), max_speed=end_degree_to_1_dps_LSB(90))
-            motor_Rear.set_position_to_angle(0)
-            time.sleep(0.5)
-            motor_Rear.multi_turn_position_control(angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(90))
-            time.sleep(0.5)
-            print("Finished Position Initialization")
+            commands.put(redo_initialization, preempt=True)
     return on_key_press
 
 def on_key_release(event):
@@ -220,104 +179,45 @@ def motor_get_speed(motor):
     return speed
 
 def main():
+    parser = argparse.ArgumentParser(description="Keyboard fish control")
+    parser.add_argument("--unattended", action="store_true", help="run the initialization without prompts")
+    args = parser.parse_args()
 
-    input("Press Enter to Start Motor Initialization")
+    if not args.unattended:
+        input("Press Enter to Start Motor Initialization")
     print("------------ Initialization ------------")
-    motor_Front = LKMotor(bus_interface="socketcan", bus_channel="can0", motor_id=2)
-    motor_Rear = LKMotor(bus_interface="socketcan", bus_channel="can0", motor_id=1)
-    
-    # Test communication before proceeding
-    try:
-        print("Testing front motor communication...")
-        status = motor_Front.read_motor_status_1()
-        print(f"Front motor status: {status}")
-        
-        print("Testing rear motor communication...")
-        status = motor_Rear.read_motor_status_1()
-        print(f"Rear motor status: {status}")
-    except Exception as e:
-        print(f"Communication error: {e}")
+    motor_Front = LKMotor(bus_interface="socketcan", bus_channel="can0", motor_id=2, gear_ratio=gearBox_Ratio)
+    motor_Rear = LKMotor(bus_interface="socketcan", bus_channel="can0", motor_id=1, gear_ratio=gearBox_Ratio)
+
+    # Both motors home at once, every step ends when its target is confirmed
+    homing = TailHoming(motor_Front, motor_Rear, iq_control=init_Torque, max_speed=20, total_phase_diff=total_Phase_Diff)
+    startup = Sequence(
+        motor_startup_sequence(motor_Front, motor_Rear, telemetry_hz=50).stages
+        + [
+            Step("Motor status", lambda: (motor_status(motor_Front), motor_status(motor_Rear))),
+            Step(
+                "Position Initialization",
+                until=lambda timeout, cancel: homing.run(cancel=cancel),
+                prompt="Press Enter to Start Fish Tail Position Initialization",
+            ),
+        ]
+    )
+    start_time = time.monotonic()
+    if not startup.run(unattended=args.unattended):
+        MotorGroup([motor_Front, motor_Rear]).motor_shutdown()
+        motor_Front.close()
+        motor_Rear.close()
         return
-
-    motor_Front.motor_shutdown()
-    motor_Rear.motor_shutdown()
-    motor_Front.motor_run()
-    motor_Rear.motor_run()
-    motor_status(motor_Front)
-    motor_status(motor_Rear)
-    print("Finished Motor Initialization")
-    time.sleep(1)
-
-    input("Press Enter to Start Fish Tail Position Initialization")
-    motor_Front.torque_loop_control(iq_control=init_Torque)
-    motor_Rear.torque_loop_control(iq_control=init_Torque)
-    # time.sleep(0.1)
-
-    # Wait for the motor to got stuck and stop
-    # print("Wait for the motor to got stuck and stop")
-    # print(f"Speed Front: {motor_Front.read_motor_status_2()[2]} deg/s")
-    # time.sleep(0.1)
-    # print(f"Speed Rear: {motor_Rear.read_motor_status_2()[2]} deg/s")
-    # time.sleep(0.1)
-
-    time_cycle_out = 0
-    while motor_Front.read_motor_status_2()[2] > 0.01 or motor_Rear.read_motor_status_2()[2] > 0.01:
-        print(f"Time cycle out: {time_cycle_out}----------------------------")
-        print(f"Current Front: {motor_Front.read_motor_status_1()[2]} A")
-        print(f"Current Rear: {motor_Rear.read_motor_status_1()[2]} A")
-        print(f"Speed Front: {motor_Front.read_motor_status_2()[2]} deg/s")
-        print(f"Speed Rear: {motor_Rear.read_motor_status_2()[2]} deg/s")
-        time.sleep(0.1)
-        time_cycle_out += 1
-        print(f"Time cycle out: {time_cycle_out}----------------------------")
-        if time_cycle_out == 50:
-            print("Wait Motor Stuck Time Out!")
-            break
-
-    # Stop the motor
-    print("Motor Stopped")
-    motor_Front.motor_stop()
-    motor_Rear.motor_stop()
-    time.sleep(2)
-
-    input("Press Enter to Continue Position Initialization")
-
-    # Set the current position to 0
-    input("Press Enter to Set the current position to 0")
-    motor_Front.set_position_to_angle(0)
-    motor_Rear.set_position_to_angle(0)
-    time.sleep(2)
-    print("set_position_to_angle 0 Finished")
-
-    input("Press Enter to Move both motors to 0 degree")
-    motor_Rear.brake_control(0) # brake
-    motor_Front.multi_turn_position_control(angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(20))
-    time.sleep(2)
-    motor_Rear.brake_control(1) # release brake
-    
-    motor_Front.brake_control(0) # brake
-    motor_Rear.multi_turn_position_control(angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(20))
-    time.sleep(2)
-    motor_Front.brake_control(1) # release brake
-    print("multi_turn_position_control Finished")
-
-    input("Press Enter to set Rear Motor to total_Phase_Diff")
-    motor_Front.brake_control(0) # brake
-    motor_Rear.multi_turn_position_control(angle_control=end_degree_to_0_01_dps_LSB(total_Phase_Diff), max_speed=end_degree_to_1_dps_LSB(20))
-    time.sleep(2)
-    motor_Rear.set_position_to_angle(0)
-    time.sleep(2)
-    motor_Rear.multi_turn_position_control(angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(20))
-    time.sleep(5)
-
-    motor_Front.brake_control(1) # release brake
-    motor_Rear.brake_control(1) # release brake
-    print("Finished Position Initialization")
+    print(f"Finished Initialization in {time.monotonic() - start_time:.1f} s")
 
     print("------------ Start Keyboard Control ------------")
-    input("Press Enter to Start Keyboard Control (Press 'Esc' to exit)")
+    if not args.unattended:
+        input("Press Enter to Start Keyboard Control (Press 'Esc' to exit)")
     # Create callback with motor references
-    key_press_callback = create_key_press_callback(motor_Front, motor_Rear)
+    commands = CommandQueue()
+    phase_controller = PhaseController(motor_Front, motor_Rear, iq_control=rotate_Torque)
+    phase_controller.start()
+    key_press_callback = create_key_press_callback(motor_Front, motor_Rear, commands, phase_controller)
     
     # Hook into key press events
     keyboard.on_press(key_press_callback)
@@ -326,37 +226,15 @@ def main():
     # Keep the program running until 'Esc' is pressed
     keyboard.wait('esc')
     print("Exiting...")
+    keyboard.unhook_all()
+    commands.close()
+    phase_controller.stop()
 
-    print("------------ Return to Middle Position ------------")
-    # Stop the motor
-    motor_Front.motor_stop()
-    motor_Rear.motor_stop()
-    print("Motor Stopped")
-    time.sleep(0.5)
+    print("------------ Return to Middle Position and Shutdown ------------")
+    shutdown_sequence(motor_Front, motor_Rear, max_speed=90, timeout=10, gear_ratio=gearBox_Ratio).run()
 
-    motor_Front.single_turn_position_control(spin_direction=0, angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(90))
-    motor_Rear.single_turn_position_control(spin_direction=0, angle_control=end_degree_to_0_01_dps_LSB(0), max_speed=end_degree_to_1_dps_LSB(90))
-    
-    time_cycle_out = 0
-    while motor_Front.read_motor_status_2()[2] > 0.01 or motor_Rear.read_motor_status_2()[2] > 0.01:
-        print(f"Speed Front: {motor_Front.read_motor_status_2()[2]} deg/s")
-        print(f"Speed Rear: {motor_Rear.read_motor_status_2()[2]} deg/s")
-        time.sleep(0.1)
-        time_cycle_out += 1
-        print(f"Time cycle out: {time_cycle_out}")
-        if time_cycle_out == 100:
-            print("Wait Motor Stop Time Out!")
-            break
-
-    print("------------ Motor and CAN Shutdown ------------")
-    motor_Front.motor_stop()
-    motor_Rear.motor_stop()
-
-    motor_Front.motor_shutdown()
-    motor_Rear.motor_shutdown()
-
-    motor_Front.bus.shutdown()
-    motor_Rear.bus.shutdown()
+    motor_Front.close()
+    motor_Rear.close()
 
     print("------------ Thank you and Goodbye! ------------")
 
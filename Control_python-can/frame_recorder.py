@@ -0,0 +1,369 @@
+# Record every CAN frame of a channel to disk, and open recordings as NumPy arrays.
+#   python3 Control_python-can/frame_recorder.py record runs/swim-01 --channel can0
+#   python3 Control_python-can/frame_recorder.py info runs/swim-01
+
+import can
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# Columns of a recording: name -> (dtype, shape of one record). Each column is
+# its own file of fixed-size records, so it maps as a flat array.
+COLUMNS = {
+    "time": (np.dtype("<f8"), ()),
+    "arbitration_id": (np.dtype("<u4"), ()),
+    "flags": (np.dtype("u1"), ()),
+    "dlc": (np.dtype("u1"), ()),
+    "data": (np.dtype("u1"), (8,)),
+}
+# Bits of the flags column
+FLAG_TX = 0x01  # sent from this host (SocketCAN marks locally sent frames)
+FLAG_EXTENDED = 0x02
+FLAG_REMOTE = 0x04
+FLAG_ERROR = 0x08
+
+# Reply layouts of the LK CAN protocol over the 8 data bytes, for zero-copy decoding
+STATUS_1_DTYPE = np.dtype(
+    [("command", "u1"), ("temperature", "i1"), ("voltage", "<i2"), ("current", "<i2"), ("motor_state", "u1"), ("error_state", "u1")]
+)
+STATUS_2_DTYPE = np.dtype([("command", "u1"), ("temperature", "i1"), ("iq", "<i2"), ("speed", "<i2"), ("encoder", "<u2")])
+# Commands whose reply is status 2: 0x9C and the closed-loop control commands
+STATUS_2_COMMANDS = (0x9C, 0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5, 0xA6, 0xA7, 0xA8)
+
+
+class FrameRecorder:
+    """Record every frame on a CAN channel into memory-mapped column files
+
+    The recorder opens its own socket on the channel, so it sees the frames
+    sent by this host as well as the received ones, with the kernel receive
+    timestamps on SocketCAN, and the control code is not touched at all. One
+    background thread receives the frames and writes them straight into a
+    memory-mapped window of each column file. When a window is full it is
+    flushed and unmapped and the files grow by one window, so the memory
+    used stays at one window however long the run is.
+
+    The decoded telemetry is not stored twice: the status replies are in
+    the data column and `FrameRecording` decodes them with zero-copy views.
+
+    Example:
+        with FrameRecorder("runs/swim-01", bus_channel="can0"):
+            ...  # run the fish
+        recording = FrameRecording("runs/swim-01")
+    """
+
+    def __init__(self, path, bus_interface="socketcan", bus_channel="can0", window=65536, **kwargs):
+        """Initialize the recorder
+
+        Args:
+            path (str): Directory of the recording, created if needed
+            bus_interface (str, optional): CAN bus interface. Defaults to "socketcan".
+            bus_channel (str, optional): CAN bus channel. Defaults to "can0".
+            window (int, optional): Records mapped at once. Defaults to 65536
+                (1.4 MB over all columns).
+            **kwargs: Additional arguments for the bus
+        """
+
+        self.path = path
+        self.bus_interface = bus_interface
+        self.bus_channel = bus_channel
+        self.window = window
+        self.bus_kwargs = kwargs
+        self.frames_recorded = 0
+        self._bus = None
+        self._files = {}
+        self._maps = {}
+        self._window_start = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Open the bus and the files and start recording"""
+
+        if self._running:
+            return self
+        os.makedirs(self.path, exist_ok=True)
+        self._files = {name: open(os.path.join(self.path, f"{name}.bin"), "w+b") for name in COLUMNS}
+        self.frames_recorded = 0
+        self._window_start = 0
+        self._map_window()
+        self._started_at = time.time()
+        self._write_meta()
+        self._bus = can.interface.Bus(interface=self.bus_interface, channel=self.bus_channel, **self.bus_kwargs)
+        self._running = True
+        self._thread = threading.Thread(target=self._record_loop, name="frame-recorder", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop recording, then flush and close the files"""
+
+        if not self._running:
+            return
+        self._running = False
+        self._thread.join()
+        self._thread = None
+        self._bus.shutdown()
+        self._bus = None
+        self._unmap_window()
+        for name, f in self._files.items():
+            dtype, shape = COLUMNS[name]
+            f.truncate(self.frames_recorded * dtype.itemsize * int(np.prod(shape, dtype=int)))
+            f.close()
+        self._files = {}
+        self._write_meta()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _map_window(self):
+        """Grow the files by one window and map it"""
+
+        self._maps = {}
+        for name, f in self._files.items():
+            dtype, shape = COLUMNS[name]
+            record_size = dtype.itemsize * int(np.prod(shape, dtype=int))
+            f.truncate((self._window_start + self.window) * record_size)
+            self._maps[name] = np.memmap(
+                f, dtype=dtype, mode="r+", offset=self._window_start * record_size, shape=(self.window,) + shape
+            )
+
+    def _unmap_window(self):
+        for column in self._maps.values():
+            column.flush()
+        self._maps = {}
+
+    def _write_meta(self):
+        meta = {
+            "interface": self.bus_interface,
+            "channel": self.bus_channel,
+            "started_at": self._started_at,
+            "count": self.frames_recorded,
+            "columns": {name: {"dtype": dtype.str, "shape": list(shape)} for name, (dtype, shape) in COLUMNS.items()},
+        }
+        temp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(temp_path, os.path.join(self.path, "meta.json"))
+
+    def _record_loop(self):
+        columns = self._maps
+        while self._running:
+            message = self._bus.recv(0.1)
+            if message is None:
+                continue
+            row = self.frames_recorded - self._window_start
+            if row == self.window:
+                # The count in meta.json lets a crashed run be opened up to here
+                self._unmap_window()
+                self._write_meta()
+                self._window_start = self.frames_recorded
+                self._map_window()
+                columns = self._maps
+                row = 0
+            columns["time"][row] = message.timestamp
+            columns["arbitration_id"][row] = message.arbitration_id
+            columns["flags"][row] = (
+                (0 if message.is_rx else FLAG_TX)
+                | (FLAG_EXTENDED if message.is_extended_id else 0)
+                | (FLAG_REMOTE if message.is_remote_frame else 0)
+                | (FLAG_ERROR if message.is_error_frame else 0)
+            )
+            dlc = min(message.dlc, 8)
+            columns["dlc"][row] = dlc
+            columns["data"][row, :dlc] = message.data[:dlc]
+            self.frames_recorded += 1
+
+
+class FrameRecording:
+    """A recording opened as read-only memory-mapped NumPy arrays
+
+    Every column (`time`, `arbitration_id`, `flags`, `dlc`, `data`) is a
+    flat array over the files, nothing is copied until it is indexed.
+
+    Example:
+        recording = FrameRecording("runs/swim-01")
+        front = recording.status_2(motor_id=2)
+        print(front["time"], front["speed"] / 36)
+    """
+
+    def __init__(self, path):
+        """Open a recording
+
+        Args:
+            path (str): Directory of the recording
+        """
+
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.count = self.meta["count"]
+        self._is_reply = None
+        for name, column in self.meta["columns"].items():
+            shape = (self.count,) + tuple(column["shape"])
+            if self.count == 0:
+                values = np.zeros(shape, dtype=column["dtype"])
+            else:
+                values = np.memmap(os.path.join(path, f"{name}.bin"), dtype=column["dtype"], mode="r", shape=shape)
+            setattr(self, name, values)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def is_tx(self):
+        """Mask of the frames sent from the recording host"""
+
+        return (self.flags & FLAG_TX).astype(bool)
+
+    def frames(self, arbitration_id=None, command_byte=None, tx=None):
+        """Indices of the frames that match
+
+        Args:
+            arbitration_id (int, optional): Only this arbitration ID
+            command_byte (int or tuple, optional): Only frames with this DATA[0]
+            tx (bool, optional): Only sent (True) or received (False) frames
+
+        Returns:
+            numpy.ndarray: Frame indices
+        """
+
+        mask = np.ones(self.count, dtype=bool)
+        if arbitration_id is not None:
+            mask &= self.arbitration_id == arbitration_id
+        if command_byte is not None:
+            mask &= np.isin(self.data[:, 0], command_byte)
+        if tx is not None:
+            mask &= self.is_tx == tx
+        return np.flatnonzero(mask)
+
+    @property
+    def is_reply(self):
+        """Mask of the motor replies, the frames received from the motors
+
+        Recordings with the direction use it. Without it (e.g. the virtual
+        bus), a command and its reply alternate per motor and command byte;
+        the request of a read command has no payload, so a frame with a
+        payload there is always a reply, and a broadcast torque frame is
+        answered with 0xA1 replies of motors 1 to 4.
+        This needs a Python loop over the frames and is cached.
+        """
+
+        if self._is_reply is None:
+            if self.is_tx.any():
+                self._is_reply = ~self.is_tx
+            else:
+                self._is_reply = self._pair_replies()
+        return self._is_reply
+
+    def _pair_replies(self):
+        indices = np.flatnonzero(
+            ((self.arbitration_id >= 0x141) & (self.arbitration_id <= 0x160)) | (self.arbitration_id == 0x280)
+        )
+        keys = self.arbitration_id[indices].astype(np.int64) << 8 | self.data[indices, 0]
+        has_payload = self.data[indices, 1:].any(axis=1)
+        replies = np.zeros(self.count, dtype=bool)
+        awaiting_reply = set()
+        # Motors 1 to 4 answer the broadcast torque frame with a 0xA1 reply
+        broadcast_replies = [(0x140 + motor_id) << 8 | 0xA1 for motor_id in range(1, 5)]
+        for index, key, payload in zip(indices.tolist(), keys.tolist(), has_payload.tolist()):
+            if key >> 8 == 0x280:
+                awaiting_reply.update(broadcast_replies)
+            elif key in awaiting_reply or (key & 0xFF in (0x9A, 0x9C, 0x92) and payload):
+                replies[index] = True
+                awaiting_reply.discard(key)
+            else:
+                awaiting_reply.add(key)
+        return replies
+
+    def _replies(self, dtype, command_byte, motor_id):
+        # Decoded with a view of the data column; only the selection copies
+        decoded = self.data.view(dtype).reshape(self.count)
+        indices = self.frames(None if motor_id is None else 0x140 + motor_id, command_byte)
+        indices = indices[self.is_reply[indices]]
+        return self.time[indices], self.arbitration_id[indices] - 0x140, decoded[indices]
+
+    def status_1(self, motor_id=None):
+        """Decoded status 1 replies (0x9A)
+
+        Returns:
+            dict: Arrays `time`, `motor_id`, `temperature`, `voltage` (V),
+                `current` (A), `motor_state` and `error_state`
+        """
+
+        times, motor_ids, replies = self._replies(STATUS_1_DTYPE, 0x9A, motor_id)
+        return {
+            "time": times,
+            "motor_id": motor_ids,
+            "temperature": replies["temperature"],
+            "voltage": replies["voltage"] * 0.01,
+            "current": replies["current"] * 0.01,
+            "motor_state": replies["motor_state"],
+            "error_state": replies["error_state"],
+        }
+
+    def status_2(self, motor_id=None):
+        """Decoded status 2 replies (0x9C and the closed-loop control commands)
+
+        Returns:
+            dict: Arrays `time`, `motor_id`, `command`, `temperature`, `iq`,
+                `speed` (dps at the motor) and `encoder`
+        """
+
+        times, motor_ids, replies = self._replies(STATUS_2_DTYPE, STATUS_2_COMMANDS, motor_id)
+        return {
+            "time": times,
+            "motor_id": motor_ids,
+            "command": replies["command"],
+            "temperature": replies["temperature"],
+            "iq": replies["iq"],
+            "speed": replies["speed"],
+            "encoder": replies["encoder"],
+        }
+
+    def multi_turn_angle(self, motor_id=None):
+        """Decoded multi-turn angle replies (0x92)
+
+        Returns:
+            dict: Arrays `time`, `motor_id` and `angle` (0.01 degree at the motor)
+        """
+
+        times, motor_ids, replies = self._replies(np.dtype("<i8"), 0x92, motor_id)
+        # int56 in DATA[1:8]: the whole frame as int64, shifted past the command byte
+        return {"time": times, "motor_id": motor_ids, "angle": replies >> 8}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record the CAN frames of a channel")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    record_parser = subparsers.add_parser("record", help="record until Ctrl+C")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--interface", default="socketcan")
+    record_parser.add_argument("--channel", default="can0")
+    info_parser = subparsers.add_parser("info", help="summarize a recording")
+    info_parser.add_argument("path")
+    args = parser.parse_args()
+
+    if args.action == "record":
+        with FrameRecorder(args.path, bus_interface=args.interface, bus_channel=args.channel) as recorder:
+            print(f"Recording {args.interface} {args.channel} to {args.path}. Press Ctrl+C to stop.")
+            try:
+                while True:
+                    time.sleep(1)
+                    print(f"Frames: {recorder.frames_recorded}")
+            except KeyboardInterrupt:
+                pass
+    else:
+        recording = FrameRecording(args.path)
+        print(f"{len(recording)} frames on {recording.meta['interface']} {recording.meta['channel']}")
+        if len(recording):
+            duration = recording.time[-1] - recording.time[0]
+            print(f"Duration {duration:.1f} s, {len(recording) / max(duration, 1e-9):.0f} frames/s, {int(recording.is_tx.sum())} sent")
+            for arbitration_id in np.unique(recording.arbitration_id):
+                print(f"  0x{arbitration_id:03X}: {int((recording.arbitration_id == arbitration_id).sum())} frames")
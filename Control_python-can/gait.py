@@ -0,0 +1,327 @@
+import threading
+import numpy as np
+from control_loop import ControlLoop
+
+GEAR_RATIO = 36
+
+
+class GaitTable:
+    """One precomputed gait cycle for a group of motors
+
+    Rows are ticks of the streaming loop, columns are motors in group order.
+    The setpoints are already in protocol units (0.01 degree for position,
+    0.01 dps for speed) and stored as Python int rows, so streaming a tick is
+    a list lookup with no math.
+    """
+
+    def __init__(self, setpoints, mode, rate_hz, max_speed=None, iq_control=180):
+        """Initialize the table
+
+        Args:
+            setpoints (numpy.ndarray): Shape (ticks, motors), protocol units
+            mode (str): "position" (multi-turn position control) or "speed" (speed loop control)
+            rate_hz (float): Streaming rate the table was computed for
+            max_speed (list, optional): Maximum speed per motor for the
+                position mode, unit: 1 dps/LSB
+            iq_control (int, optional): Torque limit for the speed mode. Defaults to 180.
+        """
+
+        if mode not in ("position", "speed"):
+            raise ValueError(f"Unknown gait mode: {mode}")
+        self.setpoints = np.asarray(setpoints, dtype=np.int64)
+        self.mode = mode
+        self.rate_hz = rate_hz
+        self.max_speed = max_speed
+        self.iq_control = iq_control
+        self.rows = self.setpoints.tolist()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def frequency(self):
+        """Actual gait frequency in Hz, after rounding the cycle to whole ticks"""
+
+        return self.rate_hz / len(self.rows)
+
+
+def _cycle_time(frequency, rate_hz):
+    """Tick times of one cycle, rounded to a whole number of ticks"""
+
+    ticks = max(int(round(rate_hz / frequency)), 2)
+    return np.arange(ticks) / rate_hz, rate_hz / ticks
+
+
+def _to_table(angles, mode, rate_hz, gear_ratio, max_speed_margin, iq_control):
+    """Convert output-shaft angles (ticks, motors) in degrees to a GaitTable"""
+
+    # Speed from the periodic central difference of the angle table
+    speeds = (np.roll(angles, -1, axis=0) - np.roll(angles, 1, axis=0)) * rate_hz / 2
+    if mode == "position":
+        peak_speed = np.abs(speeds).max(axis=0) * gear_ratio * max_speed_margin
+        max_speed = np.clip(np.ceil(peak_speed), 1, 65535).astype(int).tolist()
+        setpoints = np.round(angles * gear_ratio * 100)
+        return GaitTable(setpoints, mode, rate_hz, max_speed=max_speed)
+    setpoints = np.round(speeds * gear_ratio * 100)
+    return GaitTable(setpoints, mode, rate_hz, iq_control=iq_control)
+
+
+def sinusoidal_gait(
+    frequency,
+    amplitude,
+    phase_lag,
+    rate_hz=100,
+    mode="position",
+    motors=2,
+    center=0.0,
+    mean_speed=0.0,
+    directions=(1, -1),
+    gear_ratio=GEAR_RATIO,
+    max_speed_margin=1.5,
+    iq_control=180,
+):
+    """Sinusoidal gait: every motor follows the same sine, each one lagging the previous
+
+    Motor k follows center + amplitude * sin(2 pi f t - k * phase_lag), plus
+    a constant rotation of mean_speed in its direction.
+
+    Args:
+        frequency (float): Tail beat frequency in Hz
+        amplitude (float): Amplitude at the output shaft in degrees
+        phase_lag (float): Phase lag between neighbouring motors in degrees
+        rate_hz (float, optional): Streaming rate. Defaults to 100.
+        mode (str, optional): "position" or "speed". Defaults to "position".
+        motors (int, optional): Number of motors. Defaults to 2 (front, rear).
+        center (float or list, optional): Center angle per motor in degrees. Defaults to 0.
+        mean_speed (float, optional): Constant rotation speed in degree/s,
+            only for the speed mode. Defaults to 0.
+        directions (tuple, optional): Rotation direction per motor for the
+            mean speed. Defaults to (1, -1), like the keyboard control.
+        gear_ratio (int, optional): Gear ratio. Defaults to 36.
+        max_speed_margin (float, optional): Position mode maximum speed as a
+            multiple of the peak table speed. Defaults to 1.5.
+        iq_control (int, optional): Torque limit for the speed mode. Defaults to 180.
+
+    Returns:
+        GaitTable: One cycle of setpoints
+    """
+
+    t, actual_frequency = _cycle_time(frequency, rate_hz)
+    lags = np.radians(phase_lag) * np.arange(motors)
+    phase = 2 * np.pi * actual_frequency * t[:, None] - lags[None, :]
+    angles = np.broadcast_to(np.asarray(center, dtype=float), (motors,)) + amplitude * np.sin(phase)
+    table = _to_table(angles, mode, rate_hz, gear_ratio, max_speed_margin, iq_control)
+    if mode == "speed" and mean_speed:
+        direction = np.asarray(directions[:motors], dtype=float)
+        table = GaitTable(
+            table.setpoints + np.round(mean_speed * direction * gear_ratio * 100).astype(np.int64),
+            mode,
+            rate_hz,
+            iq_control=iq_control,
+        )
+    return table
+
+
+def cpg_gait(
+    frequency,
+    amplitude,
+    phase_lag,
+    rate_hz=100,
+    mode="position",
+    motors=2,
+    center=0.0,
+    coupling=4.0,
+    convergence=20.0,
+    settle_cycles=10,
+    gear_ratio=GEAR_RATIO,
+    max_speed_margin=1.5,
+    iq_control=180,
+):
+    """Central pattern generator gait: a chain of coupled phase oscillators
+
+    Each motor has an oscillator with phase phi and amplitude r (Ijspeert's
+    amplitude-controlled phase oscillators), coupled to its neighbours with
+    the desired phase lag:
+        dphi_k/dt = 2 pi f + sum_j coupling * r_j * sin(phi_j - phi_k - lag_kj)
+        dr_k/dt = convergence * (amplitude - r_k)
+    The chain is integrated, vectorized over the motors, until it settles,
+    and its last cycle becomes the table. The output is r_k * sin(phi_k).
+
+    Args:
+        frequency (float): Tail beat frequency in Hz
+        amplitude (float): Amplitude at the output shaft in degrees
+        phase_lag (float): Phase lag between neighbouring motors in degrees
+        rate_hz (float, optional): Streaming rate. Defaults to 100.
+        mode (str, optional): "position" or "speed". Defaults to "position".
+        motors (int, optional): Number of motors. Defaults to 2 (front, rear).
+        center (float or list, optional): Center angle per motor in degrees. Defaults to 0.
+        coupling (float, optional): Coupling weight, unit: 1/(s degree). Defaults to 4.
+        convergence (float, optional): Amplitude convergence rate, unit: 1/s. Defaults to 20.
+        settle_cycles (int, optional): Cycles integrated before the table. Defaults to 10.
+        gear_ratio (int, optional): Gear ratio. Defaults to 36.
+        max_speed_margin (float, optional): Position mode maximum speed as a
+            multiple of the peak table speed. Defaults to 1.5.
+        iq_control (int, optional): Torque limit for the speed mode. Defaults to 180.
+
+    Returns:
+        GaitTable: One cycle of setpoints
+    """
+
+    t, actual_frequency = _cycle_time(frequency, rate_hz)
+    ticks = len(t)
+    dt = 1.0 / rate_hz
+    lag = np.radians(phase_lag)
+    # Neighbour coupling matrix and the lag of motor k behind motor j
+    index = np.arange(motors)
+    neighbours = np.abs(index[:, None] - index[None, :]) == 1
+    lags = (index[:, None] - index[None, :]) * lag
+    weights = coupling * neighbours / max(amplitude, 1e-9)
+    # Integrate in substeps for stability; this runs once, when the table is built
+    substeps = 10
+    h = dt / substeps
+    phi = np.zeros(motors)
+    r = np.zeros(motors)
+    cycle = np.empty((ticks, motors))
+    first_phase = np.empty(ticks)
+    for tick in range(settle_cycles * ticks + ticks):
+        for _ in range(substeps):
+            coupling_term = (weights * r[None, :] * np.sin(phi[None, :] - phi[:, None] - lags)).sum(axis=1)
+            phi = phi + h * (2 * np.pi * actual_frequency + coupling_term)
+            r = r + h * convergence * (amplitude - r)
+        if tick >= settle_cycles * ticks:
+            cycle[tick - settle_cycles * ticks] = r * np.sin(phi)
+            first_phase[tick - settle_cycles * ticks] = phi[0]
+    # Start the cycle where the first motor's phase is 0, like the sinusoidal gait
+    cycle = np.roll(cycle, -int(np.argmin(np.mod(first_phase, 2 * np.pi))), axis=0)
+    angles = np.broadcast_to(np.asarray(center, dtype=float), (motors,)) + cycle
+    return _to_table(angles, mode, rate_hz, gear_ratio, max_speed_margin, iq_control)
+
+
+class GaitPlayer:
+    """Stream a gait table to a motor group at a fixed rate
+
+    Each tick sends one row of the table with `multi_turn_position_control`
+    or `speed_loop_control`, pipelined over the group. A new table set with
+    `set_gait` takes over at the next cycle boundary, so a cycle is never cut.
+
+    Example:
+        player = GaitPlayer(motors, sinusoidal_gait(1.0, 30, 90, rate_hz=100))
+        player.start()
+        player.set_gait(sinusoidal_gait(1.5, 30, 90, rate_hz=100))
+        ...
+        player.stop()
+    """
+
+    def __init__(self, motors, table, spin_margin=0.0):
+        """Initialize the player
+
+        Args:
+            motors (MotorGroup): Motors in table column order
+            table (GaitTable): First gait
+            spin_margin (float, optional): See `ControlLoop`. Defaults to 0.
+        """
+
+        self._check(motors, table)
+        self.motors = motors
+        self.table = table
+        self.tick = 0
+        self.cycles = 0
+        self._next_table = None
+        self._swap_lock = threading.Lock()
+        self.loop = ControlLoop(self._step, table.rate_hz, spin_margin=spin_margin, name="gait-player")
+
+    @staticmethod
+    def _check(motors, table):
+        if table.setpoints.shape[1] != len(motors):
+            raise ValueError(
+                f"Gait table has {table.setpoints.shape[1]} columns for {len(motors)} motors"
+            )
+
+    def set_gait(self, table):
+        """Switch to another gait at the next cycle boundary
+
+        Args:
+            table (GaitTable): New gait, computed for the same rate
+        """
+
+        self._check(self.motors, table)
+        if table.rate_hz != self.table.rate_hz:
+            raise ValueError(
+                f"Gait table rate {table.rate_hz} Hz does not match the player rate {self.table.rate_hz} Hz"
+            )
+        with self._swap_lock:
+            self._next_table = table
+
+    def start(self):
+        """Start streaming from the beginning of the cycle"""
+
+        self.tick = 0
+        self.loop.start()
+
+    def stop(self):
+        """Stop streaming, the motors keep their last setpoint"""
+
+        self.loop.stop()
+
+    def _step(self, loop):
+        table = self.table
+        row = table.rows[self.tick]
+        with loop.bus_io():
+            if table.mode == "position":
+                self.motors.multi_turn_position_control(angle_control=row, max_speed=table.max_speed)
+            else:
+                self.motors.speed_loop_control(iq_control=table.iq_control, speed_control=row)
+        self.tick += 1
+        if self.tick == len(table.rows):
+            self.tick = 0
+            self.cycles += 1
+            with self._swap_lock:
+                if self._next_table is not None:
+                    self.table, self._next_table = self._next_table, None
+
+
+if __name__ == "__main__":
+    # Swim with a sinusoidal gait, and switch gaits from the terminal:
+    #   python3 Control_python-can/gait.py --frequency 1 --amplitude 30 --phase-lag 90
+    import argparse
+    from pylkmotor import LKMotor
+    from pylkmotor.LKMotor import MotorGroup
+
+    parser = argparse.ArgumentParser(description="Stream a gait table to the tail motors")
+    parser.add_argument("--interface", default="socketcan")
+    parser.add_argument("--channel", default="can0")
+    parser.add_argument("--motor-ids", type=int, nargs="+", default=[2, 1], help="front and rear motor IDs")
+    parser.add_argument("--rate", type=float, default=100)
+    parser.add_argument("--mode", choices=("position", "speed"), default="position")
+    parser.add_argument("--frequency", type=float, default=1.0, help="Hz")
+    parser.add_argument("--amplitude", type=float, default=30.0, help="degree at the output shaft")
+    parser.add_argument("--phase-lag", type=float, default=90.0, help="degree")
+    parser.add_argument("--cpg", action="store_true", help="use the CPG gait instead of the sine")
+    args = parser.parse_args()
+
+    make_gait = cpg_gait if args.cpg else sinusoidal_gait
+    motors = MotorGroup(
+        [LKMotor(bus_interface=args.interface, bus_channel=args.channel, motor_id=motor_id) for motor_id in args.motor_ids]
+    )
+    motors.motor_run()
+    player = GaitPlayer(
+        motors,
+        make_gait(args.frequency, args.amplitude, args.phase_lag, rate_hz=args.rate, mode=args.mode, motors=len(motors)),
+    )
+    player.start()
+    print("Enter 'frequency amplitude phase_lag' to change the gait, empty line to exit.")
+    while True:
+        line = input("> ").strip()
+        if not line:
+            break
+        try:
+            frequency, amplitude, phase_lag = (float(value) for value in line.split())
+        except ValueError:
+            print("Expected three numbers")
+            continue
+        player.set_gait(make_gait(frequency, amplitude, phase_lag, rate_hz=args.rate, mode=args.mode, motors=len(motors)))
+    player.stop()
+    print(player.loop.format_stats())
+    motors.motor_stop()
+    for motor in motors:
+        motor.close()
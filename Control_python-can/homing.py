@@ -0,0 +1,250 @@
+import time
+from pylkmotor.LKMotor import MotorGroup
+from sequence import Sequence, Step
+
+
+class TailHoming:
+    """Home both tail motors against their hard stops, driven by telemetry
+
+    Both motors are pushed towards their hard stops at the same time with a
+    small torque. A motor has reached its stop when its speed stays near 0
+    while it still pushes with at least half the torque, for `stall_time`;
+    this is checked on the `MotorState` of each status 2 sample, so the homing ends as soon as
+    both motors are stalled. Every following move waits until its target
+    angle is confirmed and the motors are stopped, instead of a fixed sleep,
+    so the homing takes about the mechanical travel time.
+
+    The status 2 telemetry of both motors should be running
+    (`motor.start_telemetry(fields=("status_2",))`); angles are read with
+    group reads while a move is confirmed.
+
+    Example:
+        homing = TailHoming(motor_Front, motor_Rear, iq_control=60, total_phase_diff=540)
+        if not homing.run():
+            print("Homing failed")
+    """
+
+    def __init__(
+        self,
+        motor_Front,
+        motor_Rear,
+        iq_control=60,
+        max_speed=90,
+        total_phase_diff=540,
+        angle_tolerance=0.5,
+        speed_threshold=0.1,
+        stall_time=0.1,
+        poll_hz=100,
+        gear_ratio=None,
+    ):
+        """Initialize the homing
+
+        Args:
+            motor_Front (LKMotor): Front motor
+            motor_Rear (LKMotor): Rear motor, moved by the phase offset
+            iq_control (int or list, optional): Homing torque, one value for
+                both motors or one per motor. Defaults to 60.
+            max_speed (float, optional): Speed of the position moves in degree/s
+                at the output shaft. Defaults to 90.
+            total_phase_diff (float, optional): Offset of the rear motor from
+                its hard stop to its zero, in degrees at the output shaft. Defaults to 540.
+            angle_tolerance (float, optional): Angle error in degrees at the
+                output shaft that confirms a move. Defaults to 0.5.
+            speed_threshold (float, optional): Largest absolute speed counted
+                as stopped, in degree/s at the output shaft. Defaults to 0.1.
+            stall_time (float, optional): Time in seconds a motor must be
+                stalled to count as at its hard stop. Defaults to 0.1.
+            poll_hz (float, optional): Maximum checks per second. Defaults to 100.
+            gear_ratio (int, optional): Gear ratio. Defaults to None, the
+                `gear_ratio` of the front motor, which the `MotorState`
+                angles and speeds are read with.
+        """
+
+        self.motor_Front = motor_Front
+        self.motor_Rear = motor_Rear
+        self.motors = MotorGroup([motor_Front, motor_Rear])
+        self.iq_control = list(iq_control) if isinstance(iq_control, (list, tuple)) else [iq_control] * 2
+        self.max_speed = max_speed
+        self.total_phase_diff = total_phase_diff
+        self.angle_tolerance = angle_tolerance
+        self.speed_threshold = speed_threshold
+        self.stall_time = stall_time
+        self.poll_hz = poll_hz
+        self.gear_ratio = motor_Front.gear_ratio if gear_ratio is None else gear_ratio
+
+    def _travel_timeout(self, distance):
+        """Upper bound of the time a move of `distance` degrees takes"""
+
+        return 2 * abs(distance) / self.max_speed + 1.0
+
+    def wait_stalled(self, timeout=10.0, cancel=None):
+        """Wait until every motor pushes against its hard stop
+
+        Args:
+            timeout (float, optional): Timeout in seconds. Defaults to 10.
+            cancel (threading.Event, optional): Stop waiting when it is set
+
+        Returns:
+            bool: True if every motor is stalled, False on timeout or cancel
+        """
+
+        stalled_since = [None] * len(self.iq_control)
+
+        def all_stalled(states):
+            now = time.monotonic()
+            for index, (state, motor, iq_control) in enumerate(zip(states, self.motors, self.iq_control)):
+                pushing = abs(state.torque_current) >= abs(iq_control) * motor.amps_per_iq / 2
+                if abs(state.speed) <= self.speed_threshold and pushing:
+                    if stalled_since[index] is None:
+                        stalled_since[index] = now
+                else:
+                    stalled_since[index] = None
+            return all(since is not None and now - since >= self.stall_time for since in stalled_since)
+
+        return self.motors.wait_until(all_stalled, timeout, self.poll_hz, field="state", cancel=cancel)
+
+    def wait_at_angles(self, motors, angles, timeout, cancel=None):
+        """Wait until the motors are at their target angles and stopped
+
+        Args:
+            motors (MotorGroup): Motors to check
+            angles (list): Target per motor in degrees at the output shaft
+            timeout (float): Timeout in seconds
+            cancel (threading.Event, optional): Stop waiting when it is set
+
+        Returns:
+            bool: True if every motor is at its target, False on timeout or cancel
+        """
+
+        deadline = time.monotonic() + timeout
+        if not motors.wait_until(
+            lambda _: all(
+                abs(motor.state().angle - target) <= self.angle_tolerance for motor, target in zip(motors, angles)
+            ),
+            timeout,
+            self.poll_hz,
+            field="multi_turn_angle",
+            cancel=cancel,
+        ):
+            return False
+        return motors.wait_until_stopped(
+            max(deadline - time.monotonic(), 0), self.speed_threshold, self.poll_hz, cancel=cancel
+        )
+
+    def _position_command(self, motors, angles):
+        """Send the multi-turn position command for angles at the output shaft"""
+
+        return motors.multi_turn_position_control(
+            angle_control=[int(angle * self.gear_ratio * 100) for angle in angles],
+            max_speed=int(self.max_speed * self.gear_ratio),
+        )
+
+    def move_to(self, motors, angles, timeout=None, cancel=None):
+        """Move the motors to angles and wait until they are confirmed
+
+        Args:
+            motors (MotorGroup): Motors to move
+            angles (list): Target per motor in degrees at the output shaft
+            timeout (float, optional): Timeout in seconds. Defaults to None,
+                twice the travel time from the current angles plus 1 s.
+            cancel (threading.Event, optional): Stop waiting when it is set
+
+        Returns:
+            bool: True if every motor is at its target, False on timeout or cancel
+        """
+
+        if timeout is None:
+            motors.read_multi_turn_angle()
+            distance = max(abs(angle - motor.state().angle) for angle, motor in zip(angles, motors))
+            timeout = self._travel_timeout(distance)
+        self._position_command(motors, angles)
+        return self.wait_at_angles(motors, angles, timeout, cancel)
+
+    def set_zero(self, motors, cancel=None):
+        """Set the current position of the motors as 0 and confirm it
+
+        Returns:
+            bool: True if every motor reads 0, False on timeout or cancel
+        """
+
+        motors.set_position_to_angle(0)
+        return self.wait_at_angles(motors, [0] * len(motors), 1.0, cancel)
+
+    def sequence(self, stall_timeout=10.0):
+        """The homing procedure as a `Sequence`
+
+        Args:
+            stall_timeout (float, optional): Timeout in seconds to reach the
+                hard stops. Defaults to 10.
+
+        Returns:
+            Sequence: Stops the motors and releases the brakes when a step fails
+        """
+
+        motors = self.motors
+        rear = MotorGroup([self.motor_Rear])
+
+        def at_angles(group, angles):
+            return lambda timeout, cancel: self.wait_at_angles(group, angles, timeout, cancel)
+
+        def on_failure():
+            motors.motor_stop()
+            motors.brake_control(1)
+
+        return Sequence(
+            [
+                Step(
+                    "Push both motors to their hard stops",
+                    lambda: motors.broadcast_torque_control(iq_control=self.iq_control),
+                    self.wait_stalled,
+                    stall_timeout,
+                ),
+                Step(
+                    "Stop both motors",
+                    motors.motor_stop,
+                    lambda timeout, cancel: motors.wait_until_stopped(
+                        timeout, self.speed_threshold, self.poll_hz, cancel=cancel
+                    ),
+                    1.0,
+                ),
+                Step("Set the current position to 0", lambda: motors.set_position_to_angle(0), at_angles(motors, [0, 0]), 1.0),
+                Step(
+                    "Move both motors to 0 degree",
+                    lambda: self._position_command(motors, [0, 0]),
+                    at_angles(motors, [0, 0]),
+                    self._travel_timeout(0),
+                ),
+                # The front motor holds still with the brake while the rear motor moves alone
+                Step("Brake Front Motor", lambda: self.motor_Front.brake_control(0)),
+                Step(
+                    "Move Rear Motor to total_Phase_Diff",
+                    lambda: self._position_command(rear, [self.total_phase_diff]),
+                    at_angles(rear, [self.total_phase_diff]),
+                    self._travel_timeout(self.total_phase_diff),
+                ),
+                Step("Set the current position of Rear Motor to 0", lambda: rear.set_position_to_angle(0), at_angles(rear, [0]), 1.0),
+                Step(
+                    "Hold Rear Motor at 0 degree",
+                    lambda: self._position_command(rear, [0]),
+                    at_angles(rear, [0]),
+                    self._travel_timeout(0),
+                ),
+                Step("Release the brakes", lambda: motors.brake_control(1)),
+            ],
+            on_failure=on_failure,
+        )
+
+    def run(self, stall_timeout=10.0, cancel=None):
+        """Home both motors and move the rear motor by the phase offset
+
+        Args:
+            stall_timeout (float, optional): Timeout in seconds to reach the
+                hard stops. Defaults to 10.
+            cancel (threading.Event, optional): Stop the homing when it is set
+
+        Returns:
+            bool: True if the homing finished, False on a timeout or cancel.
+                The motors are stopped when it did not finish.
+        """
+
+        return self.sequence(stall_timeout).run(unattended=True, cancel=cancel)
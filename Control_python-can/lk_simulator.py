@@ -0,0 +1,553 @@
+import can
+import heapq
+import math
+import random
+import struct
+import threading
+import time
+from pylkmotor.LKMotor import (
+    _COMMAND_LAYOUTS,
+    _ENCODER_REPLY,
+    _MULTI_MOTOR_TORQUE,
+    _STATUS_1_REPLY,
+    _STATUS_2_REPLY,
+    _STATUS_3_REPLY,
+)
+
+_MULTI_TURN_ANGLE = struct.Struct("<q")
+_SINGLE_TURN_ANGLE = struct.Struct("<4xI")
+_ENCODER_OFFSET = struct.Struct("<6xH")
+_CONTROL_PARAM = struct.Struct("<BB6s")
+# Bits of a standard frame with 8 data bytes on the wire, with typical bit stuffing
+_FRAME_BITS = 130
+
+
+class SimulatedLKMotor:
+    """Model of one MG-series LK motor behind the CAN protocol
+
+    All protocol values are on the motor side of the gearbox, like on the
+    real motor: speed in dps, angles in 0.01 degree. The hard stops are given
+    at the output shaft and scaled by the gear ratio.
+
+    The dynamics are integrated in small fixed steps whenever a frame arrives:
+    - torque loop: acceleration from iq, minus viscous damping
+    - speed and position loops: acceleration limited by `max_acceleration`
+      and by the iq limit of the command
+    - speed is limited to `max_speed`, iq to `max_iq`
+    - at a hard stop the motor stalls: speed 0 and the stall error flag set
+      while it pushes into the stop
+    - with the brake engaged the motor does not move
+    """
+
+    def __init__(
+        self,
+        motor_id,
+        gear_ratio=36,
+        max_speed=19440,
+        max_iq=2048,
+        max_acceleration=200000.0,
+        acceleration_per_iq=1000.0,
+        damping=10.0,
+        hard_stops=None,
+        angle=0.0,
+        time_step=0.0005,
+    ):
+        """Initialize the motor model
+
+        Args:
+            motor_id (int): Motor ID
+            gear_ratio (int, optional): Gear ratio. Defaults to 36 (MG4010E-i36).
+            max_speed (float, optional): Speed limit, unit: dps at the motor.
+                Defaults to 19440 (90 rpm at the output).
+            max_iq (int, optional): iq limit, range up to 2048. Defaults to 2048.
+            max_acceleration (float, optional): Acceleration limit of the speed
+                and position loops, unit: dps/s at the motor. Defaults to 200000.
+            acceleration_per_iq (float, optional): Acceleration per iq LSB in
+                the torque loop, unit: dps/s. Defaults to 1000.
+            damping (float, optional): Viscous damping, unit: 1/s. Defaults to 10.
+            hard_stops (tuple, optional): (low, high) hard stops at the output
+                shaft in degrees, None for free rotation. Defaults to None.
+            angle (float, optional): Initial output angle in degrees. Defaults to 0.
+            time_step (float, optional): Integration step in seconds. Defaults to 0.0005.
+        """
+
+        self.motor_id = motor_id
+        self.gear_ratio = gear_ratio
+        self.max_speed = max_speed
+        self.max_iq = max_iq
+        self.max_acceleration = max_acceleration
+        self.acceleration_per_iq = acceleration_per_iq
+        self.damping = damping
+        self.time_step = time_step
+        if hard_stops is None:
+            self.hard_stops = None
+        else:
+            self.hard_stops = (hard_stops[0] * gear_ratio, hard_stops[1] * gear_ratio)
+
+        self.angle = angle * gear_ratio  # degree at the motor
+        self.angle_offset = 0.0  # set by 0x95, multi-turn angle = angle - offset
+        self.speed = 0.0  # dps at the motor
+        self.iq = 0.0
+        self.running = False
+        self.braked = False
+        self.stalled = False
+        self.mode = None
+        self.iq_command = 0
+        self.speed_command = 0.0
+        self.position_target = 0.0
+        self.position_max_speed = max_speed
+        self.encoder_offset = 0
+        self.temperature = 30
+        self.voltage = 24.0
+        self.control_params = {}
+        self.last_update = None
+
+    def _limit(self, value, limit):
+        return max(-limit, min(limit, value))
+
+    def advance(self, now):
+        """Integrate the dynamics up to `now` (time.monotonic())"""
+
+        if self.last_update is None:
+            self.last_update = now
+            return
+        while self.last_update + self.time_step <= now:
+            self._step(self.time_step)
+            self.last_update += self.time_step
+
+    def _step(self, dt):
+        """Integrate the dynamics over one time step"""
+
+        if not self.running or self.braked:
+            self.speed = 0.0
+            self.iq = 0.0 if not self.running else self.iq
+        elif self.mode == "torque":
+            self.iq = self._limit(self.iq_command, self.max_iq)
+            acceleration = self.iq * self.acceleration_per_iq - self.damping * self.speed
+            self.speed = self._limit(self.speed + acceleration * dt, self.max_speed)
+        else:
+            if self.mode == "speed":
+                target_speed = self.speed_command
+                iq_limit = min(abs(self.iq_command), self.max_iq)
+            elif self.mode == "position":
+                error = self.position_target - self.angle
+                # Speed that can still stop at the target with max acceleration
+                target_speed = math.copysign(
+                    min(math.sqrt(2 * self.max_acceleration * abs(error)), abs(error) / dt),
+                    error,
+                )
+                target_speed = self._limit(target_speed, self.position_max_speed)
+                iq_limit = self.max_iq
+            else:
+                # Stopped: brake to zero speed
+                target_speed = 0.0
+                iq_limit = self.max_iq
+            target_speed = self._limit(target_speed, self.max_speed)
+            max_delta = min(self.max_acceleration, iq_limit * self.acceleration_per_iq) * dt
+            delta = self._limit(target_speed - self.speed, max_delta)
+            self.speed += delta
+            self.iq = self._limit(
+                (delta / dt + self.damping * self.speed) / self.acceleration_per_iq,
+                iq_limit,
+            )
+
+        self.angle += self.speed * dt
+        self.stalled = False
+        if self.hard_stops is not None:
+            low, high = self.hard_stops
+            if self.angle <= low:
+                self.angle = low
+                self.stalled = self.iq < 0
+                self.speed = max(self.speed, 0.0)
+            elif self.angle >= high:
+                self.angle = high
+                self.stalled = self.iq > 0
+                self.speed = min(self.speed, 0.0)
+
+    @property
+    def multi_turn_angle(self):
+        """Multi-turn angle, unit: 0.01 degree/LSB"""
+
+        return int(round((self.angle - self.angle_offset) * 100))
+
+    @property
+    def encoder_raw(self):
+        """Raw 16-bit encoder value of the motor shaft"""
+
+        return int((self.angle % 360.0) / 360.0 * 65536) & 0xFFFF
+
+    @property
+    def encoder_value(self):
+        return (self.encoder_raw - self.encoder_offset) & 0xFFFF
+
+    def _status_1(self, reply, command_byte):
+        current = int(round(abs(self.iq) * 66 / 4096 * 100))
+        _STATUS_1_REPLY.pack_into(
+            reply,
+            0,
+            self.temperature,
+            int(round(self.voltage * 100)),
+            current,
+            0x00 if self.running else 0x10,
+            0x40 if self.stalled else 0x00,
+        )
+        reply[0] = command_byte
+
+    def _status_2(self, reply, command_byte):
+        _STATUS_2_REPLY.pack_into(
+            reply,
+            0,
+            self.temperature,
+            int(round(self.iq)),
+            int(round(self._limit(self.speed, 32767))),
+            self.encoder_value,
+        )
+        reply[0] = command_byte
+
+    def _status_3(self, reply, command_byte):
+        electrical = math.radians(self.angle * 14)
+        currents = [
+            int(round(self.iq * math.cos(electrical - shift)))
+            for shift in (0.0, 2 * math.pi / 3, 4 * math.pi / 3)
+        ]
+        _STATUS_3_REPLY.pack_into(reply, 0, self.temperature, *currents)
+        reply[0] = command_byte
+
+    def handle(self, data, now):
+        """Handle one command frame
+
+        Args:
+            data (bytearray): Command frame data
+            now (float): Receive time, `time.monotonic()`
+
+        Returns:
+            bytearray: Reply frame data
+        """
+
+        self.advance(now)
+        command_byte = data[0]
+        reply = bytearray(8)
+        reply[0] = command_byte
+
+        if command_byte == 0x80:
+            self.running = False
+            self.mode = None
+            self.angle_offset = self.angle - (self.angle % (360.0 * self.gear_ratio))
+        elif command_byte == 0x81:
+            self.mode = None
+        elif command_byte == 0x88:
+            self.running = True
+        elif command_byte == 0x8C:
+            control_byte = data[1]
+            if control_byte == 0x00:
+                self.braked = True
+            elif control_byte == 0x01:
+                self.braked = False
+            reply[1] = 0x00 if self.braked else 0x01
+            return reply
+        elif command_byte in (0x9A, 0x9B):
+            self._status_1(reply, command_byte)
+            return reply
+        elif command_byte == 0x9D:
+            self._status_3(reply, command_byte)
+            return reply
+        elif command_byte == 0x90:
+            _ENCODER_REPLY.pack_into(
+                reply, 0, self.encoder_value, self.encoder_raw, self.encoder_offset
+            )
+            reply[0] = command_byte
+            return reply
+        elif command_byte == 0x19:
+            self.encoder_offset = self.encoder_raw
+            _ENCODER_OFFSET.pack_into(reply, 0, self.encoder_offset)
+            reply[0] = command_byte
+            return reply
+        elif command_byte == 0x92:
+            _MULTI_TURN_ANGLE.pack_into(reply, 0, (self.multi_turn_angle << 8) | command_byte)
+            return reply
+        elif command_byte == 0x94:
+            full_turn = 36000 * self.gear_ratio
+            _SINGLE_TURN_ANGLE.pack_into(reply, 0, self.multi_turn_angle % full_turn)
+            reply[0] = command_byte
+            return reply
+        elif command_byte == 0x95:
+            _, multi_turn_angle = _COMMAND_LAYOUTS[0x95].unpack_from(data)
+            self.angle_offset = self.angle - multi_turn_angle / 100
+            if self.mode == "position":
+                self.position_target = self.angle
+            return bytearray(data)
+        elif command_byte == 0xC0:
+            param_id = data[1]
+            reply[1] = param_id
+            reply[2:8] = self.control_params.get(param_id, bytes(6))
+            return reply
+        elif command_byte == 0xC1:
+            _, param_id, param_bytes = _CONTROL_PARAM.unpack_from(data)
+            self.control_params[param_id] = param_bytes
+            return bytearray(data)
+        elif command_byte in _COMMAND_LAYOUTS and self.running:
+            self._control(command_byte, _COMMAND_LAYOUTS[command_byte].unpack_from(data)[1:])
+            self._status_2(reply, command_byte)
+            return reply
+        elif 0xA0 <= command_byte <= 0xA8:
+            # The motor replies, but does not execute commands while it is off
+            self._status_2(reply, command_byte)
+            return reply
+        else:
+            self._status_2(reply, 0x9C)
+            reply[0] = command_byte
+            return reply
+        return reply
+
+    def torque(self, iq_control):
+        """Torque loop control, also used by the multi-motor torque frame"""
+
+        self.mode = "torque"
+        self.iq_command = iq_control
+        if self.running and not self.braked:
+            self.iq = self._limit(iq_control, self.max_iq)
+
+    def _control(self, command_byte, values):
+        """Apply a closed-loop control command"""
+
+        full_turn = 360.0 * self.gear_ratio
+        if command_byte == 0xA1:
+            self.torque(values[0])
+        elif command_byte == 0xA2:
+            self.mode = "speed"
+            self.iq_command, speed_control = values
+            self.speed_command = speed_control / 100
+        elif command_byte in (0xA3, 0xA4):
+            self.position_max_speed = self.max_speed if command_byte == 0xA3 else values[0]
+            self.mode = "position"
+            self.position_target = values[-1] / 100 + self.angle_offset
+        elif command_byte in (0xA5, 0xA6):
+            spin_direction = values[0]
+            self.position_max_speed = self.max_speed if command_byte == 0xA5 else values[1]
+            target = values[-1] / 100
+            current = (self.angle - self.angle_offset) % full_turn
+            if spin_direction == 0x00:
+                delta = (target - current) % full_turn
+            else:
+                delta = -((current - target) % full_turn)
+            self.mode = "position"
+            self.position_target = self.angle + delta
+        elif command_byte in (0xA7, 0xA8):
+            self.position_max_speed = self.max_speed if command_byte == 0xA7 else values[0]
+            self.mode = "position"
+            self.position_target = self.angle + values[-1] / 100
+
+
+class LKMotorSimulator:
+    """Simulated LK motors answering on a CAN bus
+
+    Runs on python-can's `virtual` interface (in the same process as the
+    motors) or on a Linux `vcan` interface (for scripts in other processes).
+    Replies go out on 0x140 + ID, like the motors `LKMotor` talks to, after
+    a configurable latency, and a configurable share of them is dropped.
+    With a bit rate, every command and reply occupies the simulated wire for
+    the time of one frame, so a channel saturates like a real CAN bus.
+    The multi-motor torque frame (0x280) is answered by motor IDs 1 to 4.
+    """
+
+    def __init__(
+        self,
+        bus_interface="virtual",
+        bus_channel="vcan0",
+        motor_ids=(1, 2),
+        latency=0.0002,
+        drop_rate=0.0,
+        seed=None,
+        bitrate=None,
+        **motor_kwargs,
+    ):
+        """Initialize the simulator
+
+        Args:
+            bus_interface (str, optional): CAN bus interface. Defaults to "virtual".
+            bus_channel (str, optional): CAN bus channel. Defaults to "vcan0".
+            motor_ids (tuple, optional): IDs of the simulated motors. Defaults to (1, 2).
+            latency (float, optional): Reply latency in seconds. Defaults to 0.0002
+                (the protocol allows up to 0.25 ms).
+            drop_rate (float, optional): Share of replies that are dropped,
+                from 0 to 1. Defaults to 0.
+            seed (int, optional): Seed for the drop decisions
+            bitrate (int, optional): Bit rate of the simulated wire, e.g. 1000000.
+                Defaults to None, an infinitely fast wire.
+            **motor_kwargs: Arguments for every `SimulatedLKMotor`, e.g. hard_stops
+        """
+
+        self.bus_interface = bus_interface
+        self.bus_channel = bus_channel
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.frame_time = _FRAME_BITS / bitrate if bitrate else 0.0
+        self.motors = {
+            motor_id: SimulatedLKMotor(motor_id, **motor_kwargs) for motor_id in motor_ids
+        }
+        self.frames_received = 0
+        self.replies_sent = 0
+        self.replies_dropped = 0
+
+        self._random = random.Random(seed)
+        self._wire_free_at = 0.0
+        self._bus = None
+        self._replies = []
+        self._replies_ready = threading.Condition()
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        """Open the bus and start answering"""
+
+        if self._running:
+            return self
+        # Only the command frames of the simulated motors and the multi-motor torque frame
+        can_filters = [
+            {"can_id": arbitration_id, "can_mask": 0x7FF, "extended": False}
+            for arbitration_id in [0x140 + motor_id for motor_id in self.motors] + [0x280]
+        ]
+        self._bus = can.interface.Bus(
+            interface=self.bus_interface, channel=self.bus_channel, can_filters=can_filters
+        )
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._receive_loop, name="lk-simulator-rx", daemon=True),
+            threading.Thread(target=self._reply_loop, name="lk-simulator-tx", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Stop answering and shut down the bus"""
+
+        self._running = False
+        with self._replies_ready:
+            self._replies_ready.notify()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
+        if self._bus is not None:
+            self._bus.shutdown()
+            self._bus = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _occupy_wire(self, earliest):
+        """Time at which a frame that can start at `earliest` is completely on the wire"""
+
+        self._wire_free_at = max(earliest, self._wire_free_at) + self.frame_time
+        return self._wire_free_at
+
+    def _schedule(self, motor_id, data, now):
+        """Queue a reply, or drop it"""
+
+        if self.drop_rate and self._random.random() < self.drop_rate:
+            self.replies_dropped += 1
+            return
+        message = can.Message(arbitration_id=0x140 + motor_id, data=data, is_extended_id=False)
+        with self._replies_ready:
+            due = self._occupy_wire(now + self.latency) if self.frame_time else now + self.latency
+            heapq.heappush(self._replies, (due, self.replies_sent, message))
+            self.replies_sent += 1
+            self._replies_ready.notify()
+
+    def _receive_loop(self):
+        """Answer every command frame for the simulated motors"""
+
+        while self._running:
+            message = self._bus.recv(0.1)
+            if message is None or message.is_extended_id or len(message.data) < 8:
+                continue
+            now = time.monotonic()
+            if self.frame_time:
+                # The command is complete on the wire only after the frames before it
+                with self._replies_ready:
+                    now = self._occupy_wire(now - self.frame_time)
+            arbitration_id = message.arbitration_id
+            if arbitration_id == 0x280:
+                self.frames_received += 1
+                for index, iq_control in enumerate(_MULTI_MOTOR_TORQUE.unpack_from(message.data)):
+                    motor = self.motors.get(index + 1)
+                    if motor is None:
+                        continue
+                    motor.advance(now)
+                    if motor.running:
+                        motor.torque(iq_control)
+                    reply = bytearray(8)
+                    motor._status_2(reply, 0xA1)
+                    self._schedule(motor.motor_id, reply, now)
+                continue
+            motor = self.motors.get(arbitration_id - 0x140)
+            if motor is None:
+                continue
+            self.frames_received += 1
+            self._schedule(motor.motor_id, motor.handle(message.data, now), now)
+
+    def _reply_loop(self):
+        """Send the queued replies when they are due"""
+
+        while self._running:
+            with self._replies_ready:
+                if not self._replies:
+                    self._replies_ready.wait(0.1)
+                    continue
+                due, _, message = self._replies[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._replies_ready.wait(delay)
+                    continue
+                heapq.heappop(self._replies)
+            self._bus.send(message)
+
+
+if __name__ == "__main__":
+    # Run simulated motors on a vcan interface named like the real one, so
+    # the control scripts run unchanged in another terminal:
+    #   sudo ip link add dev can0 type vcan
+    #   sudo ip link set up can0
+    #   python3 Control_python-can/lk_simulator.py --channel can0 --hard-stops -300 300
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulated LK motors on a CAN bus")
+    parser.add_argument("--interface", default="socketcan")
+    parser.add_argument("--channel", default="can0")
+    parser.add_argument("--motor-ids", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--latency", type=float, default=0.0002, help="reply latency in seconds")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of dropped replies")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--bitrate", type=int, default=None, help="bit rate of the simulated wire")
+    parser.add_argument(
+        "--hard-stops", type=float, nargs=2, default=None, metavar=("LOW", "HIGH"),
+        help="hard stops at the output shaft in degrees",
+    )
+    args = parser.parse_args()
+
+    simulator = LKMotorSimulator(
+        bus_interface=args.interface,
+        bus_channel=args.channel,
+        motor_ids=args.motor_ids,
+        latency=args.latency,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+        bitrate=args.bitrate,
+        hard_stops=args.hard_stops,
+    )
+    simulator.start()
+    print(f"Simulating LK motors {args.motor_ids} on {args.interface} {args.channel}. Press Ctrl+C to exit.")
+    try:
+        while True:
+            time.sleep(1)
+            states = ", ".join(
+                f"{motor_id}: {motor.angle / motor.gear_ratio:.1f} deg {motor.speed / motor.gear_ratio:.1f} deg/s"
+                for motor_id, motor in simulator.motors.items()
+            )
+            print(f"Frames: {simulator.frames_received}, replies: {simulator.replies_sent}, dropped: {simulator.replies_dropped} | {states}")
+    except KeyboardInterrupt:
+        pass
+    simulator.stop()
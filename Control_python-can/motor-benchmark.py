@@ -0,0 +1,307 @@
+# Latency and throughput benchmark of LKMotor and the keyboard control script.
+# By default it runs against simulated motors on python-can's virtual bus, so
+# no hardware is needed:
+#   python3 Control_python-can/motor-benchmark.py --output benchmark.json
+# Against a vcan interface with lk_simulator.py running in another terminal
+# (or against the real motors, which will move):
+#   python3 Control_python-can/motor-benchmark.py --interface socketcan --channel can0
+# The report is JSON, so runs before and after a change of LKMotor-change.py
+# can be compared by a script.
+
+import argparse
+import can
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import threading
+import time
+import timeit
+import types
+from pylkmotor import LKMotor
+from pylkmotor.LKMotor import MotorGroup, _COMMAND_LAYOUTS, _STATUS_2_REPLY
+from lk_simulator import LKMotorSimulator
+
+# Commands that only read the motor state
+READ_COMMANDS = {0x90, 0x92, 0x94, 0x9A, 0x9C, 0x9D, 0xC0}
+KEYBOARD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fish-control-keyboard.py")
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, failures=0):
+    """Summarize latency samples in seconds as microsecond statistics"""
+
+    samples = sorted(samples)
+    count = len(samples)
+    return {
+        "count": count,
+        "failures": failures,
+        "mean_us": sum(samples) / count * 1e6 if count else None,
+        "p50_us": percentile(samples, 0.50) * 1e6 if count else None,
+        "p90_us": percentile(samples, 0.90) * 1e6 if count else None,
+        "p99_us": percentile(samples, 0.99) * 1e6 if count else None,
+        "max_us": samples[-1] * 1e6 if count else None,
+    }
+
+
+def bench_rtt(motor, iterations):
+    """Round-trip time of single commands to one motor"""
+
+    commands = {
+        "0x88 motor_run": motor.motor_run,
+        "0x9A read_motor_status_1": motor.read_motor_status_1,
+        "0x9C read_motor_status_2": lambda: motor.read_motor_status_2(retries=1),
+        "0x92 read_multi_turn_angle": motor.read_multi_turn_angle,
+        "0xA2 speed_loop_control": lambda: motor.speed_loop_control(iq_control=180, speed_control=0),
+    }
+    results = {}
+    for name, command in commands.items():
+        samples = []
+        failures = 0
+        for _ in range(iterations):
+            start = time.perf_counter()
+            result = command()
+            samples.append(time.perf_counter() - start)
+            if result is None or result == (0, 0, 0, 0):
+                failures += 1
+        results[name] = summarize(samples, failures)
+    return results
+
+
+def bench_throughput(motors, duration):
+    """Status reads per second for one motor, two motors in turn and a pipelined group"""
+
+    def run(step, commands_per_step):
+        steps = 0
+        end = time.perf_counter() + duration
+        start = time.perf_counter()
+        while time.perf_counter() < end:
+            step()
+            steps += 1
+        elapsed = time.perf_counter() - start
+        return {"commands": steps * commands_per_step, "commands_per_sec": steps * commands_per_step / elapsed}
+
+    group = MotorGroup(motors)
+    results = {"1 motor": run(lambda: motors[0].read_motor_status_2(retries=1), 1)}
+    if len(motors) > 1:
+        results[f"{len(motors)} motors sequential"] = run(
+            lambda: [motor.read_motor_status_2(retries=1) for motor in motors], len(motors)
+        )
+        results[f"{len(motors)} motors pipelined"] = run(group.read_status_2, len(motors))
+    return results
+
+
+def bench_timeout(bus_interface, bus_channel, missing_id, iterations):
+    """Time a command costs when the motor does not answer"""
+
+    motor = LKMotor(bus_interface=bus_interface, bus_channel=bus_channel, motor_id=missing_id)
+    try:
+        results = {}
+        for name, command in (
+            ("0x9A read_motor_status_1", motor.read_motor_status_1),
+            ("0x9C read_motor_status_2 (3 retries)", motor.read_motor_status_2),
+        ):
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                command()
+                samples.append(time.perf_counter() - start)
+            results[name] = summarize(samples, failures=iterations)
+        return results
+    finally:
+        motor.close()
+
+
+def bench_codec(number):
+    """Nanoseconds to encode a speed command and decode a status 2 reply"""
+
+    tx_message = can.Message(arbitration_id=0x141, data=bytearray(8), is_extended_id=False)
+    speed_layout = _COMMAND_LAYOUTS[0xA2]
+    reply = bytearray([0xA2, 0x1E, 0x34, 0xFF, 0x10, 0x27, 0x00, 0x20])
+
+    def encode():
+        speed_layout.pack_into(tx_message.data, 0, 0xA2, -180, 324000)
+
+    def decode():
+        return _STATUS_2_REPLY.unpack_from(reply)
+
+    return {
+        name: {"ns_per_frame": min(timeit.repeat(function, number=number, repeat=5)) / number * 1e9}
+        for name, function in (("encode 0xA2", encode), ("decode 0x9C", decode))
+    }
+
+
+def load_keyboard_script():
+    """Import fish-control-keyboard.py as a module without running main()"""
+
+    spec = importlib.util.spec_from_file_location("fish_control_keyboard", KEYBOARD_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_keys(motors, bus_interface, bus_channel, keys, repeats, timeout):
+    """End-to-end latency of keyboard actions
+
+    For each key press this measures the time until the first control frame
+    is on the bus (status reads, e.g. by the phase controller, do not count),
+    and until the queued motor work has finished.
+    """
+
+    from command_queue import CommandQueue
+    from phase_control import PhaseController
+
+    script = load_keyboard_script()
+    motor_Front, motor_Rear = motors[0], motors[1]
+    tx_ids = {0x140 + motor.motor_id for motor in motors} | {0x280}
+    commands = CommandQueue()
+    phase_controller = PhaseController(motor_Front, motor_Rear)
+    on_key_press = script.create_key_press_callback(motor_Front, motor_Rear, commands, phase_controller)
+    sniffer = can.interface.Bus(interface=bus_interface, channel=bus_channel)
+    results = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            MotorGroup(motors).motor_run()
+            phase_controller.start()
+            for key in keys:
+                first_frame = []
+                completion = []
+                for _ in range(repeats):
+                    while sniffer.recv(0) is not None:
+                        pass
+                    done = threading.Event()
+                    start = time.perf_counter()
+                    on_key_press(types.SimpleNamespace(name=key))
+                    commands.put(lambda cancelled: done.set())
+                    deadline = time.monotonic() + timeout
+                    while time.monotonic() < deadline:
+                        message = sniffer.recv(deadline - time.monotonic())
+                        if (
+                            message is not None
+                            and message.arbitration_id in tx_ids
+                            and message.data[0] not in READ_COMMANDS
+                        ):
+                            first_frame.append(time.perf_counter() - start)
+                            break
+                    if done.wait(max(0.0, deadline - time.monotonic())):
+                        completion.append(time.perf_counter() - start)
+                results[key] = {
+                    "first_frame": summarize(first_frame, repeats - len(first_frame)),
+                    "completed": summarize(completion, repeats - len(completion)),
+                }
+            MotorGroup(motors).motor_stop()
+    finally:
+        commands.close()
+        phase_controller.stop()
+        sniffer.shutdown()
+    return results
+
+
+def format_report(report):
+    """Format the report for printing"""
+
+    def us(value):
+        return "-" if value is None else f"{value:.0f}"
+
+    lines = ["------------ Round-trip time (us) ------------"]
+    for name, stats in report["rtt"].items():
+        lines.append(
+            f"{name:<36} p50 {us(stats['p50_us']):>7} p90 {us(stats['p90_us']):>7} "
+            f"p99 {us(stats['p99_us']):>7} max {us(stats['max_us']):>7} failures {stats['failures']}"
+        )
+    lines.append("------------ Throughput ------------")
+    for name, stats in report["throughput"].items():
+        lines.append(f"{name:<36} {stats['commands_per_sec']:.0f} cmds/s")
+    lines.append("------------ Timeout cost (ms) ------------")
+    for name, stats in report["timeout"].items():
+        lines.append(f"{name:<36} mean {stats['mean_us'] / 1000:.1f} ms")
+    lines.append("------------ Codec (ns per frame) ------------")
+    for name, stats in report["codec"].items():
+        lines.append(f"{name:<36} {stats['ns_per_frame']:.0f} ns")
+    if report["keys"]:
+        lines.append("------------ Keyboard actions (ms) ------------")
+        for key, stats in report["keys"].items():
+            first_frame = stats["first_frame"]["p50_us"]
+            completed = stats["completed"]["p50_us"]
+            lines.append(
+                f"'{key}': first frame p50 {'-' if first_frame is None else f'{first_frame / 1000:.2f}'} ms, "
+                f"completed p50 {'-' if completed is None else f'{completed / 1000:.0f}'} ms"
+            )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LKMotor latency and throughput")
+    parser.add_argument("--interface", default="virtual", help="'virtual' starts simulated motors")
+    parser.add_argument("--channel", default="lk-benchmark")
+    parser.add_argument("--motor-ids", type=int, nargs="+", default=[2, 1], help="front and rear motor IDs")
+    parser.add_argument("--gear-ratio", type=float, default=36, help="gear ratio of the motors")
+    parser.add_argument("--missing-id", type=int, default=32, help="motor ID nobody answers, for the timeout cost")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per throughput run")
+    parser.add_argument("--keys", default="wasr", help="keyboard actions to time, empty to skip")
+    parser.add_argument("--key-repeats", type=int, default=3)
+    parser.add_argument("--sim-latency", type=float, default=0.0002, help="reply latency of the simulated motors")
+    parser.add_argument("--output", help="write the JSON report to this file, '-' for stdout")
+    args = parser.parse_args()
+
+    simulator = None
+    if args.interface == "virtual":
+        simulator = LKMotorSimulator(
+            bus_channel=args.channel,
+            motor_ids=args.motor_ids,
+            latency=args.sim_latency,
+            hard_stops=(-300, 300),
+        ).start()
+    motors = [
+        LKMotor(bus_interface=args.interface, bus_channel=args.channel, motor_id=motor_id, gear_ratio=args.gear_ratio)
+        for motor_id in args.motor_ids
+    ]
+    try:
+        report = {
+            "meta": {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "interface": args.interface,
+                "channel": args.channel,
+                "simulated": simulator is not None,
+                "sim_latency": args.sim_latency if simulator is not None else None,
+                "motor_ids": args.motor_ids,
+            },
+            "rtt": bench_rtt(motors[0], args.iterations),
+            "throughput": bench_throughput(motors, args.duration),
+            "timeout": bench_timeout(args.interface, args.channel, args.missing_id, 3),
+            "codec": bench_codec(100000),
+            "keys": {},
+        }
+        if args.keys and len(motors) >= 2:
+            report["keys"] = bench_keys(motors, args.interface, args.channel, args.keys, args.key_repeats, timeout=15)
+    finally:
+        for motor in motors:
+            motor.close()
+        if simulator is not None:
+            simulator.stop()
+
+    if args.output == "-":
+        print(json.dumps(report, indent=2))
+        return
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -47,4 +47,4 @@ time.sleep(5)
 print("------------ Motor and CAN Shutdown ------------")
 motor.motor_stop()
 motor.motor_shutdown()
-motor.bus.shutdown()
\ No newline at end of file
+motor.close()
@@ -93,6 +93,7 @@ while True:
 
 
 print("------------ Motor and CAN Shutdown ------------")
-motor.motor_stop()
-motor.motor_shutdown()
-motor.bus.shutdown()
\ No newline at end of file
+for motor in (motor1, motor2):
+    motor.motor_stop()
+    motor.motor_shutdown()
+    motor.close()
@@ -0,0 +1,153 @@
+import threading
+import time
+from pylkmotor.LKMotor import MotorGroup
+from control_loop import ControlLoop
+
+
+class PhaseController:
+    """Keep both tail motors in the speed loop and steer their phase difference
+
+    The front motor turns at +speed and the rear motor at -speed, so the sum
+    of their multi-turn angles stays constant while swimming. That sum,
+    at the output shaft, is the phase difference. Every tick the controller
+    reads both angles and sets the rear speed to -speed plus a correction
+    proportional to the phase error, limited to `max_correction`, so the
+    phase moves to its target while the tail keeps swimming.
+
+    The phase difference is 0 where both multi-turn angles were set to 0,
+    i.e. at the end of the position initialization.
+
+    Example:
+        controller = PhaseController(motor_Front, motor_Rear)
+        controller.start()
+        controller.set_speed(90)
+        controller.set_phase(5)
+        controller.wait_settled(timeout=1)
+        ...
+        controller.stop()
+    """
+
+    def __init__(
+        self,
+        motor_Front,
+        motor_Rear,
+        rate_hz=50,
+        gain=8.0,
+        max_correction=90.0,
+        tolerance=0.5,
+        iq_control=180,
+        gear_ratio=None,
+    ):
+        """Initialize the controller
+
+        Args:
+            motor_Front (LKMotor): Front motor, turns at +speed
+            motor_Rear (LKMotor): Rear motor, turns at -speed plus the correction
+            rate_hz (float, optional): Control rate. Defaults to 50.
+            gain (float, optional): Correction speed per degree of phase error,
+                unit: 1/s. Defaults to 8.
+            max_correction (float, optional): Largest correction in degree/s
+                at the output shaft. Defaults to 90.
+            tolerance (float, optional): Phase error in degrees that counts as
+                settled. Defaults to 0.5.
+            iq_control (int, optional): Torque limit of the speed loop. Defaults to 180.
+            gear_ratio (int, optional): Gear ratio of the speed commands.
+                Defaults to None, the `gear_ratio` of the front motor, which
+                the `MotorState` angles are read with.
+        """
+
+        self.motors = MotorGroup([motor_Front, motor_Rear])
+        self.gain = gain
+        self.max_correction = max_correction
+        self.tolerance = tolerance
+        self.iq_control = iq_control
+        self.gear_ratio = motor_Front.gear_ratio if gear_ratio is None else gear_ratio
+
+        self.speed = 0.0  # degree/s at the output shaft
+        self.target_phase = 0.0  # degree at the output shaft
+        self.phase = None
+        self.correction = 0.0
+        self._settled = threading.Event()
+        self._commanding = False
+        self.loop = ControlLoop(self._step, rate_hz, name="phase-controller")
+
+    def set_speed(self, speed):
+        """Set the swimming speed
+
+        Args:
+            speed (float): Speed in degree/s at the output shaft, front +speed, rear -speed
+        """
+
+        self.speed = speed
+
+    def set_phase(self, phase):
+        """Set the target phase difference
+
+        Args:
+            phase (float): Target in degrees at the output shaft
+        """
+
+        self.target_phase = phase
+        self._settled.clear()
+
+    def wait_settled(self, timeout=2.0, cancel=None):
+        """Wait until the phase difference is within the tolerance of its target
+
+        Args:
+            timeout (float, optional): Timeout in seconds. Defaults to 2.
+            cancel (threading.Event, optional): Stop waiting when it is set
+
+        Returns:
+            bool: True if settled, False on timeout or cancel
+        """
+
+        deadline = time.monotonic() + timeout
+        while not self._settled.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (cancel is not None and cancel.is_set()):
+                return False
+            self._settled.wait(min(remaining, 0.02))
+        return True
+
+    def start(self):
+        """Start the control loop"""
+
+        self._settled.clear()
+        self.loop.start()
+
+    def stop(self):
+        """Stop the control loop, the motors keep their last speed command"""
+
+        self.loop.stop()
+        self._commanding = False
+
+    def _step(self, loop):
+        with loop.bus_io():
+            angles = self.motors.read_multi_turn_angle()
+        if None in angles:
+            return
+        front, rear = (motor.state() for motor in self.motors)
+        self.phase = front.angle + rear.angle
+        error = self.target_phase - self.phase
+        settled = abs(error) <= self.tolerance
+        if settled:
+            self._settled.set()
+        else:
+            self._settled.clear()
+        self.correction = max(-self.max_correction, min(self.max_correction, self.gain * error))
+
+        # Leave the motors alone while there is nothing to do, e.g. holding a
+        # position after the initialization
+        if not self._commanding and self.speed == 0 and settled:
+            return
+        self._commanding = True
+        front_speed = self.speed
+        rear_speed = -self.speed + self.correction
+        with loop.bus_io():
+            self.motors.speed_loop_control(
+                iq_control=self.iq_control,
+                speed_control=[
+                    int(front_speed * self.gear_ratio * 100),
+                    int(rear_speed * self.gear_ratio * 100),
+                ],
+            )
@@ -0,0 +1,182 @@
+import functools
+import time
+from pylkmotor.LKMotor import MotorGroup
+from sequence import Sequence, Step
+
+GEAR_RATIO = 36
+
+
+def _wait_for(read, predicate, timeout, cancel, poll_hz=50.0):
+    """Call `read` until `predicate` holds on its result, at most `poll_hz` times per second"""
+
+    deadline = time.monotonic() + timeout
+    while not cancel.is_set():
+        if predicate(read()):
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        cancel.wait(min(1.0 / poll_hz, remaining))
+    return False
+
+
+def motor_startup_sequence(motor_Front, motor_Rear, telemetry_hz=50):
+    """Check the communication, restart both motors and start their telemetry
+
+    Args:
+        motor_Front (LKMotor): Front motor
+        motor_Rear (LKMotor): Rear motor
+        telemetry_hz (float, optional): Rate of the status 2 telemetry, None
+            for no telemetry. Defaults to 50.
+
+    Returns:
+        Sequence: The startup procedure
+    """
+
+    motors = MotorGroup([motor_Front, motor_Rear])
+
+    def start_telemetry():
+        for motor in motors:
+            motor.start_telemetry(rate_hz=telemetry_hz, fields=("status_2",))
+
+    stages = [
+        Step(
+            "Test motor communication",
+            until=lambda timeout, cancel: motors.wait_until(
+                lambda statuses: True, timeout, field="status_1", cancel=cancel
+            ),
+            timeout=1.0,
+        ),
+        Step("Shut down both motors", motors.motor_shutdown),
+        Step("Run both motors", motors.motor_run),
+    ]
+    if telemetry_hz:
+        stages.append(Step("Start telemetry", start_telemetry))
+    return Sequence(stages)
+
+
+def zero_position_sequence(motor_Front, motor_Rear, max_speed=90, tolerance=0.5, gear_ratio=GEAR_RATIO):
+    """Set the current positions as 0 and hold both motors there
+
+    Args:
+        motor_Front (LKMotor): Front motor
+        motor_Rear (LKMotor): Rear motor
+        max_speed (float, optional): Speed limit in degree/s at the output shaft. Defaults to 90.
+        tolerance (float, optional): Angle error in degrees at the output shaft
+            that confirms a position. Defaults to 0.5.
+        gear_ratio (int, optional): Gear ratio. Defaults to 36.
+
+    Returns:
+        Sequence: The procedure, the moves of both motors run in parallel
+    """
+
+    motors = MotorGroup([motor_Front, motor_Rear])
+    limit = tolerance * gear_ratio * 100
+
+    def at_zero(motor):
+        return lambda timeout, cancel: _wait_for(motor.read_multi_turn_angle, lambda angle: abs(angle) <= limit, timeout, cancel)
+
+    def hold_zero(motor):
+        return lambda: motor.multi_turn_position_control(angle_control=0, max_speed=int(max_speed * gear_ratio))
+
+    return Sequence(
+        [
+            Step(
+                "Set the current position to 0",
+                lambda: motors.set_position_to_angle(0),
+                lambda timeout, cancel: _wait_for(
+                    motors.read_multi_turn_angle,
+                    lambda angles: None not in angles and all(abs(angle) <= limit for angle in angles),
+                    timeout,
+                    cancel,
+                ),
+                timeout=1.0,
+            ),
+            (
+                Step("Move Front Motor to 0 degree", hold_zero(motor_Front), at_zero(motor_Front), 2.0),
+                Step("Move Rear Motor to 0 degree", hold_zero(motor_Rear), at_zero(motor_Rear), 2.0),
+            ),
+        ],
+        on_failure=motors.motor_stop,
+    )
+
+
+def shutdown_sequence(motor_Front, motor_Rear, max_speed=90, timeout=10.0, tolerance=0.5, gear_ratio=GEAR_RATIO):
+    """Return both motors to the middle of their single-turn range and shut them down
+
+    Each motor returns to single-turn angle 0 the shorter way, so a motor
+    near one hard stop does not travel round the turn into the other one.
+    A motor that does not reply with its angle is not moved, and its return
+    fails on the timeout.
+
+    Args:
+        motor_Front (LKMotor): Front motor
+        motor_Rear (LKMotor): Rear motor
+        max_speed (float, optional): Speed limit in degree/s at the output shaft. Defaults to 90.
+        timeout (float, optional): Timeout of the return in seconds. Defaults to 10.
+        tolerance (float, optional): Angle error in degrees at the motor that
+            confirms the middle position. Defaults to 0.5.
+        gear_ratio (int, optional): Gear ratio. Defaults to 36.
+
+    Returns:
+        Sequence: The procedure, the returns of both motors run in parallel.
+            The motors are shut down even if a return times out or raises.
+    """
+
+    motors = MotorGroup([motor_Front, motor_Rear])
+    limit = tolerance * 100
+    # The single-turn angle of the motor covers one turn of the output shaft
+    full_turn = 36000 * gear_ratio
+
+    def at_single_turn_zero(angle):
+        if angle is None:
+            return False
+        angle %= full_turn
+        return min(angle, full_turn - angle) <= limit
+
+    def in_middle(motor):
+        def wait(timeout, cancel):
+            deadline = time.monotonic() + timeout
+            # A motor that does not reply is never in the middle, the step times out
+            read_angle = functools.partial(motor.read_single_turn_angle, fresh=True)
+            if not _wait_for(read_angle, at_single_turn_zero, timeout, cancel):
+                return False
+            return MotorGroup([motor]).wait_until_stopped(max(deadline - time.monotonic(), 0), cancel=cancel)
+
+        return wait
+
+    def return_to_middle(motor):
+        def move():
+            angle = motor.read_single_turn_angle(fresh=True)
+            if angle is None:
+                # Without its angle the shorter way is unknown, leave the motor where it is
+                return
+            # The shorter way: clockwise (increasing) from the upper half of the turn
+            spin_direction = 0x00 if angle % full_turn >= full_turn / 2 else 0x01
+            motor.single_turn_position_control(
+                spin_direction=spin_direction, angle_control=0, max_speed=int(max_speed * gear_ratio)
+            )
+
+        return move
+
+    def shut_down():
+        motors.motor_stop()
+        motors.motor_shutdown()
+
+    return Sequence(
+        [
+            Step(
+                "Stop both motors",
+                motors.motor_stop,
+                lambda timeout, cancel: motors.wait_until_stopped(timeout, cancel=cancel),
+                timeout=2.0,
+                required=False,
+            ),
+            (
+                Step("Return Front Motor to the middle", return_to_middle(motor_Front), in_middle(motor_Front), timeout, required=False),
+                Step("Return Rear Motor to the middle", return_to_middle(motor_Rear), in_middle(motor_Rear), timeout, required=False),
+            ),
+            Step("Shut down both motors", shut_down),
+        ],
+        on_failure=shut_down,
+    )
@@ -0,0 +1,227 @@
+# Replay a recorded CAN session through LKMotor, and check the commands against the recording.
+#   motor = LKMotor(ReplayBus, "runs/swim-01", motor_id=2, mode="fast")
+
+import can
+import threading
+import time
+import numpy as np
+from frame_recorder import FLAG_ERROR, FLAG_EXTENDED, FLAG_REMOTE, FrameRecording
+
+MODES = ("realtime", "fast", "step")
+
+
+class ReplayBus(can.BusABC):
+    """A CAN bus that answers with the replies of a `FrameRecording`
+
+    It plugs in where `can.interface.Bus` does: pass the class as the bus
+    interface and the recording directory as the channel, e.g.
+    `LKMotor(ReplayBus, "runs/swim-01", 2, mode="fast")`, and the motors on
+    that channel share it like a real bus.
+
+    The recorded replies are delivered in the recorded order, each one only
+    after the application has sent the commands recorded before it, so the
+    parsing and the controller logic see the same replies in the same order
+    as in the recorded run. The modes set when a reply is delivered:
+    - "realtime": with its recorded delay after the command before it,
+      divided by `speed`
+    - "fast": as soon as the commands before it are sent
+    - "step": as soon as the commands before it are sent and `step()` has
+      released it
+
+    Every sent frame is matched with the next recorded command. The
+    differences ("changed", "missing", "extra") are collected in
+    `differences`, and `check()` adds the recorded commands never sent.
+    """
+
+    def __init__(self, channel, mode="realtime", speed=1.0, lookahead=8, can_filters=None, **kwargs):
+        """Open a recording for replay
+
+        Args:
+            channel (str): Directory of the recording
+            mode (str, optional): "realtime", "fast" or "step". Defaults to "realtime".
+            speed (float, optional): Time scale of the realtime mode, 2 replays
+                twice as fast. Defaults to 1.
+            lookahead (int, optional): Recorded commands searched for a sent
+                frame; the skipped ones count as missing. Defaults to 8.
+            can_filters (list, optional): Receive filters
+            **kwargs: Additional arguments of the bus, ignored
+        """
+
+        if mode not in MODES:
+            raise ValueError(f"Unknown replay mode {mode!r}, expected one of {MODES}")
+        self.recording = FrameRecording(channel)
+        self.channel_info = f"replay {channel}"
+        self.mode = mode
+        self.speed = speed
+        self.lookahead = lookahead
+        recording = self.recording
+        is_reply = recording.is_reply
+        self._rx = np.flatnonzero(is_reply)
+        self._tx = np.flatnonzero(~is_reply)
+        # Index in _tx of the last recorded command before each reply, -1 for none
+        self._rx_anchor = np.searchsorted(self._tx, self._rx) - 1
+        self._tx_sent_at = np.full(len(self._tx), np.nan)
+        self._rx_cursor = 0
+        self._tx_cursor = 0
+        self._credits = 0
+        self._start = time.monotonic()
+        self._condition = threading.Condition()
+        self.sent = []
+        self.differences = []
+        self.finished = threading.Event()
+        if not len(self._rx):
+            self.finished.set()
+        super().__init__(channel=channel, can_filters=can_filters, **kwargs)
+
+    @property
+    def replies_delivered(self):
+        """Recorded replies delivered so far"""
+
+        return self._rx_cursor
+
+    @property
+    def commands_matched(self):
+        """Recorded commands sent or skipped so far"""
+
+        return self._tx_cursor
+
+    def step(self, count=1):
+        """Release the next replies in step mode
+
+        Args:
+            count (int, optional): Replies to release. Defaults to 1.
+        """
+
+        with self._condition:
+            self._credits += count
+            self._condition.notify_all()
+
+    def _expected(self, tx_position):
+        index = self._tx[tx_position]
+        dlc = int(self.recording.dlc[index])
+        return int(self.recording.arbitration_id[index]), bytes(self.recording.data[index, :dlc])
+
+    def _difference(self, kind, tx_position, actual=None):
+        entry = {"kind": kind, "index": None, "time": None, "expected": None, "actual": None}
+        if tx_position is not None:
+            arbitration_id, data = self._expected(tx_position)
+            entry["index"] = int(self._tx[tx_position])
+            entry["time"] = float(self.recording.time[self._tx[tx_position]] - self.recording.time[0])
+            entry["expected"] = f"{arbitration_id:03X}#{data.hex().upper()}"
+        if actual is not None:
+            entry["actual"] = f"{actual[0]:03X}#{actual[1].hex().upper()}"
+        return entry
+
+    def send(self, msg, timeout=None):
+        """Match a sent frame with the next recorded command
+
+        An exact match is searched in the next `lookahead` recorded commands,
+        the ones skipped count as missing. Otherwise a frame with the
+        arbitration ID and command byte of the next recorded command is
+        "changed" and takes its place, and any other frame is "extra".
+        """
+
+        actual = (msg.arbitration_id, bytes(msg.data[: msg.dlc]))
+        with self._condition:
+            now = time.monotonic()
+            self.sent.append((now,) + actual)
+            position = self._tx_cursor
+            match = None
+            for candidate in range(position, min(position + self.lookahead, len(self._tx))):
+                if self._expected(candidate) == actual:
+                    match = candidate
+                    break
+            if match is None and position < len(self._tx):
+                arbitration_id, data = self._expected(position)
+                if arbitration_id == actual[0] and data[:1] == actual[1][:1]:
+                    self.differences.append(self._difference("changed", position, actual))
+                    match = position
+            if match is None:
+                self.differences.append(self._difference("extra", None, actual))
+                return
+            for skipped in range(position, match):
+                self.differences.append(self._difference("missing", skipped))
+            self._tx_sent_at[position : match + 1] = now
+            self._tx_cursor = match + 1
+            self._condition.notify_all()
+
+    def _recv_internal(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        recording = self.recording
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = None if deadline is None else deadline - now
+                if self._rx_cursor < len(self._rx):
+                    index = self._rx[self._rx_cursor]
+                    anchor = self._rx_anchor[self._rx_cursor]
+                    # The commands recorded before the reply must be sent first
+                    released = anchor < self._tx_cursor and (self.mode != "step" or self._credits > 0)
+                    if released:
+                        due = now
+                        if self.mode == "realtime":
+                            if anchor < 0:
+                                due = self._start + (recording.time[index] - recording.time[0]) / self.speed
+                            else:
+                                due = self._tx_sent_at[anchor] + (
+                                    recording.time[index] - recording.time[self._tx[anchor]]
+                                ) / self.speed
+                        if due <= now:
+                            return self._deliver(index), False
+                        wait = due - now if wait is None else min(wait, due - now)
+                if wait is not None and wait <= 0:
+                    return None, False
+                self._condition.wait(wait)
+
+    def _deliver(self, index):
+        recording = self.recording
+        flags = int(recording.flags[index])
+        dlc = int(recording.dlc[index])
+        self._rx_cursor += 1
+        if self.mode == "step":
+            self._credits -= 1
+        if self._rx_cursor == len(self._rx):
+            self.finished.set()
+        return can.Message(
+            timestamp=float(recording.time[index]),
+            arbitration_id=int(recording.arbitration_id[index]),
+            is_extended_id=bool(flags & FLAG_EXTENDED),
+            is_remote_frame=bool(flags & FLAG_REMOTE),
+            is_error_frame=bool(flags & FLAG_ERROR),
+            dlc=dlc,
+            data=bytes(recording.data[index, :dlc]),
+            channel=self.channel_info,
+            is_rx=True,
+        )
+
+    def check(self):
+        """Differences between the recorded and the sent commands
+
+        Returns:
+            list: One dict per difference with `kind` ("changed", "missing" or
+                "extra"), `index` (frame index in the recording), `time`
+                (seconds into the recording) and `expected` and `actual`
+                frames as "ID#DATA", None where there is none
+        """
+
+        with self._condition:
+            return self.differences + [
+                self._difference("missing", position) for position in range(self._tx_cursor, len(self._tx))
+            ]
+
+    def shutdown(self):
+        with self._condition:
+            self._condition.notify_all()
+        super().shutdown()
+
+
+def format_differences(differences, limit=20):
+    """One line per difference, for printing the result of `ReplayBus.check()`"""
+
+    lines = [f"{len(differences)} differences"]
+    for entry in differences[:limit]:
+        where = "" if entry["time"] is None else f" at {entry['time']:.3f} s (frame {entry['index']})"
+        lines.append(f"  {entry['kind']}{where}: expected {entry['expected']}, sent {entry['actual']}")
+    if len(differences) > limit:
+        lines.append(f"  ... {len(differences) - limit} more")
+    return "\n".join(lines)
@@ -0,0 +1,152 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Step:
+    """One step of a `Sequence`: a command, a wait for a condition, or both
+
+    The action runs first, then `until` is called as until(timeout, cancel)
+    and must return True once its condition holds, e.g.
+    `lambda timeout, cancel: motors.wait_until_stopped(timeout, cancel=cancel)`.
+    A step without `until` is done when its action returns.
+    """
+
+    def __init__(self, name, action=None, until=None, timeout=5.0, prompt=None, required=True):
+        """Describe the step
+
+        Args:
+            name (str): Name printed when the step finishes or fails
+            action (callable, optional): Called without arguments
+            until (callable, optional): Called as until(timeout, cancel),
+                returns True when the condition holds
+            timeout (float, optional): Timeout of `until` in seconds. Defaults to 5.
+            prompt (str, optional): Asked with input() before the step, unless
+                the sequence runs unattended
+            required (bool, optional): A failure stops the sequence. Defaults to True.
+        """
+
+        self.name = name
+        self.action = action
+        self.until = until
+        self.timeout = timeout
+        self.prompt = prompt
+        self.required = required
+
+    def run(self, cancel):
+        """Run the step
+
+        Returns:
+            bool: True if the step finished, False on timeout or cancel
+        """
+
+        if cancel.is_set():
+            return False
+        if self.action is not None:
+            self.action()
+        if self.until is None:
+            return True
+        return bool(self.until(self.timeout, cancel))
+
+
+class Sequence:
+    """Runs a declarative procedure of steps, with parallel stages
+
+    The procedure is a list of stages. A stage is a `Step`, or a list or
+    tuple of steps that do not depend on each other, e.g. the same move of
+    different motors. The steps of a stage run in parallel threads and the
+    next stage starts when all of them are done, so a stage takes as long as
+    its slowest step. When a required step fails, the stage is finished and
+    the sequence stops, after calling `on_failure`. When a step raises,
+    `on_failure` is called too and the exception is raised again.
+
+    Example:
+        startup = Sequence(
+            [
+                Step("Motor run", motors.motor_run),
+                (
+                    Step("Front to 0", lambda: front.multi_turn_position_control(0, 900), front_at_zero, 10),
+                    Step("Rear to 0", lambda: rear.multi_turn_position_control(0, 900), rear_at_zero, 10),
+                ),
+            ],
+            on_failure=motors.motor_stop,
+        )
+        if not startup.run(unattended=True):
+            ...
+    """
+
+    def __init__(self, stages, on_failure=None):
+        """Describe the procedure
+
+        Args:
+            stages (list): `Step`s, or lists or tuples of steps that run in parallel
+            on_failure (callable, optional): Called without arguments when a
+                required step fails or raises, or the sequence is cancelled
+        """
+
+        self.stages = [tuple(stage) if isinstance(stage, (list, tuple)) else (stage,) for stage in stages]
+        self.on_failure = on_failure
+        self.durations = {}
+        self.failed = []
+
+    def run(self, unattended=False, cancel=None):
+        """Run the stages in order
+
+        Args:
+            unattended (bool, optional): Skip the prompts. Defaults to False.
+            cancel (threading.Event, optional): Stop the sequence when it is set
+
+        Returns:
+            bool: True if every required step finished
+        """
+
+        cancel = cancel if cancel is not None else threading.Event()
+        self.durations = {}
+        self.failed = []
+        try:
+            finished = self._run_stages(unattended, cancel)
+        except BaseException:
+            # A step raised, e.g. a bus error or Ctrl+C: clean up before passing it on
+            if self.on_failure is not None:
+                self.on_failure()
+            raise
+        if not finished and self.on_failure is not None:
+            self.on_failure()
+        return finished
+
+    def _run_stages(self, unattended, cancel):
+        width = max(map(len, self.stages))
+        with ThreadPoolExecutor(width, thread_name_prefix="sequence") as executor:
+            for stage in self.stages:
+                if not unattended:
+                    for step in stage:
+                        if step.prompt is not None:
+                            input(step.prompt)
+                if len(stage) == 1:
+                    results = [self._run_step(stage[0], cancel)]
+                else:
+                    results = list(executor.map(lambda step: self._run_step(step, cancel), stage))
+                if cancel.is_set() or not all(
+                    finished or not step.required for step, finished in zip(stage, results)
+                ):
+                    return False
+        return True
+
+    def _run_step(self, step, cancel):
+        start_time = time.monotonic()
+        try:
+            finished = step.run(cancel)
+        except Exception as e:
+            self.failed.append(step.name)
+            print(f"{step.name} Failed: {e!r}")
+            raise
+        finally:
+            self.durations[step.name] = time.monotonic() - start_time
+        if finished:
+            print(f"{step.name} Finished")
+        elif cancel.is_set():
+            print(f"{step.name} Cancelled!")
+        else:
+            self.failed.append(step.name)
+            print(f"{step.name} Time Out!")
+        return finished